@@ -1,21 +1,62 @@
+from startup import configure_logging, initialize, report_startup  # first, so STARTUP_PROFILE sees every import
 import logging
+from functools import partial
+
+import click
 from flask import Flask, jsonify
+from flask.cli import with_appcontext
 from db import db
 from routes import customers_bp
-import os
+from idempotency import init_idempotency
+from routing import init_replica
+from cache import init_cache
+from credentials import init_credentials
+from ratelimit import init_rate_limiting
+from http_cache import init_http_cache
+from query_profiler import init_query_profiler
+from sampling_profiler import init_sampling_profiler
+from serialization import init_serialization
+from consumers import init_consumers
+from wallet import init_wallet
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create the tables. Run once per deploy, not in every worker."""
+    db.create_all()
+    logging.info("Database tables initialized.")
+    click.echo("Database initialized.")
+
 
 def create_app():
+    configure_logging('customers_service.log')
     app = Flask(__name__)
 
     # Database configuration
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///customers.db'
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-    # Initialize SQLAlchemy
-    db.init_app(app)
+    # Initialize SQLAlchemy (read-only routes use the replica bind when one is configured)
+    initialize(
+        app,
+        init_replica,
+        db.init_app,
+        init_query_profiler,
+        partial(init_sampling_profiler, url_prefix='/api/v1'),
+        init_idempotency,
+        init_cache,
+        init_credentials,
+        init_wallet,
+        init_rate_limiting,
+        partial(init_http_cache, db=db),
+        init_serialization,
+        init_consumers,
+    )
 
     # Register blueprints
     app.register_blueprint(customers_bp, url_prefix='/api/v1')
+    app.cli.add_command(init_db_command)
 
     # Health check route
     @app.route('/health', methods=['GET'])
@@ -39,23 +80,10 @@ def create_app():
         logging.warning(f"400 error: {error}")
         return jsonify({"error": "Bad request"}), 400
 
+    report_startup(app)
     return app
 
 
 if __name__ == '__main__':
-
-    log_file_path = os.path.join(os.getcwd(), 'customers_service.log')
-    logging.basicConfig(
-    filename=log_file_path,
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
-    print(f"Logging to: {log_file_path}")
     app = create_app()
-
-    # Create tables within the app context
-    with app.app_context():
-        db.create_all()
-        logging.info("Database tables initialized.")
-
     app.run(host='0.0.0.0', port=5001)
@@ -0,0 +1,33 @@
+import logging
+
+from db import db
+from events import SALE_COMPLETED, SALE_FAILED, init_events
+from models import PurchaseLedgerEntry
+
+ENTRY_TYPES = {SALE_COMPLETED: 'purchase', SALE_FAILED: 'sale_failed'}
+
+
+def record_sale_outcome(event):
+    """Append the sale to its customer's purchase ledger, once per event even when it is redelivered."""
+    if PurchaseLedgerEntry.query.filter_by(reference=event.key).first() is not None:
+        return
+    sale = event.payload
+    db.session.add(PurchaseLedgerEntry(
+        customer_username=sale['customer_username'],
+        sale_id=sale['sale_id'],
+        entry_type=ENTRY_TYPES[event.topic],
+        item_name=sale['item_name'],
+        quantity=sale['quantity'],
+        amount=sale['total_price'] if event.topic == SALE_COMPLETED else None,
+        note=sale.get('error'),
+        reference=event.key
+    ))
+    db.session.commit()
+    logging.info(f"Ledger entry recorded for sale {sale['sale_id']} of customer: {sale['customer_username']}")
+
+
+def init_consumers(app):
+    return init_events(app, group='customers', handlers={
+        SALE_COMPLETED: record_sale_outcome,
+        SALE_FAILED: record_sale_outcome,
+    })
@@ -0,0 +1,153 @@
+import base64
+import hashlib
+import hmac
+import logging
+import multiprocessing
+import os
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+from cache import get_cache
+
+SCHEME = 'scrypt'
+TOKEN_SALT = 'customer-auth'
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _derive(password, salt, n, r, p):
+    # Module-level so it can run in a worker process.
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r + 1024 * 1024, dklen=32)
+
+
+def _run(password, salt, n, r, p):
+    """Run the KDF in the process pool, or inline when PASSWORD_HASH_WORKERS is 0.
+
+    The KDF is pure CPU; in a pool it runs outside the worker's GIL, and the request
+    thread only waits on the result.
+    """
+    global _pool
+    workers = current_app.config['PASSWORD_HASH_WORKERS']
+    if workers <= 0:
+        return _derive(password, salt, n, r, p)
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn, not fork: forking a multi-threaded server can deadlock the child.
+                _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    return _pool.submit(_derive, password, salt, n, r, p).result()
+
+
+def _params():
+    config = current_app.config
+    return config['PASSWORD_SCRYPT_N'], config['PASSWORD_SCRYPT_R'], config['PASSWORD_SCRYPT_P']
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def hash_password(password):
+    """Return ``scrypt$n$r$p$salt$hash`` for ``password`` using the configured parameters."""
+    n, r, p = _params()
+    salt = secrets.token_bytes(16)
+    return f'{SCHEME}${n}${r}${p}${_b64(salt)}${_b64(_run(password, salt, n, r, p))}'
+
+
+def _parse(stored):
+    scheme, n, r, p, salt, digest = stored.split('$')
+    if scheme != SCHEME:
+        raise ValueError(f"Unknown password scheme: {scheme}")
+    return int(n), int(r), int(p), base64.b64decode(salt), base64.b64decode(digest)
+
+
+def is_hashed(stored):
+    return stored.startswith(f'{SCHEME}$')
+
+
+def needs_rehash(stored):
+    """True for legacy plaintext passwords and for hashes made with other parameters."""
+    return not is_hashed(stored) or _parse(stored)[:3] != _params()
+
+
+def verify_password(password, stored):
+    if not is_hashed(stored):
+        # Rows written before hashing existed hold the plaintext; login rehashes them.
+        return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+    n, r, p, salt, digest = _parse(stored)
+    return hmac.compare_digest(_run(password, salt, n, r, p), digest)
+
+
+def burn_verification(password):
+    """Spend the same work as a real check, so unknown usernames cannot be told apart by timing."""
+    n, r, p = _params()
+    _run(password, b'\0' * 16, n, r, p)
+
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt=TOKEN_SALT)
+
+
+def password_fingerprint(stored):
+    # Binds tokens to the current password: changing it invalidates every token issued before.
+    return hashlib.sha256(stored.encode('utf-8')).hexdigest()[:16]
+
+
+def issue_token(customer):
+    return _serializer().dumps({'username': customer.username, 'pwd': password_fingerprint(customer.password)})
+
+
+def verify_token(token, load_password):
+    """Return the username ``token`` was issued to, or None if it is invalid, expired or revoked.
+
+    Valid results are cached for ``AUTH_TOKEN_CACHE_TTL`` seconds, so repeated requests
+    with the same token skip the signature check and the database lookup.
+    ``load_password(username)`` returns the stored password hash, or None.
+    """
+    max_age = current_app.config['AUTH_TOKEN_MAX_AGE']
+
+    def check():
+        try:
+            payload = _serializer().loads(token, max_age=max_age)
+        except (BadSignature, SignatureExpired):
+            return None
+        stored = load_password(payload.get('username'))
+        if stored is None or not hmac.compare_digest(password_fingerprint(stored), payload.get('pwd', '')):
+            return None
+        return payload['username']
+
+    key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+    return get_cache().get_or_load('auth-tokens', key, check, ttl=current_app.config['AUTH_TOKEN_CACHE_TTL'])
+
+
+def revoke_tokens_on_commit(session):
+    """Drop every cached token verification once ``session`` commits (password change, deletion)."""
+    get_cache().invalidate_on_commit(session, 'auth-tokens')
+
+
+def init_credentials(app):
+    """Tokens are signed with ``SECRET_KEY``, which every worker must share.
+
+    Without one, only a test app that does not share its cache (``TESTING``, or the
+    ``TESTING=1`` environment variable, and no ``CACHE_URL``) gets a random per-process key.
+    """
+    if not app.config.get('SECRET_KEY'):
+        app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
+    if not app.config['SECRET_KEY']:
+        testing = app.config.get('TESTING') or os.getenv('TESTING', '0') == '1'
+        if app.config.get('CACHE_URL') or not testing:
+            raise RuntimeError("SECRET_KEY must be set: every worker signs and verifies auth tokens with it.")
+        logging.warning("SECRET_KEY is not set; auth tokens will only be valid in this test process.")
+        app.config['SECRET_KEY'] = secrets.token_hex(32)
+    app.config.setdefault('PASSWORD_SCRYPT_N', int(os.getenv('PASSWORD_SCRYPT_N', str(2 ** 14))))
+    app.config.setdefault('PASSWORD_SCRYPT_R', int(os.getenv('PASSWORD_SCRYPT_R', '8')))
+    app.config.setdefault('PASSWORD_SCRYPT_P', int(os.getenv('PASSWORD_SCRYPT_P', '1')))
+    app.config.setdefault('PASSWORD_HASH_WORKERS', int(os.getenv('PASSWORD_HASH_WORKERS', '2')))
+    app.config.setdefault('AUTH_TOKEN_MAX_AGE', int(os.getenv('AUTH_TOKEN_MAX_AGE', '3600')))
+    app.config.setdefault('AUTH_TOKEN_CACHE_TTL', float(os.getenv('AUTH_TOKEN_CACHE_TTL', '60')))
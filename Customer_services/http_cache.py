@@ -0,0 +1,189 @@
+import gzip
+import hashlib
+import logging
+import os
+from datetime import datetime, timezone
+from functools import wraps
+from itertools import chain
+
+from flask import current_app, make_response, request
+from sqlalchemy import Column, DateTime, Integer, String, Table, event, insert, select, update
+
+from routing import RoutingSession
+
+try:
+    import brotli
+except ImportError:  # optional: gzip is always available
+    brotli = None
+
+CHANGED_TABLES = 'http_cache_changed_tables'
+COMPRESSIBLE_TYPES = ('application/json', 'application/msgpack', 'application/x-msgpack', 'text/')
+
+# Tables some conditional route depends on; only these get a version counter.
+_tracked_tables = set()
+_versions = None
+
+
+def _versions_table(metadata):
+    if 'table_versions' in metadata.tables:
+        return metadata.tables['table_versions']
+    return Table(
+        'table_versions', metadata,
+        Column('table_name', String(100), primary_key=True),
+        Column('version', Integer, nullable=False, default=0),
+        Column('updated_at', DateTime, nullable=False),
+    )
+
+
+def _bump(connection, tables):
+    now = datetime.utcnow()
+    for table in sorted(tables):
+        result = connection.execute(
+            update(_versions).where(_versions.c.table_name == table)
+            .values(version=_versions.c.version + 1, updated_at=now)
+        )
+        if result.rowcount == 0:
+            connection.execute(insert(_versions).values(table_name=table, version=1, updated_at=now))
+
+
+def touch(session, *tables):
+    """Bump the version of ``tables`` once ``session`` commits, for writes made outside it."""
+    if _versions is not None:
+        session.info.setdefault(CHANGED_TABLES, set()).update(t for t in tables if t in _tracked_tables)
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def _collect_changed_tables(session, flush_context, instances):
+    if _versions is None:
+        return
+    changed = session.info.setdefault(CHANGED_TABLES, set())
+    for obj in chain(session.new, session.dirty, session.deleted):
+        table = getattr(obj, '__tablename__', None)
+        if table in _tracked_tables and (obj not in session.dirty or session.is_modified(obj)):
+            changed.add(table)
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _collect_bulk_statements(orm_execute_state):
+    # Bulk INSERT/UPDATE/DELETE statements skip the flush, so they are counted here.
+    if _versions is None or not (orm_execute_state.is_insert or orm_execute_state.is_update
+                                 or orm_execute_state.is_delete):
+        return
+    table = getattr(orm_execute_state.statement, 'table', None)
+    if table is not None and table.name in _tracked_tables:
+        orm_execute_state.session.info.setdefault(CHANGED_TABLES, set()).add(table.name)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _bump_committed_tables(session):
+    # Bumped in a short transaction of its own after the write committed, so writers never
+    # queue on a version row while holding their own locks.
+    changed = session.info.pop(CHANGED_TABLES, None)
+    if not changed:
+        return
+    try:
+        with session._db.engine.begin() as connection:
+            _bump(connection, changed)
+    except Exception as e:
+        logging.error(f"Bumping the versions of {', '.join(sorted(changed))} failed: {str(e)}")
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_changed_tables(session):
+    session.info.pop(CHANGED_TABLES, None)
+
+
+def _validators(tables, fingerprint=''):
+    rows = current_app.extensions['sqlalchemy'].session.execute(
+        select(_versions.c.table_name, _versions.c.version, _versions.c.updated_at)
+        .where(_versions.c.table_name.in_(tables))
+    ).all()
+    versions = {row.table_name: row.version for row in rows}
+    tag = '-'.join(f'{versions.get(table, 0)}' for table in tables)
+    digest = hashlib.sha1(f'{request.full_path}|{tag}|{fingerprint}'.encode('utf-8')).hexdigest()[:20]
+    updated = [row.updated_at for row in rows]
+    last_modified = max(updated).replace(microsecond=0, tzinfo=timezone.utc) if updated else None
+    return digest, last_modified
+
+
+def conditional(*tables, max_age=0, fingerprint=None):
+    """Add ``ETag``/``Last-Modified`` derived from the version counters of ``tables``.
+
+    A request whose ``If-None-Match`` or ``If-Modified-Since`` still matches is answered
+    with 304 before the view runs, so revalidation costs one small query. ``Last-Modified``
+    only has whole seconds, so a date equal to it may predate a later write in that same
+    second and is answered in full.
+
+    ``fingerprint(**view_args)`` adds data without a table-wide counter to the ETag, such as
+    the latest row id of one customer, so writes to that table bump no shared row. Such
+    responses carry no ``Last-Modified``: it could not tell when that data changed.
+    """
+    _tracked_tables.update(tables)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if _versions is None:
+                return view(*args, **kwargs)
+            etag, last_modified = _validators(tables, fingerprint(**kwargs) if fingerprint else '')
+            if fingerprint:
+                last_modified = None
+            cache_control = f'private, max-age={max_age}, must-revalidate' if max_age else 'no-cache'
+
+            not_modified = (request.if_none_match.contains_weak(etag) if request.if_none_match
+                            else last_modified is not None and request.if_modified_since is not None
+                            and last_modified < request.if_modified_since)
+            response = make_response(('', 304) if not_modified else view(*args, **kwargs))
+            if response.status_code in (200, 304):
+                response.set_etag(etag, weak=True)
+                if last_modified is not None:
+                    response.last_modified = last_modified
+                response.headers['Cache-Control'] = cache_control
+            return response
+        return wrapper
+    return decorator
+
+
+def _choose_encoding():
+    encodings = request.accept_encodings
+    if brotli is not None and encodings['br']:
+        return 'br'
+    if encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress_response(response):
+    config = current_app.config
+    if (not config['COMPRESS_RESPONSES'] or response.direct_passthrough or response.is_streamed
+            or not 200 <= response.status_code < 300 or response.status_code == 204
+            or 'Content-Encoding' in response.headers
+            or not (response.mimetype or '').startswith(COMPRESSIBLE_TYPES)):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    encoding = _choose_encoding()
+    if encoding is None or len(data) < config['COMPRESS_MIN_SIZE']:
+        return response
+
+    if encoding == 'br':
+        data = brotli.compress(data, quality=config['COMPRESS_BROTLI_QUALITY'])
+    else:
+        data = gzip.compress(data, compresslevel=config['COMPRESS_LEVEL'])
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_http_cache(app, db):
+    """Negotiated response compression plus the version counters behind ``@conditional``."""
+    global _versions
+    app.config.setdefault('COMPRESS_RESPONSES', os.getenv('COMPRESS_RESPONSES', '1') == '1')
+    app.config.setdefault('COMPRESS_MIN_SIZE', int(os.getenv('COMPRESS_MIN_SIZE', '1024')))
+    app.config.setdefault('COMPRESS_LEVEL', int(os.getenv('COMPRESS_LEVEL', '6')))
+    app.config.setdefault('COMPRESS_BROTLI_QUALITY', int(os.getenv('COMPRESS_BROTLI_QUALITY', '5')))
+
+    _versions = _versions_table(db.metadata)
+    app.after_request(compress_response)
+    app.extensions['http_cache'] = _versions
@@ -0,0 +1,186 @@
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import wraps
+
+import click
+from flask import current_app, make_response, request
+from sqlalchemy.exc import IntegrityError
+
+from db import db
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+_sweep_lock = threading.Lock()
+_last_sweep = datetime.min
+
+
+class IdempotencyRecord(db.Model):
+    """Response stored for an ``Idempotency-Key``; ``status_code`` is NULL while the request is running.
+
+    The body is kept as raw bytes with its mimetype, so non-JSON (msgpack) responses replay as sent.
+    """
+    __tablename__ = 'idempotency_keys'
+
+    key = db.Column(db.String(512), primary_key=True)
+    request_hash = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer)
+    response_body = db.Column(db.LargeBinary)
+    response_mimetype = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+def purge_expired_keys(now=None):
+    """Delete expired records (an index range scan on ``expires_at``). Returns the number removed."""
+    deleted = IdempotencyRecord.query.filter(
+        IdempotencyRecord.expires_at <= (now or datetime.utcnow())
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def _maybe_sweep(now):
+    global _last_sweep
+    interval = timedelta(seconds=current_app.config['IDEMPOTENCY_SWEEP_INTERVAL_SECONDS'])
+    if now - _last_sweep < interval or not _sweep_lock.acquire(blocking=False):
+        return
+    try:
+        _last_sweep = now
+        deleted = purge_expired_keys(now)
+        if deleted:
+            logging.info(f"Purged {deleted} expired idempotency keys.")
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error while purging idempotency keys: {str(e)}")
+    finally:
+        _sweep_lock.release()
+
+
+def _request_fingerprint():
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.path.encode())
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def _forget(scoped_key):
+    IdempotencyRecord.query.filter_by(key=scoped_key).delete(synchronize_session=False)
+    db.session.commit()
+
+
+@contextmanager
+def _commits_deferred(session):
+    """Turn ``session``'s commits into flushes, so the caller commits the view's effect itself."""
+    session.commit = session.flush
+    try:
+        yield
+    finally:
+        del session.commit
+
+
+def idempotent(view):
+    """Make a mutating endpoint safe to retry when the client sends an ``Idempotency-Key`` header.
+
+    The first request runs normally and its response is stored; retries with the same key
+    and body replay that response instead of applying the effect again. A retry that arrives
+    while the first attempt is still running gets 409; reusing a key for a different request
+    gets 422. 5xx responses are not stored, so the client can retry them.
+
+    The view's own commits are deferred: its effect commits in the same transaction as the
+    stored response, so a crash in between cannot leave an applied effect behind an expired claim.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return {"error": f"{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters."}, 400
+
+        config = current_app.config
+        now = datetime.utcnow()
+        _maybe_sweep(now)
+
+        scoped_key = f"{request.method} {request.path} {key}"
+        fingerprint = _request_fingerprint()
+
+        record = db.session.get(IdempotencyRecord, scoped_key)
+        if record is not None:
+            lock_expired = (record.status_code is None and
+                            now - record.created_at > timedelta(seconds=config['IDEMPOTENCY_LOCK_SECONDS']))
+            if record.expires_at <= now or lock_expired:
+                db.session.delete(record)
+                db.session.commit()
+                record = None
+
+        if record is not None:
+            if record.request_hash != fingerprint:
+                logging.warning(f"Idempotency key reused with a different request: {key}")
+                return {"error": f"{IDEMPOTENCY_HEADER} was already used for a different request."}, 422
+            if record.status_code is None:
+                return {"error": "A request with this Idempotency-Key is still in progress."}, 409
+            logging.info(f"Replaying stored response for idempotency key: {key}")
+            response = current_app.response_class(
+                record.response_body, status=record.status_code,
+                mimetype=record.response_mimetype or 'application/json'
+            )
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        # Claim the key before running the view so concurrent retries cannot both apply it.
+        try:
+            db.session.add(IdempotencyRecord(
+                key=scoped_key,
+                request_hash=fingerprint,
+                created_at=now,
+                expires_at=now + timedelta(seconds=config['IDEMPOTENCY_TTL_SECONDS'])
+            ))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return {"error": "A request with this Idempotency-Key is still in progress."}, 409
+
+        try:
+            with _commits_deferred(db.session()):
+                response = make_response(view(*args, **kwargs))
+        except Exception:
+            db.session.rollback()
+            _forget(scoped_key)
+            raise
+
+        if response.status_code >= 500:
+            db.session.rollback()
+            _forget(scoped_key)
+            return response
+
+        try:
+            record = db.session.get(IdempotencyRecord, scoped_key)
+            record.status_code = response.status_code
+            record.response_body = response.get_data()
+            record.response_mimetype = response.mimetype
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            _forget(scoped_key)
+            raise
+        return response
+
+    return wrapper
+
+
+@click.command('purge-idempotency-keys')
+def purge_idempotency_keys_command():
+    """Delete expired idempotency records."""
+    click.echo(f"Purged {purge_expired_keys()} expired idempotency keys.")
+
+
+def init_idempotency(app):
+    app.config.setdefault('IDEMPOTENCY_TTL_SECONDS', 24 * 60 * 60)
+    app.config.setdefault('IDEMPOTENCY_LOCK_SECONDS', 60)
+    app.config.setdefault('IDEMPOTENCY_SWEEP_INTERVAL_SECONDS', 5 * 60)
+    app.cli.add_command(purge_idempotency_keys_command)
@@ -5,12 +5,74 @@ class Customer(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     full_name = db.Column(db.String(100), nullable=False)
     username = db.Column(db.String(50), unique=True, nullable=False)
-    password = db.Column(db.String(100), nullable=False)
+    password = db.Column(db.String(255), nullable=False)  # scrypt hash, see credentials.py
     age = db.Column(db.Integer, nullable=False)
     address = db.Column(db.String(200))
     gender = db.Column(db.String(10))
     marital_status = db.Column(db.String(20))
-    wallet = db.Column(db.Float, default=0.0)
+    wallet = db.Column(db.Float, default=0.0)  # opening balance from before the wallet ledger; see wallet.py
 
     def __repr__(self):
         return f'<Customer {self.username}>'
+
+
+class PurchaseLedgerEntry(db.Model):
+    """A customer's sale outcomes as reported by Sales events; ``reference`` (the event key) makes replays no-ops."""
+    __tablename__ = 'purchase_ledger'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    customer_username = db.Column(db.String(50), nullable=False, index=True)
+    sale_id = db.Column(db.Integer, nullable=False)
+    entry_type = db.Column(db.String(20), nullable=False)  # purchase, sale_failed
+    item_name = db.Column(db.String(100), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    amount = db.Column(db.Float)
+    note = db.Column(db.Text)
+    reference = db.Column(db.String(80), nullable=False, unique=True)
+    created_at = db.Column(db.DateTime, default=db.func.now())
+
+    def to_dict(self):
+        return {
+            "sale_id": self.sale_id,
+            "entry_type": self.entry_type,
+            "item_name": self.item_name,
+            "quantity": self.quantity,
+            "amount": self.amount,
+            "note": self.note,
+            "created_at": self.created_at.isoformat() if self.created_at else None
+        }
+
+
+class WalletEntry(db.Model):
+    """One wallet movement in integer cents. Rows are only ever inserted; the balance is their sum."""
+    __tablename__ = 'wallet_ledger'
+    __table_args__ = (
+        db.Index('ix_wallet_ledger_customer_id', 'customer_username', 'id'),
+        {'sqlite_autoincrement': True},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    customer_username = db.Column(db.String(50), nullable=False)
+    amount_cents = db.Column(db.BigInteger, nullable=False)  # positive credits, negative debits
+    kind = db.Column(db.String(20), nullable=False)  # charge, deduct, close
+    reference = db.Column(db.String(255))  # Idempotency-Key of the request, when it had one
+    created_at = db.Column(db.DateTime, default=db.func.now())
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "amount": self.amount_cents / 100,
+            "kind": self.kind,
+            "reference": self.reference,
+            "created_at": self.created_at.isoformat() if self.created_at else None
+        }
+
+
+class WalletSnapshot(db.Model):
+    """A customer's balance including every ledger entry up to ``last_entry_id``."""
+    __tablename__ = 'wallet_snapshots'
+
+    customer_username = db.Column(db.String(50), primary_key=True)
+    last_entry_id = db.Column(db.Integer, primary_key=True)
+    balance_cents = db.Column(db.BigInteger, nullable=False)
+    taken_at = db.Column(db.DateTime, default=db.func.now())
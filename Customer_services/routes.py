@@ -1,16 +1,18 @@
-from flask import Blueprint, request, jsonify
-from models import Customer
+from flask import Blueprint, request, jsonify, current_app
+from models import Customer, PurchaseLedgerEntry, WalletEntry
 from db import db
+from idempotency import idempotent
+from routing import read_only
+from cache import get_cache
+from http_cache import conditional
+from wallet import (balance_cents, balances_cents, close_wallet, latest_entry_id, lock_customer, post_entry,
+                    to_amount, to_cents)
+from credentials import (hash_password, verify_password, needs_rehash, burn_verification,
+                         issue_token, verify_token, revoke_tokens_on_commit)
 import logging
 from sqlalchemy.sql import text
 
 
-logging.basicConfig(
-    filename='customers_service.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
-
 customers_bp = Blueprint('customers_bp', __name__)
 
 
@@ -32,6 +34,7 @@ def health_check():
 
 
 @customers_bp.route('/customers', methods=['POST'])
+@idempotent
 def register_customer():
     try:
         data = request.json
@@ -68,13 +71,14 @@ def register_customer():
         customer = Customer(
             full_name=data.get('full_name'),
             username=data.get('username'),
-            password=data.get('password'),
+            password=hash_password(data.get('password')),
             age=age,
             address=data.get('address'),
             gender=data.get('gender'),
             marital_status=data.get('marital_status')
         )
         db.session.add(customer)
+        get_cache().invalidate_on_commit(db.session, 'customers', customer.username)
         db.session.commit()
 
         logging.info(f"Customer registered successfully: {data.get('username')}")
@@ -86,6 +90,8 @@ def register_customer():
         return {"error": f"An unexpected error occurred: {str(e)}"}, 500
 
 @customers_bp.route('/customers', methods=['GET'])
+@read_only
+@conditional(Customer.__tablename__, fingerprint=latest_entry_id)
 def get_all_customers():
     try:
         customers = Customer.query.all()
@@ -95,11 +101,12 @@ def get_all_customers():
 
         logging.info("Fetched all customers.")
 
+        balances = balances_cents(customers)
         return jsonify([{
             "id": c.id,
             "full_name": c.full_name,
             "username": c.username,
-            "wallet": c.wallet
+            "wallet": to_amount(balances[c.username])
         } for c in customers]), 200
 
     except Exception as e:
@@ -109,27 +116,86 @@ def get_all_customers():
 
 
 
+def _customer_profile(username):
+    customer = Customer.query.filter_by(username=username).first()
+    if not customer:
+        return None
+    return {
+        "id": customer.id,
+        "full_name": customer.full_name,
+        "username": customer.username,
+        "wallet": to_amount(balance_cents(customer))
+    }
+
 @customers_bp.route('/customers/<username>', methods=['GET'])
+@read_only
+@conditional(Customer.__tablename__, fingerprint=latest_entry_id)
 def get_customer_by_username(username):
+    try:
+        # Cached per username (shared across workers when CACHE_URL is set); writes invalidate it.
+        profile = get_cache().get_or_load('customers', username, lambda: _customer_profile(username))
+        if not profile:
+            logging.warning(f"Customer not found: {username}")
+            return {"error": "Customer not found"}, 404
+
+        logging.info(f"Customer fetched by username: {username}")
+        return profile, 200
+
+    except Exception as e:
+        logging.error(f"Error while fetching customer: {e}")
+        return {"error": f"An unexpected error occurred: {str(e)}"}, 500
+
+
+@customers_bp.route('/customers/<username>/purchases', methods=['GET'])
+@read_only
+@conditional(PurchaseLedgerEntry.__tablename__)
+def get_purchase_ledger(username):
+    # Filled asynchronously from Sales events, so a sale shows up here shortly after it settles.
+    try:
+        entries = (PurchaseLedgerEntry.query.filter_by(customer_username=username)
+                   .order_by(PurchaseLedgerEntry.id.desc()).limit(100).all())
+        logging.info(f"Purchase ledger fetched for customer: {username}")
+        return jsonify([entry.to_dict() for entry in entries]), 200
+
+    except Exception as e:
+        logging.error(f"Error while fetching purchase ledger: {e}")
+        return {"error": f"An unexpected error occurred: {str(e)}"}, 500
+
+@customers_bp.route('/customers/<username>/wallet', methods=['GET'])
+@read_only
+@conditional(Customer.__tablename__, fingerprint=latest_entry_id)
+def get_wallet_ledger(username):
+    # Newest first; ?before=<entry id> pages back through the history.
     try:
         customer = Customer.query.filter_by(username=username).first()
         if not customer:
             logging.warning(f"Customer not found: {username}")
             return {"error": "Customer not found"}, 404
+        try:
+            before = request.args.get('before', type=int)
+            limit = min(max(int(request.args.get('limit', 100)), 1), 500)
+        except ValueError:
+            return {"error": "limit must be an integer."}, 400
 
-        logging.info(f"Customer fetched by username: {username}")
+        query = WalletEntry.query.filter_by(customer_username=username)
+        if before is not None:
+            query = query.filter(WalletEntry.id < before)
+        entries = query.order_by(WalletEntry.id.desc()).limit(limit).all()
+
+        logging.info(f"Wallet ledger fetched for customer: {username}")
         return {
-            "id": customer.id,
-            "full_name": customer.full_name,
-            "username": customer.username,
-            "wallet": customer.wallet
+            "username": username,
+            "balance": to_amount(balance_cents(customer)),
+            "opening_balance": customer.wallet or 0.0,
+            "entries": [entry.to_dict() for entry in entries]
         }, 200
 
     except Exception as e:
-        logging.error(f"Error while fetching customer: {e}")
+        logging.error(f"Error while fetching wallet ledger: {e}")
         return {"error": f"An unexpected error occurred: {str(e)}"}, 500
-    
+
 @customers_bp.route('/customers/<username>', methods=['PUT'])
+@idempotent
 def update_customer(username):
     try:
         data = request.json
@@ -149,7 +215,8 @@ def update_customer(username):
             customer.full_name = data['full_name']
         if 'password' in data:
             logging.info(f"Updating password for {username}")
-            customer.password = data['password']
+            customer.password = hash_password(data['password'])
+            revoke_tokens_on_commit(db.session)
         if 'age' in data:
             try:
                 age = int(data['age'])
@@ -174,6 +241,7 @@ def update_customer(username):
             logging.info(f"Updating marital_status for {username}: {data['marital_status']}")
             customer.marital_status = data['marital_status']
 
+        get_cache().invalidate_on_commit(db.session, 'customers', username)
         db.session.commit()
         logging.info(f"Customer updated successfully: {username} | Updated Data: {customer}")
         return {"message": "Customer updated successfully"}, 200
@@ -184,13 +252,14 @@ def update_customer(username):
         return {"error": "An unexpected error occurred. Please try again later."}, 500
 
 @customers_bp.route('/customers/<username>', methods=['DELETE'])
+@idempotent
 def delete_customer(username):
     try:
         # Log the delete request
         logging.info(f"Received request to delete customer: {username}")
 
         # Query the customer by username
-        customer = Customer.query.filter_by(username=username).first()
+        customer = lock_customer(username)
         if not customer:
             logging.warning(f"Customer not found for deletion: {username}")
             return {"error": "Customer not found"}, 404
@@ -198,8 +267,13 @@ def delete_customer(username):
         # Log customer details before deletion
         logging.info(f"Deleting customer: {username} | Details: {customer}")
 
+        # Close the wallet so a later customer with the same username starts from zero
+        close_wallet(customer)
+
         # Perform the deletion
         db.session.delete(customer)
+        get_cache().invalidate_on_commit(db.session, 'customers', username)
+        revoke_tokens_on_commit(db.session)
         db.session.commit()
 
         # Log success
@@ -215,6 +289,7 @@ def delete_customer(username):
         return {"error": "An unexpected error occurred. Please try again later."}, 500
 
 @customers_bp.route('/customers/<username>/charge', methods=['POST'])
+@idempotent
 def charge_wallet(username):
     try:
         # Log the request
@@ -231,31 +306,28 @@ def charge_wallet(username):
             return {"error": "Amount is required."}, 400
         try:
             amount = float(amount)
-            if amount <= 0:
+            cents = to_cents(amount)
+            if cents <= 0:
                 logging.warning(f"Invalid amount {amount} for customer: {username}")
                 return {"error": "Amount must be a positive number."}, 400
         except ValueError:
             logging.warning(f"Non-numeric amount provided for customer: {username}")
             return {"error": "Amount must be a valid number."}, 400
 
-        customer = Customer.query.filter_by(username=username).first()
+        customer = lock_customer(username)
         if not customer:
             logging.warning(f"Customer not found: {username}")
             return {"error": "Customer not found."}, 404
         # Log the charging process
-        logging.info(f"Charging ${amount} to customer wallet: {username} | Current balance: {customer.wallet}")
+        logging.info(f"Charging ${amount} to customer wallet: {username}")
 
-        # Update the customer's wallet
-        customer.wallet += amount
+        # Append the movement to the wallet ledger
+        balance = post_entry(customer, cents, 'charge', reference=request.headers.get('Idempotency-Key'))
+        get_cache().invalidate_on_commit(db.session, 'customers', username)
         db.session.commit()
 
         # Log the successful transaction
-        logging.info(f"Successfully charged ${amount} to wallet of customer: {username} | New balance: {customer.wallet}")
-
-        # Return a success response
-
-        customer.wallet += amount
-        db.session.commit()
+        logging.info(f"Successfully charged ${amount} to wallet of customer: {username} | New balance: {to_amount(balance)}")
 
         return {"message": f"${amount} added to wallet."}, 200
 
@@ -271,6 +343,7 @@ def charge_wallet(username):
         return {"error": "An unexpected error occurred. Please try again later."}, 500
 
 @customers_bp.route('/customers/<username>/deduct', methods=['POST'])
+@idempotent
 def deduct_wallet(username):
     try:
 
@@ -290,35 +363,33 @@ def deduct_wallet(username):
             return {"error": "Amount is required."}, 400
         try:
             amount = float(amount)
-            if amount <= 0:
+            cents = to_cents(amount)
+            if cents <= 0:
                 logging.warning(f"Invalid amount {amount} for customer: {username}")
                 return {"error": "Amount must be a positive number."}, 400
         except ValueError:
             logging.warning(f"Non-numeric amount provided for customer: {username}")
             return {"error": "Amount must be a valid number."}, 400
 
-        customer = Customer.query.filter_by(username=username).first()
+        customer = lock_customer(username)
         if not customer:
             logging.warning(f"Customer not found: {username}")
             return {"error": "Customer not found."}, 404
 
-        if customer.wallet < amount:
-            logging.warning(f"Insufficient funds: Attempt to deduct ${amount} from customer: {username} with wallet balance: {customer.wallet}")
+        balance = balance_cents(customer)
+        if balance < cents:
+            logging.warning(f"Insufficient funds: Attempt to deduct ${amount} from customer: {username} with wallet balance: {to_amount(balance)}")
             return {"error": "Insufficient funds in wallet."}, 400
 
 
-        # Deduct the amount from the wallet
-        logging.info(f"Deducting ${amount} from customer wallet: {username} | Current balance: {customer.wallet}")
-        customer.wallet -= amount
+        # Append the deduction to the wallet ledger
+        logging.info(f"Deducting ${amount} from customer wallet: {username} | Current balance: {to_amount(balance)}")
+        balance = post_entry(customer, -cents, 'deduct', reference=request.headers.get('Idempotency-Key'))
+        get_cache().invalidate_on_commit(db.session, 'customers', username)
         db.session.commit()
 
         # Log successful deduction
-        logging.info(f"Successfully deducted ${amount} from wallet of customer: {username} | New balance: {customer.wallet}")
-
-        # Return success response
-
-        customer.wallet -= amount
-        db.session.commit()
+        logging.info(f"Successfully deducted ${amount} from wallet of customer: {username} | New balance: {to_amount(balance)}")
 
         return {"message": f"${amount} deducted from wallet."}, 200
 
@@ -334,3 +405,54 @@ def deduct_wallet(username):
 
         return {"error": "An unexpected error occurred. Please try again later."}, 500
 
+@customers_bp.route('/auth/login', methods=['POST'])
+def login():
+    try:
+        data = request.json
+        if not data or not isinstance(data, dict):
+            return {"error": "Invalid JSON or empty request body."}, 400
+        username = data.get('username')
+        password = data.get('password')
+        if not username or not password:
+            return {"error": "username and password are required."}, 400
+
+        customer = Customer.query.filter_by(username=username).first()
+        if not customer:
+            burn_verification(password)
+            logging.warning(f"Login failed for unknown customer: {username}")
+            return {"error": "Invalid username or password."}, 401
+        if not verify_password(password, customer.password):
+            logging.warning(f"Login failed for customer: {username}")
+            return {"error": "Invalid username or password."}, 401
+
+        if needs_rehash(customer.password):
+            # Legacy plaintext or outdated KDF parameters: upgrade while we have the password.
+            customer.password = hash_password(password)
+            db.session.commit()
+            logging.info(f"Rehashed password for customer: {username}")
+
+        logging.info(f"Customer logged in: {username}")
+        return {"token": issue_token(customer), "expires_in": current_app.config['AUTH_TOKEN_MAX_AGE']}, 200
+
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error during login | Error: {e}")
+        return {"error": "An unexpected error occurred. Please try again later."}, 500
+
+@customers_bp.route('/auth/verify', methods=['GET'])
+def verify():
+    auth = request.headers.get('Authorization', '')
+    if not auth.startswith('Bearer '):
+        return {"error": "A bearer token is required."}, 401
+    try:
+        username = verify_token(auth[len('Bearer '):], _stored_password)
+    except Exception as e:
+        logging.error(f"Error while verifying token: {e}")
+        return {"error": "An unexpected error occurred. Please try again later."}, 500
+    if username is None:
+        return {"error": "Invalid or expired token."}, 401
+    return {"username": username}, 200
+
+def _stored_password(username):
+    customer = Customer.query.filter_by(username=username).first()
+    return customer.password if customer else None
@@ -0,0 +1,97 @@
+import builtins
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+def configure_logging(filename):
+    """Log to ``LOG_FILE`` (default ``filename``) at ``LOG_LEVEL``. A no-op once logging is configured."""
+    logging.basicConfig(
+        filename=os.getenv('LOG_FILE', filename),
+        level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+        format=LOG_FORMAT
+    )
+
+
+class StartupProfiler:
+    """Import and init timings for ``STARTUP_PROFILE=1``.
+
+    Imports are timed by wrapping ``__import__``: each module gets its inclusive time and
+    its self time (without the modules it imported), so the cost lands on the module that
+    actually pays it. ``app.py`` imports this module first so everything after it is seen.
+    """
+
+    def __init__(self):
+        self.imports = {}
+        self.steps = []
+        self._stack = []
+        self._original_import = None
+
+    def install(self):
+        if self._original_import is None:
+            self._original_import = builtins.__import__
+            builtins.__import__ = self._timed_import
+
+    def uninstall(self):
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+        self._stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            self.imports[name] = (elapsed, elapsed - children)
+
+    @contextmanager
+    def step(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((name, time.perf_counter() - start))
+
+    def report(self, top=15):
+        lines = ['Startup profile (ms):', f"{'import':<48}{'self':>10}{'total':>10}"]
+        by_self = sorted(self.imports.items(), key=lambda item: item[1][1], reverse=True)
+        for name, (total, own) in by_self[:top]:
+            lines.append(f'{name:<48}{own * 1000:>10.1f}{total * 1000:>10.1f}')
+        lines.append(f"{'init step':<48}{'':>10}{'total':>10}")
+        for name, elapsed in self.steps:
+            lines.append(f'{name:<48}{"":>10}{elapsed * 1000:>10.1f}')
+        return '\n'.join(lines)
+
+
+profiler = StartupProfiler()
+if os.getenv('STARTUP_PROFILE') == '1':
+    profiler.install()
+
+
+def initialize(app, *initializers):
+    """Call each ``initializer(app)`` in order, timed under its module and name for the startup profile."""
+    for initializer in initializers:
+        func = getattr(initializer, 'func', initializer)
+        with profiler.step(f"{func.__module__}.{getattr(func, '__qualname__', repr(func))}"):
+            initializer(app)
+
+
+def report_startup(app):
+    if os.getenv('STARTUP_PROFILE') != '1':
+        return
+    profiler.uninstall()
+    report = profiler.report()
+    app.extensions['startup_profile'] = report
+    logging.info(report)
+    print(report, file=sys.stderr)
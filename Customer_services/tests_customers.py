@@ -1,4 +1,9 @@
+import os
+
 import pytest
+
+os.environ.setdefault('TESTING', '1')  # create_app() runs before the fixtures set TESTING
+
 from app import create_app
 from db import db
 from models import Customer
@@ -145,8 +150,7 @@ def test_charge_wallet(test_client):
     assert response.json["message"] == "$25.0 added to wallet."
 
     # Verify the wallet update
-    updated_customer = Customer.query.filter_by(username="daviddoe").first()
-    assert updated_customer.wallet == 75.0
+    assert test_client.get('/api/v1/customers/daviddoe').json['wallet'] == 75.0
 
 def test_deduct_wallet(test_client):
     # Add a test customer to the database
@@ -171,5 +175,313 @@ def test_deduct_wallet(test_client):
     assert response.json["message"] == "$50.0 deducted from wallet."
 
     # Verify the wallet update
-    updated_customer = Customer.query.filter_by(username="evedoe").first()
-    assert updated_customer.wallet == 50.0
+    assert test_client.get('/api/v1/customers/evedoe').json['wallet'] == 50.0
+
+def test_deduct_wallet_retry_is_not_applied_twice(test_client):
+    with test_client.application.app_context():
+        db.session.add(Customer(full_name="Fay Doe", username="faydoe", password="pw", age=30, wallet=100.0))
+        db.session.commit()
+
+    headers = {"Idempotency-Key": "sale-7-deduct"}
+    for _ in range(3):
+        response = test_client.post('/api/v1/customers/faydoe/deduct', json={"amount": 30.0}, headers=headers)
+        assert response.status_code == 200
+
+    assert test_client.get('/api/v1/customers/faydoe').json['wallet'] == 70.0
+
+def test_idempotent_retry_replays_a_msgpack_response(test_client):
+    msgpack = pytest.importorskip('msgpack')
+    with test_client.application.app_context():
+        db.session.add(Customer(full_name="Hal Doe", username="haldoe", password="pw", age=30, wallet=0.0))
+        db.session.commit()
+
+    headers = {"Idempotency-Key": "sale-8-refund", "Accept": "application/msgpack"}
+    first = test_client.post('/api/v1/customers/haldoe/charge', json={"amount": 10.0}, headers=headers)
+    retry = test_client.post('/api/v1/customers/haldoe/charge', json={"amount": 10.0}, headers=headers)
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.mimetype == first.mimetype == 'application/msgpack'
+    assert msgpack.unpackb(retry.get_data()) == msgpack.unpackb(first.get_data()) == {"message": "$10.0 added to wallet."}
+    assert test_client.get('/api/v1/customers/haldoe').json['wallet'] == 10.0
+
+def test_charge_interrupted_before_its_response_is_stored_is_not_applied(test_client, monkeypatch):
+    import idempotency
+    with test_client.application.app_context():
+        db.session.add(Customer(full_name="Ida Doe", username="idadoe", password="pw", age=30, wallet=0.0))
+        db.session.commit()
+
+    def crash(*args, **kwargs):
+        raise RuntimeError("worker killed")
+    monkeypatch.setattr(idempotency, 'make_response', crash)
+    headers = {"Idempotency-Key": "sale-10-refund"}
+    with pytest.raises(RuntimeError):
+        test_client.post('/api/v1/customers/idadoe/charge', json={"amount": 10.0}, headers=headers)
+    monkeypatch.undo()
+
+    # The charge rolled back with the missing response, so the retry applies it exactly once.
+    assert test_client.post('/api/v1/customers/idadoe/charge', json={"amount": 10.0}, headers=headers).status_code == 200
+    assert test_client.get('/api/v1/customers/idadoe').json['wallet'] == 10.0
+
+
+def test_wallet_movements_are_ledger_entries_in_cents_with_snapshots(test_client):
+    from models import WalletEntry, WalletSnapshot
+
+    test_client.application.config['WALLET_SNAPSHOT_EVERY'] = 4
+    with test_client.application.app_context():
+        db.session.add(Customer(full_name="Gus Doe", username="gusdoe", password="pw", age=40, wallet=1.0))
+        db.session.commit()
+
+    for _ in range(10):
+        assert test_client.post('/api/v1/customers/gusdoe/charge', json={"amount": 0.1}).status_code == 200
+    assert test_client.post('/api/v1/customers/gusdoe/deduct', json={"amount": 2.01}).status_code == 400
+    assert test_client.post('/api/v1/customers/gusdoe/deduct', json={"amount": 0.3},
+                            headers={"Idempotency-Key": "sale-9-deduct"}).status_code == 200
+
+    # 1.0 + 10 * 0.1 - 0.3 with no float drift, and the legacy column is left alone.
+    assert test_client.get('/api/v1/customers/gusdoe').json['wallet'] == 1.7
+    ledger = test_client.get('/api/v1/customers/gusdoe/wallet?limit=2').json
+    assert ledger['balance'] == 1.7 and ledger['opening_balance'] == 1.0
+    assert [(e['kind'], e['amount'], e['reference']) for e in ledger['entries']] == [
+        ('deduct', -0.3, 'sale-9-deduct'), ('charge', 0.1, None)]
+    with test_client.application.app_context():
+        assert WalletEntry.query.filter_by(customer_username="gusdoe").count() == 11
+        snapshots = WalletSnapshot.query.order_by(WalletSnapshot.last_entry_id).all()
+        assert [s.balance_cents for s in snapshots] == [140, 180]
+
+    # A new customer reusing the username starts from the closed wallet, not the old history.
+    assert test_client.delete('/api/v1/customers/gusdoe').status_code == 200
+    test_client.post('/api/v1/customers', json={"full_name": "Gus Two", "username": "gusdoe", "password": "pw", "age": 41})
+    assert test_client.get('/api/v1/customers/gusdoe').json['wallet'] == 0.0
+
+
+def test_wallet_movements_change_etags_without_a_table_version(test_client):
+    from sqlalchemy import select
+
+    with test_client.application.app_context():
+        db.session.add(Customer(full_name="Jay Doe", username="jaydoe", password="pw", age=30, wallet=10.0))
+        db.session.add(Customer(full_name="Kim Doe", username="kimdoe", password="pw", age=31, wallet=10.0))
+        db.session.commit()
+
+    profile = test_client.get('/api/v1/customers/jaydoe')
+    wallet = test_client.get('/api/v1/customers/jaydoe/wallet')
+    other = test_client.get('/api/v1/customers/kimdoe')
+    assert profile.last_modified is None
+
+    assert test_client.post('/api/v1/customers/jaydoe/charge', json={"amount": 5.0}).status_code == 200
+    response = test_client.get('/api/v1/customers/jaydoe', headers={'If-None-Match': profile.headers['ETag']})
+    assert response.status_code == 200
+    assert response.json['wallet'] == 15.0
+    assert test_client.get('/api/v1/customers/jaydoe/wallet',
+                           headers={'If-None-Match': wallet.headers['ETag']}).status_code == 200
+    assert test_client.get('/api/v1/customers/kimdoe', headers={'If-None-Match': other.headers['ETag']}).status_code == 304
+
+    with test_client.application.app_context():
+        versions = test_client.application.extensions['http_cache']
+        assert db.session.scalar(select(versions.c.version).where(versions.c.table_name == 'wallet_ledger')) is None
+
+
+def test_customer_profile_is_cached_until_a_write(test_client):
+    with test_client.application.app_context():
+        db.session.add(Customer(full_name="Ivy Doe", username="ivydoe", password="pw", age=28, wallet=10.0))
+        db.session.commit()
+
+    assert test_client.get('/api/v1/customers/ivydoe').json['wallet'] == 10.0
+    with test_client.application.app_context():
+        Customer.query.filter_by(username="ivydoe").update({"full_name": "Changed Behind The Cache"})
+        db.session.commit()
+    assert test_client.get('/api/v1/customers/ivydoe').json['full_name'] == "Ivy Doe"
+
+    test_client.post('/api/v1/customers/ivydoe/charge', json={"amount": 5.0})
+    profile = test_client.get('/api/v1/customers/ivydoe').json
+    assert profile['wallet'] == 15.0
+    assert profile['full_name'] == "Changed Behind The Cache"
+
+def test_login_hashes_legacy_passwords_and_issues_tokens(test_client):
+    app = test_client.application
+    app.config['PASSWORD_HASH_WORKERS'] = 0  # hash inline instead of in the process pool
+    app.config['PASSWORD_SCRYPT_N'] = 2 ** 10
+    with app.app_context():
+        db.session.add(Customer(full_name="Joe Doe", username="joedoe", password="legacy-pw", age=40))
+        db.session.commit()
+
+    assert test_client.post('/api/v1/auth/login', json={"username": "joedoe", "password": "nope"}).status_code == 401
+    assert test_client.post('/api/v1/auth/login', json={"username": "nobody", "password": "x"}).status_code == 401
+
+    response = test_client.post('/api/v1/auth/login', json={"username": "joedoe", "password": "legacy-pw"})
+    assert response.status_code == 200
+    token = response.json['token']
+    with app.app_context():
+        assert Customer.query.filter_by(username="joedoe").first().password.startswith('scrypt$1024$')
+
+    headers = {"Authorization": f"Bearer {token}"}
+    assert test_client.get('/api/v1/auth/verify', headers=headers).json == {"username": "joedoe"}
+
+    # Stronger parameters: the next login upgrades the hash; a password change revokes old tokens.
+    app.config['PASSWORD_SCRYPT_N'] = 2 ** 11
+    assert test_client.post('/api/v1/auth/login', json={"username": "joedoe", "password": "legacy-pw"}).status_code == 200
+    with app.app_context():
+        assert Customer.query.filter_by(username="joedoe").first().password.startswith('scrypt$2048$')
+    test_client.put('/api/v1/customers/joedoe', json={"password": "new-pw"})
+    assert test_client.get('/api/v1/auth/verify', headers=headers).status_code == 401
+
+def test_missing_secret_key_fails_startup_unless_testing_without_a_shared_cache(monkeypatch):
+    from flask import Flask
+    from credentials import init_credentials
+
+    monkeypatch.delenv('SECRET_KEY', raising=False)
+    monkeypatch.setenv('TESTING', '0')
+    with pytest.raises(RuntimeError):
+        init_credentials(Flask(__name__))
+
+    shared = Flask(__name__)
+    shared.config.update(TESTING=True, CACHE_URL='redis://localhost:6379/0')
+    with pytest.raises(RuntimeError):
+        init_credentials(shared)
+
+    testing = Flask(__name__)
+    testing.config['TESTING'] = True
+    init_credentials(testing)
+    assert testing.config['SECRET_KEY']
+
+def test_query_profiler_reports_statements_and_enforces_budgets(test_client, caplog):
+    from query_profiler import QueryBudgetExceeded
+
+    app = test_client.application
+    with app.app_context():
+        db.session.add(Customer(full_name="Quinn Doe", username="quinn", password="pw", age=30,
+                                address="1 Main Street", gender="Female", marital_status="Single"))
+        db.session.commit()
+
+    app.config['QUERY_N_PLUS_ONE_THRESHOLD'] = 1
+    response = test_client.get('/api/v1/customers/quinn')
+    assert int(response.headers['X-Query-Count']) >= 1
+    assert response.headers['Server-Timing'].startswith('db;dur=')
+    assert "Possible N+1 in customers_bp.get_customer_by_username" in caplog.text
+
+    app.config['QUERY_BUDGET_STRICT'] = True
+    app.config['QUERY_BUDGETS'] = {'customers_bp.update_customer': 1}
+    with pytest.raises(QueryBudgetExceeded):
+        test_client.put('/api/v1/customers/quinn', json={"address": "2 Main Street"})
+
+    app.config['QUERY_BUDGETS'] = {'customers_bp.update_customer': 10}
+    assert test_client.put('/api/v1/customers/quinn', json={"address": "3 Main Street"}).status_code == 200
+
+def test_sale_events_fill_the_purchase_ledger_once(test_client, tmp_path):
+    from consumers import record_sale_outcome
+    from events import SALE_COMPLETED, SALE_FAILED, EventConsumer, SQLiteBroker
+
+    broker = SQLiteBroker(str(tmp_path / 'events.db'))
+    sale = {"sale_id": 7, "customer_username": "pia", "item_name": "Laptop", "item_id": 1,
+            "quantity": 2, "total_price": 200.0, "purchase_id": 3, "error": None}
+    broker.publish(SALE_COMPLETED, sale, key='sale-7-SaleCompleted')
+    # The Sales relay crashed before marking the event published, so it went out twice.
+    broker.publish(SALE_COMPLETED, sale, key='sale-7-SaleCompleted')
+    broker.publish(SALE_FAILED, {**sale, "sale_id": 8, "error": "Insufficient stock."}, key='sale-8-SaleFailed')
+
+    consumer = EventConsumer(test_client.application, broker, 'customers',
+                             {SALE_COMPLETED: record_sale_outcome, SALE_FAILED: record_sale_outcome})
+    assert consumer.drain_once() == 3
+    assert consumer.drain_once() == 0
+
+    ledger = test_client.get('/api/v1/customers/pia/purchases').json
+    assert [(entry['sale_id'], entry['entry_type'], entry['amount']) for entry in ledger] == [
+        (8, 'sale_failed', None), (7, 'purchase', 200.0)]
+
+    # Another worker cannot drain the group while this one holds the lease.
+    other = EventConsumer(test_client.application, broker, 'customers', consumer.handlers)
+    broker.publish(SALE_COMPLETED, {**sale, "sale_id": 9}, key='sale-9-SaleCompleted')
+    assert other.drain_once() == 0
+    assert consumer.drain_once() == 1
+
+
+def test_read_only_routes_are_served_from_replica(tmp_path, monkeypatch):
+    monkeypatch.setenv('REPLICA_SYNC_PATH', str(tmp_path / 'replica.db'))
+    app = create_app()
+    replica = app.extensions['db_replica']
+    monkeypatch.setattr(replica, 'start', lambda: None)  # sync by hand instead of in the background
+
+    with app.app_context():
+        db.create_all()
+        db.session.add(Customer(full_name="Gina Doe", username="ginadoe", password="pw", age=31))
+        db.session.commit()
+        replica.sync_once()
+        db.session.add(Customer(full_name="Hank Doe", username="hankdoe", password="pw", age=33))
+        db.session.commit()
+
+    client = app.test_client()
+    assert client.get('/api/v1/customers/ginadoe').status_code == 200
+    assert client.get('/api/v1/customers/hankdoe').status_code == 404  # replica has not caught up yet
+
+    replica.sync_once()
+    assert client.get('/api/v1/customers/hankdoe').status_code == 200
+
+    with app.app_context():
+        db.drop_all()
+
+def test_lagging_replica_does_not_refill_the_profile_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('REPLICA_SYNC_PATH', str(tmp_path / 'replica.db'))
+    app = create_app()
+    replica = app.extensions['db_replica']
+    monkeypatch.setattr(replica, 'start', lambda: None)
+
+    with app.app_context():
+        db.create_all()
+        db.session.add(Customer(full_name="Iris Doe", username="irisdoe", password="pw", age=29, wallet=10.0))
+        db.session.commit()
+        replica.sync_once()
+
+    client = app.test_client()
+    assert client.get('/api/v1/customers/irisdoe').json['wallet'] == 10.0
+    assert client.post('/api/v1/customers/irisdoe/charge', json={"amount": 5.0}).status_code == 200
+    assert client.get('/api/v1/customers/irisdoe').json['wallet'] == 10.0  # replica has not caught up yet
+
+    replica.sync_once()
+    assert client.get('/api/v1/customers/irisdoe').json['wallet'] == 15.0
+
+    with app.app_context():
+        db.drop_all()
+
+def test_cache_loads_a_missing_key_once_for_concurrent_callers():
+    import threading
+    import time
+    from cache import Cache, LocalBackend
+
+    now = [0.0]
+    cache = Cache(LocalBackend(max_entries=2, clock=lambda: now[0]), default_ttl=10)
+    calls = []
+
+    def slow_loader():
+        calls.append(1)
+        time.sleep(0.05)
+        return {"value": 1}
+
+    threads = [threading.Thread(target=cache.get_or_load, args=('ns', 'key', slow_loader)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert cache.get('ns', 'key') == {"value": 1}
+
+    now[0] = 11.0  # past the TTL
+    assert cache.get('ns', 'key') is None
+
+    cache.set('ns', 'key', 1)
+    cache.invalidate('ns')
+    assert cache.get('ns', 'key') is None
+
+def test_cache_load_overtaken_by_a_write_does_not_cache_the_old_value():
+    from cache import Cache, LocalBackend
+
+    cache = Cache(LocalBackend(), default_ttl=60)
+    row = {"wallet": 10}
+
+    def load_then_lose_the_race():
+        value = dict(row)  # read from the primary...
+        row["wallet"] = 15  # ...just before a write commits and drops the key
+        cache.delete('customers', 'irisdoe')
+        return value
+
+    assert cache.get_or_load('customers', 'irisdoe', load_then_lose_the_race) == {"wallet": 10}
+    assert cache.get_or_load('customers', 'irisdoe', lambda: dict(row)) == {"wallet": 15}
@@ -0,0 +1,148 @@
+import logging
+import os
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import and_, func, select
+
+from db import db
+from models import Customer, WalletEntry, WalletSnapshot
+
+
+class InvalidAmount(ValueError):
+    pass
+
+
+def to_cents(amount):
+    """Money in integer cents, rounded half up from the decimal form of ``amount`` (never via float arithmetic)."""
+    try:
+        return int((Decimal(str(amount)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+    except (InvalidOperation, ValueError):
+        raise InvalidAmount(f"Not an amount: {amount!r}")
+
+
+def to_amount(cents):
+    return cents / 100
+
+
+def lock_customer(username):
+    """The customer row, locked for the rest of the transaction where the database supports it.
+
+    Movements of one customer queue on this lock instead of on an UPDATE of the row, so the
+    balance check and the snapshot see every earlier movement. SQLite ignores it and relies
+    on its single writer.
+    """
+    return Customer.query.filter_by(username=username).with_for_update().first()
+
+
+def _position(customer):
+    """``(balance_cents, entries since the latest snapshot)``: one snapshot lookup and one indexed range sum."""
+    snapshot = (WalletSnapshot.query.filter_by(customer_username=customer.username)
+                .order_by(WalletSnapshot.last_entry_id.desc()).first())
+    if snapshot is not None:
+        base, after = snapshot.balance_cents, snapshot.last_entry_id
+    else:
+        base, after = to_cents(customer.wallet or 0), 0
+    delta, pending = db.session.execute(
+        select(func.coalesce(func.sum(WalletEntry.amount_cents), 0), func.count(WalletEntry.id))
+        .where(WalletEntry.customer_username == customer.username, WalletEntry.id > after)
+    ).one()
+    return base + delta, pending
+
+
+def balance_cents(customer):
+    return _position(customer)[0]
+
+
+def balances_cents(customers):
+    """``{username: balance_cents}`` for ``customers`` in two grouped queries, however many there are."""
+    usernames = [customer.username for customer in customers]
+    latest = (select(WalletSnapshot.customer_username, func.max(WalletSnapshot.last_entry_id).label('last_entry_id'))
+              .where(WalletSnapshot.customer_username.in_(usernames))
+              .group_by(WalletSnapshot.customer_username).subquery())
+    snapshots = dict(db.session.execute(
+        select(WalletSnapshot.customer_username, WalletSnapshot.balance_cents)
+        .join(latest, and_(WalletSnapshot.customer_username == latest.c.customer_username,
+                           WalletSnapshot.last_entry_id == latest.c.last_entry_id))
+    ).all())
+    deltas = dict(db.session.execute(
+        select(WalletEntry.customer_username, func.sum(WalletEntry.amount_cents))
+        .outerjoin(latest, WalletEntry.customer_username == latest.c.customer_username)
+        .where(WalletEntry.customer_username.in_(usernames),
+               WalletEntry.id > func.coalesce(latest.c.last_entry_id, 0))
+        .group_by(WalletEntry.customer_username)
+    ).all())
+    return {
+        customer.username: snapshots.get(customer.username, to_cents(customer.wallet or 0))
+        + deltas.get(customer.username, 0)
+        for customer in customers
+    }
+
+
+def latest_entry_id(username=None):
+    """Id of the newest wallet entry (of ``username`` when given), 0 without any; it changes with every movement."""
+    statement = select(func.max(WalletEntry.id))
+    if username is not None:
+        statement = statement.where(WalletEntry.customer_username == username)
+    return db.session.scalar(statement) or 0
+
+
+def post_entry(customer, amount_cents, kind, reference=None, snapshot=False):
+    """Append a movement for ``customer`` (locked by the caller) and return the new balance. The caller commits.
+
+    Every ``WALLET_SNAPSHOT_EVERY`` entries (or when ``snapshot`` is set) the balance is
+    snapshotted, so reading it never sums more than that many rows.
+    """
+    balance, pending = _position(customer)
+    entry = WalletEntry(customer_username=customer.username, amount_cents=amount_cents,
+                        kind=kind, reference=reference)
+    db.session.add(entry)
+    db.session.flush()
+    balance += amount_cents
+    if snapshot or pending + 1 >= current_app.config['WALLET_SNAPSHOT_EVERY']:
+        db.session.add(WalletSnapshot(customer_username=customer.username, last_entry_id=entry.id,
+                                      balance_cents=balance))
+    return balance
+
+
+def close_wallet(customer):
+    """Zero the balance of a customer about to be deleted.
+
+    The closing snapshot is what a later customer with the same username starts from,
+    instead of the old entries on top of the new opening balance.
+    """
+    return post_entry(customer, -balance_cents(customer), 'close', snapshot=True)
+
+
+def snapshot_wallets():
+    """Snapshot every customer with entries since their latest snapshot. Returns how many were taken."""
+    taken = 0
+    for username in db.session.scalars(select(Customer.username).order_by(Customer.id)).all():
+        customer = lock_customer(username)
+        balance, pending = _position(customer)
+        if not pending:
+            db.session.rollback()
+            continue
+        last_entry_id = db.session.scalar(
+            select(func.max(WalletEntry.id)).where(WalletEntry.customer_username == customer.username))
+        db.session.add(WalletSnapshot(customer_username=customer.username, last_entry_id=last_entry_id,
+                                      balance_cents=balance))
+        db.session.commit()
+        taken += 1
+    return taken
+
+
+@click.command('snapshot-wallets')
+@with_appcontext
+def snapshot_wallets_command():
+    """Snapshot wallet balances (run periodically, e.g. from cron, to keep balance reads short)."""
+    taken = snapshot_wallets()
+    logging.info(f"Took {taken} wallet snapshots.")
+    click.echo(f"Took {taken} wallet snapshots.")
+
+
+def init_wallet(app):
+    app.config.setdefault('WALLET_SNAPSHOT_EVERY', int(os.getenv('WALLET_SNAPSHOT_EVERY', '50')))
+    app.cli.add_command(snapshot_wallets_command)
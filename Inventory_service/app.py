@@ -1,21 +1,57 @@
+from startup import configure_logging, initialize, report_startup  # first, so STARTUP_PROFILE sees every import
+from functools import partial
+
+import click
 from flask import Flask
+from flask.cli import with_appcontext
 from db import db
 from routes import inventory_bp
+from idempotency import init_idempotency
+from routing import init_replica
+from search import ensure_search_index
+from cache import init_cache
+from ratelimit import init_rate_limiting
+from http_cache import init_http_cache
+from query_profiler import init_query_profiler
+from sampling_profiler import init_sampling_profiler
+from serialization import init_serialization
+from consumers import init_consumers
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create the tables and the search index. Run once per deploy, not in every worker."""
+    db.create_all()
+    ensure_search_index()
+    click.echo("Database initialized.")
+
 
 def create_app():
+    configure_logging('inventory_service.log')
     app = Flask(__name__)
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///inventory.db'
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-    db.init_app(app)
+    initialize(
+        app,
+        init_replica,
+        db.init_app,
+        init_query_profiler,
+        partial(init_sampling_profiler, url_prefix='/api/v1'),
+        init_idempotency,
+        init_cache,
+        init_rate_limiting,
+        partial(init_http_cache, db=db),
+        init_serialization,
+        init_consumers,
+    )
     app.register_blueprint(inventory_bp, url_prefix='/api/v1')
+    app.cli.add_command(init_db_command)
 
+    report_startup(app)
     return app
 
 if __name__ == "__main__":
     app = create_app()
-    with app.app_context():
-        db.create_all()
-
-    
     app.run(host='0.0.0.0', port=5002)
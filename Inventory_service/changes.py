@@ -0,0 +1,79 @@
+from datetime import datetime
+from itertools import chain
+
+from sqlalchemy import delete, event, func, insert, select
+
+from db import db
+from models import Inventory, InventoryChange
+from routing import RoutingSession
+
+CHANGED_ITEMS = 'inventory_changed_items'
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def _collect_changed_items(session, flush_context, instances):
+    changed = session.info.setdefault(CHANGED_ITEMS, {})
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Inventory) and (obj not in session.dirty or session.is_modified(obj)):
+            changed[id(obj)] = (obj, obj in session.deleted)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _log_changed_items(session, flush_context):
+    changed = session.info.pop(CHANGED_ITEMS, None)
+    if not changed:
+        return
+    # Ids of new items are only known once they are flushed, so the log is written here.
+    now = datetime.utcnow()
+    rows = [{'item_id': obj.id, 'deleted': deleted, 'changed_at': now} for obj, deleted in changed.values()]
+    connection = session.connection()
+    connection.execute(delete(InventoryChange).where(InventoryChange.item_id.in_([row['item_id'] for row in rows])))
+    connection.execute(insert(InventoryChange), rows)
+
+
+def _item_dict(item):
+    return {
+        "id": item.id,
+        "name": item.name,
+        "category": item.category,
+        "price_per_item": item.price_per_item,
+        "description": item.description,
+        "count_in_stock": item.count_in_stock
+    }
+
+
+def current_cursor():
+    return db.session.scalar(select(func.max(InventoryChange.seq))) or 0
+
+
+def catalog_snapshot():
+    """Every item plus the cursor to poll from. The cursor is read first, so nothing written
+    while the items are read can be missed; it may only be sent twice, which is harmless."""
+    cursor = current_cursor()
+    items = Inventory.query.order_by(Inventory.id).all()
+    return {"snapshot": True, "cursor": cursor, "items": [_item_dict(item) for item in items],
+            "deleted": [], "has_more": False}
+
+
+def changes_since(since, limit=1000):
+    """Current state of the items changed after ``since``, and the ids of those deleted since."""
+    if since > current_cursor():
+        # The cursor is from another database (restored or recreated); start over.
+        return catalog_snapshot()
+
+    rows = db.session.execute(
+        select(InventoryChange.seq, InventoryChange.item_id)
+        .where(InventoryChange.seq > since)
+        .order_by(InventoryChange.seq)
+        .limit(limit)
+    ).all()
+    ids = [row.item_id for row in rows]
+    items = Inventory.query.filter(Inventory.id.in_(ids)).all() if ids else []
+    found = {item.id for item in items}
+    return {
+        "snapshot": False,
+        "cursor": rows[-1].seq if rows else since,
+        "items": [_item_dict(item) for item in items],
+        "deleted": [item_id for item_id in ids if item_id not in found],
+        "has_more": len(rows) == limit
+    }
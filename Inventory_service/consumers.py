@@ -0,0 +1,24 @@
+import logging
+
+from db import db
+from events import SALE_COMPLETED, init_events
+from models import StockMovement
+
+
+def finalize_sale_stock(event):
+    """Record the units a completed sale took out of stock.
+
+    The count itself was already reserved by Sales' stock step; this turns the
+    reservation into a permanent movement, once per event even when it is redelivered.
+    """
+    if StockMovement.query.filter_by(reference=event.key).first() is not None:
+        return
+    sale = event.payload
+    db.session.add(StockMovement(item_id=sale['item_id'], quantity=-sale['quantity'],
+                                 reason='sale', reference=event.key))
+    db.session.commit()
+    logging.info(f"Stock movement recorded for sale {sale['sale_id']}: item {sale['item_id']} -{sale['quantity']}")
+
+
+def init_consumers(app):
+    return init_events(app, group='inventory', handlers={SALE_COMPLETED: finalize_sale_stock})
@@ -0,0 +1,243 @@
+import abc
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import click
+from flask import current_app
+
+SALE_COMPLETED = 'SaleCompleted'
+SALE_FAILED = 'SaleFailed'
+
+LEASE_SECONDS = 30
+
+
+class Event:
+    __slots__ = ('id', 'topic', 'key', 'payload', 'created_at')
+
+    def __init__(self, id, topic, key, payload, created_at):
+        self.id = id
+        self.topic = topic
+        self.key = key
+        self.payload = payload
+        self.created_at = created_at
+
+
+class Broker(abc.ABC):
+    """What services need from a message broker; everything else is behind ``broker_from_url``.
+
+    Delivery is at least once: an event is only acknowledged after its handler returned,
+    so a crash in between redelivers it and handlers must be idempotent (``event.key``
+    is stable across redeliveries). Each consumer group sees every event of its topics.
+    """
+
+    @abc.abstractmethod
+    def publish(self, topic, payload, key=None):
+        """Append an event to ``topic`` and return its id."""
+
+    @abc.abstractmethod
+    def claim(self, group, owner):
+        """Lease ``group`` for ``owner``; False while another consumer holds it."""
+
+    @abc.abstractmethod
+    def poll(self, group, topics, limit=100):
+        """Up to ``limit`` events of ``topics`` after ``group``'s position, oldest first."""
+
+    @abc.abstractmethod
+    def ack(self, group, event):
+        """Move ``group`` past ``event`` once its handler returned."""
+
+    @abc.abstractmethod
+    def fail(self, group, event, error, max_attempts):
+        """Record a failed delivery; past ``max_attempts`` the event is dead-lettered and skipped."""
+
+
+class SQLiteBroker(Broker):
+    """Durable append-only event log in one SQLite file shared by the services (WAL mode).
+
+    Each consumer group keeps its position in the log plus a lease, so among several
+    workers of a service only one drains the group at a time, in order.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    topic TEXT NOT NULL,
+                    key TEXT,
+                    payload TEXT NOT NULL,
+                    created_at TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS ix_events_topic_id ON events (topic, id);
+                CREATE TABLE IF NOT EXISTS consumer_groups (
+                    name TEXT PRIMARY KEY,
+                    position INTEGER NOT NULL DEFAULT 0,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    lease_owner TEXT,
+                    lease_expires_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS dead_letters (
+                    group_name TEXT NOT NULL,
+                    event_id INTEGER NOT NULL,
+                    error TEXT,
+                    failed_at TEXT NOT NULL,
+                    PRIMARY KEY (group_name, event_id)
+                );
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def publish(self, topic, payload, key=None):
+        with self._connect() as conn:
+            cursor = conn.execute(
+                'INSERT INTO events (topic, key, payload, created_at) VALUES (?, ?, ?, ?)',
+                (topic, key, json.dumps(payload), datetime.utcnow().isoformat()))
+            return cursor.lastrowid
+
+    def claim(self, group, owner):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('INSERT OR IGNORE INTO consumer_groups (name) VALUES (?)', (group,))
+            cursor = conn.execute(
+                'UPDATE consumer_groups SET lease_owner = ?, lease_expires_at = ? '
+                'WHERE name = ? AND (lease_owner IS NULL OR lease_owner = ? OR lease_expires_at < ?)',
+                (owner, now + LEASE_SECONDS, group, owner, now))
+            return cursor.rowcount == 1
+
+    def poll(self, group, topics, limit=100):
+        placeholders = ', '.join('?' for _ in topics)
+        with self._connect() as conn:
+            row = conn.execute('SELECT position FROM consumer_groups WHERE name = ?', (group,)).fetchone()
+            rows = conn.execute(
+                f'SELECT id, topic, key, payload, created_at FROM events '
+                f'WHERE id > ? AND topic IN ({placeholders}) ORDER BY id LIMIT ?',
+                (row[0] if row else 0, *topics, limit)).fetchall()
+        return [Event(id, topic, key, json.loads(payload), created_at) for id, topic, key, payload, created_at in rows]
+
+    def ack(self, group, event):
+        with self._connect() as conn:
+            conn.execute('UPDATE consumer_groups SET position = ?, attempts = 0, last_error = NULL '
+                         'WHERE name = ? AND position < ?', (event.id, group, event.id))
+
+    def fail(self, group, event, error, max_attempts):
+        with self._connect() as conn:
+            conn.execute('UPDATE consumer_groups SET attempts = attempts + 1, last_error = ? WHERE name = ?',
+                         (error, group))
+            attempts = conn.execute('SELECT attempts FROM consumer_groups WHERE name = ?', (group,)).fetchone()[0]
+            if attempts < max_attempts:
+                return False
+            conn.execute('INSERT OR IGNORE INTO dead_letters (group_name, event_id, error, failed_at) '
+                         'VALUES (?, ?, ?, ?)', (group, event.id, error, datetime.utcnow().isoformat()))
+        logging.error(f"Event {event.id} ({event.topic}) dead-lettered for {group} after {attempts} attempts: {error}")
+        self.ack(group, event)
+        return True
+
+
+def broker_from_url(url):
+    """``sqlite:///path/to/events.db``; other brokers plug in here behind the same interface."""
+    if url.startswith('sqlite:///'):
+        return SQLiteBroker(url[len('sqlite:///'):])
+    raise ValueError(f"Unsupported EVENT_BROKER_URL: {url}")
+
+
+def get_broker():
+    return current_app.extensions.get('event_broker')
+
+
+class EventConsumer:
+    """Drains one consumer group in the background, calling ``handlers[topic](event)`` in an app context."""
+
+    def __init__(self, app, broker, group, handlers):
+        self.app = app
+        self.broker = broker
+        self.group = group
+        self.handlers = handlers
+        self.owner = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def drain_once(self, limit=100):
+        """Handle every pending event this consumer can get to. Returns how many were acknowledged."""
+        if not self.broker.claim(self.group, self.owner):
+            return 0
+        handled = 0
+        while True:
+            events = self.broker.poll(self.group, list(self.handlers), limit)
+            if not events:
+                return handled
+            for event in events:
+                try:
+                    with self.app.app_context():
+                        self.handlers[event.topic](event)
+                except Exception as e:
+                    logging.warning(f"{self.group} failed to handle event {event.id} ({event.topic}): {str(e)}")
+                    if not self.broker.fail(self.group, event, str(e), self.app.config['EVENT_MAX_ATTEMPTS']):
+                        return handled
+                    continue
+                self.broker.ack(self.group, event)
+                handled += 1
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f'events-{self.group}', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.drain_once()
+            except Exception as e:
+                logging.error(f"Event consumer {self.group} error: {str(e)}")
+            time.sleep(self.app.config['EVENT_POLL_INTERVAL'])
+
+
+def init_events(app, group=None, handlers=None):
+    """Connect to ``EVENT_BROKER_URL`` and, when ``handlers`` are given, consume them as ``group``.
+
+    Without a broker URL events are off: nothing is published and nothing consumed.
+    """
+    app.config.setdefault('EVENT_BROKER_URL', os.getenv('EVENT_BROKER_URL'))
+    app.config.setdefault('EVENT_CONSUMER', os.getenv('EVENT_CONSUMER', '1') == '1')
+    app.config.setdefault('EVENT_POLL_INTERVAL', float(os.getenv('EVENT_POLL_INTERVAL', '1.0')))
+    app.config.setdefault('EVENT_MAX_ATTEMPTS', int(os.getenv('EVENT_MAX_ATTEMPTS', '10')))
+    if not app.config['EVENT_BROKER_URL']:
+        return None
+
+    broker = broker_from_url(app.config['EVENT_BROKER_URL'])
+    app.extensions['event_broker'] = broker
+    if not handlers:
+        return None
+
+    consumer = EventConsumer(app, broker, group, handlers)
+    app.extensions['event_consumer'] = consumer
+
+    @app.before_request
+    def start_event_consumer():
+        if app.config['EVENT_CONSUMER']:
+            consumer.start()
+
+    @app.cli.command('consume-events')
+    @click.option('--once', is_flag=True, help='Handle the pending events once and exit.')
+    def consume_events_command(once):
+        """Run this service's event consumer in the foreground."""
+        while True:
+            handled = consumer.drain_once()
+            if once:
+                click.echo(json.dumps({'handled': handled}))
+                return
+            time.sleep(app.config['EVENT_POLL_INTERVAL'])
+
+    return consumer
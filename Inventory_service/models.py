@@ -7,3 +7,29 @@ class Inventory(db.Model):
     price_per_item = db.Column(db.Float, nullable=False)
     description = db.Column(db.Text)
     count_in_stock = db.Column(db.Integer, nullable=False)
+
+
+class InventoryChange(db.Model):
+    """Change log behind ``GET /inventory/changes``: one row per item, re-sequenced on every write.
+
+    AUTOINCREMENT keeps sequence numbers from being reused once an item's older row is dropped.
+    """
+    __tablename__ = 'inventory_changes'
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    seq = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, nullable=False, unique=True)
+    deleted = db.Column(db.Boolean, nullable=False, default=False)
+    changed_at = db.Column(db.DateTime, nullable=False)
+
+
+class StockMovement(db.Model):
+    """Append-only record of finalized stock changes; ``reference`` (the event key) makes replays no-ops."""
+    __tablename__ = 'stock_movements'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    item_id = db.Column(db.Integer, nullable=False, index=True)
+    quantity = db.Column(db.Integer, nullable=False)  # negative for units leaving stock
+    reason = db.Column(db.String(20), nullable=False)
+    reference = db.Column(db.String(80), nullable=False, unique=True)
+    created_at = db.Column(db.DateTime, default=db.func.now())
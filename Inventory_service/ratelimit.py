@@ -0,0 +1,207 @@
+import hashlib
+import hmac
+import ipaddress
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import jsonify, request
+
+# Refills the bucket from Redis' own clock so every host agrees on elapsed time.
+TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+
+
+class LocalBuckets:
+    """Token buckets in process memory; the least recently used buckets are dropped past ``max_keys``."""
+
+    def __init__(self, max_keys=10000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self._clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        """Take one token; return ``(allowed, retry_after_seconds)``."""
+        with self._lock:
+            now = self._clock()
+            tokens, last = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+
+class RedisBuckets:
+    """Token buckets shared by every worker and host through a redis-py compatible client."""
+
+    def __init__(self, client):
+        self.client = client
+        self._script = client.register_script(TOKEN_BUCKET_LUA)
+
+    @classmethod
+    def from_url(cls, url):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("redis is required when RATE_LIMIT_STORAGE_URL is set (pip install redis).") from e
+        return cls(redis.Redis.from_url(url))
+
+    def take(self, key, rate, burst):
+        allowed, tokens = self._script(keys=[key], args=[rate, burst])
+        allowed = int(allowed) == 1
+        return allowed, 0.0 if allowed else (1 - float(tokens)) / rate
+
+
+def _is_health_path(path):
+    return path.rstrip('/').endswith('/health') or '/health/' in path
+
+
+class LoadShedder:
+    """WSGI middleware that answers 503 at once while ``max_in_flight`` requests are already running.
+
+    It wraps the whole Flask app, so a shed request costs no routing, session or database
+    work, and overload shows up as fast retries instead of a growing queue. Health
+    endpoints always get through.
+    """
+
+    def __init__(self, wsgi_app, app):
+        self.wsgi_app = wsgi_app
+        self.app = app
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        max_in_flight = self.app.config['MAX_IN_FLIGHT_REQUESTS']
+        if not max_in_flight or _is_health_path(environ.get('PATH_INFO', '')):
+            return self.wsgi_app(environ, start_response)
+
+        with self._lock:
+            admitted = self.in_flight < max_in_flight
+            if admitted:
+                self.in_flight += 1
+        if not admitted:
+            logging.warning(f"Shedding load: {max_in_flight} requests in flight.")
+            start_response('503 SERVICE UNAVAILABLE', [('Content-Type', 'application/json'), ('Retry-After', '1')])
+            return [b'{"error": "Service is overloaded, please retry shortly."}\n']
+        try:
+            return self.wsgi_app(environ, start_response)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+class RateLimiter:
+    """Per-client, per-route token buckets.
+
+    Every request spends from its IP's bucket; one that carries an ``Authorization``
+    header also spends from that credential's bucket. The credential is not verified
+    here, so it can only narrow a client's limit: rotating it never buys a fresh bucket.
+    Requests over the limit get 429 with ``Retry-After``. Health endpoints are never
+    limited, and backend errors let the request through.
+
+    Calls between the services are not limited either: they all come from a handful of
+    container IPs, so sharing per-IP buckets would throttle every saga step at once. They
+    are recognised by the shared ``SERVICE_TOKEN`` (``X-Service-Token``), or by a peer
+    address in ``RATE_LIMIT_EXEMPT_NETWORKS`` where internal traffic has its own network.
+    """
+
+    def __init__(self, app, buckets):
+        self.app = app
+        self.buckets = buckets
+
+    def _client_ids(self):
+        if self.app.config['RATE_LIMIT_TRUST_PROXY'] and request.headers.get('X-Forwarded-For'):
+            client_ids = ['ip:' + request.headers['X-Forwarded-For'].split(',')[0].strip()]
+        else:
+            client_ids = [f'ip:{request.remote_addr}']
+        auth = request.headers.get('Authorization')
+        if auth:
+            client_ids.append('auth:' + hashlib.sha256(auth.encode('utf-8')).hexdigest()[:32])
+        return client_ids
+
+    def _internal(self):
+        token = self.app.config['SERVICE_TOKEN']
+        supplied = request.headers.get('X-Service-Token')
+        if token and supplied and hmac.compare_digest(supplied.encode('utf-8'), token.encode('utf-8')):
+            return True
+        networks = self.app.config['RATE_LIMIT_EXEMPT_NETWORKS']
+        if not networks or not request.remote_addr:
+            return False
+        # The socket peer only: X-Forwarded-For is client-controlled.
+        try:
+            address = ipaddress.ip_address(request.remote_addr)
+        except ValueError:
+            return False
+        return any(address in network for network in networks)
+
+    def _exempt(self):
+        endpoint = request.endpoint or ''
+        return any(name in endpoint for name in ('health', 'liveness', 'readiness')) or self._internal()
+
+    def before_request(self):
+        config = self.app.config
+        if not config['RATE_LIMIT_ENABLED'] or self._exempt():
+            return None
+
+        rate, burst = config['RATE_LIMIT_ROUTES'].get(
+            request.endpoint, (config['RATE_LIMIT_RATE'], config['RATE_LIMIT_BURST']))
+        for client_id in self._client_ids():
+            key = f"ratelimit:{request.endpoint}:{client_id}"
+            try:
+                allowed, retry_after = self.buckets.take(key, rate, burst)
+            except Exception as e:
+                logging.error(f"Rate limiter unavailable: {str(e)}")
+                return None
+            if not allowed:
+                logging.warning(f"Rate limit exceeded for {key}")
+                response = jsonify({"error": "Too many requests."})
+                response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+                return response, 429
+        return None
+
+
+def init_rate_limiting(app):
+    """Rate limits are ``(tokens per second, burst)``; ``RATE_LIMIT_ROUTES`` overrides them per endpoint."""
+    app.config.setdefault('RATE_LIMIT_ENABLED', os.getenv('RATE_LIMIT_ENABLED', '1') == '1')
+    app.config.setdefault('RATE_LIMIT_RATE', float(os.getenv('RATE_LIMIT_RATE', '20')))
+    app.config.setdefault('RATE_LIMIT_BURST', float(os.getenv('RATE_LIMIT_BURST', '40')))
+    app.config.setdefault('RATE_LIMIT_ROUTES', {})
+    app.config.setdefault('RATE_LIMIT_TRUST_PROXY', os.getenv('RATE_LIMIT_TRUST_PROXY', '0') == '1')
+    app.config.setdefault('SERVICE_TOKEN', os.getenv('SERVICE_TOKEN'))
+    app.config.setdefault('RATE_LIMIT_EXEMPT_NETWORKS', [
+        ipaddress.ip_network(cidr.strip())
+        for cidr in os.getenv('RATE_LIMIT_EXEMPT_NETWORKS', '').split(',') if cidr.strip()])
+    app.config.setdefault('RATE_LIMIT_STORAGE_URL', os.getenv('RATE_LIMIT_STORAGE_URL', os.getenv('CACHE_URL')))
+    app.config.setdefault('MAX_IN_FLIGHT_REQUESTS', int(os.getenv('MAX_IN_FLIGHT_REQUESTS', '64')))
+
+    url = app.config['RATE_LIMIT_STORAGE_URL']
+    limiter = RateLimiter(app, RedisBuckets.from_url(url) if url else LocalBuckets())
+    app.before_request(limiter.before_request)
+    app.extensions['rate_limiter'] = limiter
+    app.wsgi_app = app.extensions['load_shedder'] = LoadShedder(app.wsgi_app, app)
+    return limiter
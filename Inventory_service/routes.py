@@ -2,16 +2,17 @@ import logging
 from flask import Blueprint, request, jsonify
 from models import Inventory
 from db import db
+from search import search_inventory
+from changes import catalog_snapshot, changes_since
+from idempotency import idempotent
+from routing import read_only
+from cache import get_cache
+from http_cache import conditional
 from sqlalchemy.sql import text
 
 
 inventory_bp = Blueprint('inventory_bp', __name__)
 
-logging.basicConfig(
-    filename='inventory_service.log',  # Log file
-    level=logging.INFO,  # Logging level
-    format='%(asctime)s - %(levelname)s - %(message)s'  # Log format
-)
 
 @inventory_bp.route('/health', methods=['GET'])
 def health_check():
@@ -39,6 +40,7 @@ def default_route():
         return {"error": f"An unexpected error occurred: {str(e)}"}, 500
 
 @inventory_bp.route('/inventory', methods=['POST'])
+@idempotent
 def add_goods():
     try:
         logging.info("Request received to add a new good.")
@@ -74,6 +76,7 @@ def add_goods():
             count_in_stock=data['count_in_stock']
         )
         db.session.add(item)
+        get_cache().invalidate_on_commit(db.session, 'catalog')
         db.session.commit()
 
         logging.info(f"Good added successfully: {data['name']}")
@@ -84,6 +87,7 @@ def add_goods():
         return {"error": f"An unexpected error occurred: {str(e)}"}, 500
 
 @inventory_bp.route('/inventory/<int:item_id>', methods=['DELETE'])
+@idempotent
 def delete_goods(item_id):
     try:
         logging.info(f"Request received to delete item with ID: {item_id}")
@@ -94,6 +98,7 @@ def delete_goods(item_id):
             return {"error": "Item not found."}, 404
 
         db.session.delete(item)
+        get_cache().invalidate_on_commit(db.session, 'catalog')
         db.session.commit()
         logging.info(f"Item with ID {item_id} deleted successfully.")
         return {"message": "Item removed successfully!"}, 200
@@ -103,6 +108,7 @@ def delete_goods(item_id):
         return {"error": f"An unexpected error occurred: {str(e)}"}, 500
     
 @inventory_bp.route('inventory/<int:item_id>', methods=['PUT'])
+@idempotent
 def update_goods(item_id):
     try:
         logging.info(f"Request received to update item with ID: {item_id}")
@@ -135,6 +141,7 @@ def update_goods(item_id):
                 return {"error": "count_in_stock must be a valid integer."}, 400
 
         item.description = data.get('description', item.description)
+        get_cache().invalidate_on_commit(db.session, 'catalog')
         db.session.commit()
 
         logging.info(f"Item with ID {item_id} updated successfully.")
@@ -144,25 +151,121 @@ def update_goods(item_id):
         logging.error(f"Error while updating item with ID {item_id}: {str(e)}")
         return {"error": f"An unexpected error occurred: {str(e)}"}, 500
 
+@inventory_bp.route('/inventory/<int:item_id>/deduct', methods=['POST'])
+@idempotent
+def deduct_stock(item_id):
+    # Relative, so a retried request carries the same body however the stock moved in between.
+    try:
+        data = request.json
+        if not data or not isinstance(data, dict):
+            logging.warning(f"Invalid request body for deducting stock of item: {item_id}")
+            return {"error": "Invalid JSON or empty request body."}, 400
+        quantity = data.get('quantity')
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity <= 0:
+            logging.warning(f"Invalid quantity for deducting stock of item {item_id}: {quantity}")
+            return {"error": "quantity must be a positive integer."}, 400
+
+        # Locked where the database supports it, so concurrent sales never both take the last unit.
+        item = Inventory.query.filter_by(id=item_id).with_for_update().first()
+        if not item:
+            logging.warning(f"Item with ID {item_id} not found.")
+            return {"error": "Item not found."}, 404
+        if item.count_in_stock < quantity:
+            logging.warning(f"Insufficient stock for item {item_id}: {item.count_in_stock} < {quantity}")
+            return {"error": "Insufficient stock."}, 400
+
+        item.count_in_stock -= quantity
+        get_cache().invalidate_on_commit(db.session, 'catalog')
+        db.session.commit()
+
+        logging.info(f"Deducted {quantity} from stock of item {item_id}; {item.count_in_stock} left.")
+        return {"message": "Stock deducted.", "count_in_stock": item.count_in_stock}, 200
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error while deducting stock of item {item_id}: {str(e)}")
+        return {"error": f"An unexpected error occurred: {str(e)}"}, 500
+
+def _catalog_snapshot():
+    return [{
+        "id": item.id,
+        "name": item.name,
+        "category": item.category,
+        "price_per_item": item.price_per_item,
+        "description": item.description,
+        "count_in_stock": item.count_in_stock
+    } for item in Inventory.query.all()]
+
 @inventory_bp.route('/inventory', methods=['GET'])
+@read_only
+@conditional(Inventory.__tablename__)
 def get_all_goods():
     try:
         logging.info("Request received to fetch all goods.")
-        items = Inventory.query.all()
+        # Shared across workers when CACHE_URL is set; every write to the inventory invalidates it.
+        goods = get_cache().get_or_load('catalog', 'all', _catalog_snapshot)
 
-        if not items:
+        if not goods:
             logging.info("No goods found in inventory.")
             return {"message": "No items in inventory."}, 200
 
-        logging.info(f"Fetched {len(items)} goods from inventory.")
-        return jsonify([{
-            "id": item.id,
-            "name": item.name,
-            "category": item.category,
-            "price_per_item": item.price_per_item,
-            "description": item.description,
-            "count_in_stock": item.count_in_stock
-        } for item in items]), 200
+        logging.info(f"Fetched {len(goods)} goods from inventory.")
+        return jsonify(goods), 200
     except Exception as e:
         logging.error(f"Error while fetching all goods: {str(e)}")
-        return {"error": f"An unexpected error occurred: {str(e)}"}, 500
\ No newline at end of file
+        return {"error": f"An unexpected error occurred: {str(e)}"}, 500
+
+@inventory_bp.route('/inventory/changes', methods=['GET'])
+@read_only
+@conditional(Inventory.__tablename__)
+def get_inventory_changes():
+    try:
+        try:
+            since = request.args.get('since')
+            since = int(since) if since is not None else None
+            limit = int(request.args.get('limit', 1000))
+        except ValueError:
+            logging.warning("Invalid cursor or limit for inventory changes.")
+            return {"error": "since and limit must be valid integers."}, 400
+        if (since is not None and since < 0) or not (1 <= limit <= 5000):
+            return {"error": "since must be >= 0 and limit between 1 and 5000."}, 400
+
+        # Without a cursor the caller gets a full snapshot to start from.
+        result = catalog_snapshot() if since is None else changes_since(since, limit)
+        logging.info(f"Inventory changes since {since}: {len(result['items'])} items, {len(result['deleted'])} deleted.")
+        return jsonify(result), 200
+    except Exception as e:
+        logging.error(f"Error while fetching inventory changes: {str(e)}")
+        return {"error": f"An unexpected error occurred: {str(e)}"}, 500
+
+@inventory_bp.route('/inventory/search', methods=['GET'])
+@read_only
+@conditional(Inventory.__tablename__)
+def search_goods():
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            logging.warning("Search request without a query.")
+            return {"error": "q is required."}, 400
+
+        try:
+            page = int(request.args.get('page', 1))
+            per_page = int(request.args.get('per_page', 20))
+        except ValueError:
+            logging.warning("Invalid pagination parameters for search.")
+            return {"error": "page and per_page must be valid integers."}, 400
+        if page < 1 or not (1 <= per_page <= 100):
+            return {"error": "page must be >= 1 and per_page between 1 and 100."}, 400
+
+        category = request.args.get('category')
+        results = search_inventory(query, category=category, limit=per_page, offset=(page - 1) * per_page)
+
+        logging.info(f"Search for '{query}' returned {min(len(results), per_page)} goods.")
+        return jsonify({
+            "results": results[:per_page],
+            "page": page,
+            "per_page": per_page,
+            "has_more": len(results) > per_page
+        }), 200
+    except Exception as e:
+        logging.error(f"Error while searching goods: {str(e)}")
+        return {"error": f"An unexpected error occurred: {str(e)}"}, 500
@@ -0,0 +1,103 @@
+import re
+from sqlalchemy import DDL, event
+from sqlalchemy.sql import text
+from db import db
+from models import Inventory
+
+# External-content FTS5 index: the text lives once in `inventory`, the index only
+# stores tokens. `prefix` builds extra indexes so short prefix queries stay fast.
+SEARCH_INDEX_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS inventory_fts USING fts5(
+        name, category, description,
+        content='inventory', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS inventory_fts_ai AFTER INSERT ON inventory BEGIN
+        INSERT INTO inventory_fts(rowid, name, category, description)
+        VALUES (new.id, new.name, new.category, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS inventory_fts_ad AFTER DELETE ON inventory BEGIN
+        INSERT INTO inventory_fts(inventory_fts, rowid, name, category, description)
+        VALUES ('delete', old.id, old.name, old.category, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS inventory_fts_au AFTER UPDATE OF name, category, description ON inventory BEGIN
+        INSERT INTO inventory_fts(inventory_fts, rowid, name, category, description)
+        VALUES ('delete', old.id, old.name, old.category, old.description);
+        INSERT INTO inventory_fts(rowid, name, category, description)
+        VALUES (new.id, new.name, new.category, new.description);
+    END""",
+    # Re-sync with whatever is already in `inventory` (existing databases, re-created tables).
+    "INSERT INTO inventory_fts(inventory_fts) VALUES ('rebuild')",
+]
+
+# Column weights for bm25(): a hit in the name outranks category, which outranks description.
+RANK_EXPRESSION = 'bm25(inventory_fts, 10.0, 4.0, 1.0)'
+
+for statement in SEARCH_INDEX_DDL:
+    event.listen(Inventory.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Inventory.__table__, 'before_drop',
+             DDL('DROP TABLE IF EXISTS inventory_fts').execute_if(dialect='sqlite'))
+
+
+def ensure_search_index():
+    """Create the search index and its triggers on a database whose tables already exist."""
+    if db.engine.dialect.name != 'sqlite':
+        return
+    with db.engine.begin() as conn:
+        exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'inventory_fts'")).first()
+        if exists:
+            return
+        for statement in SEARCH_INDEX_DDL:
+            conn.execute(text(statement))
+
+
+def build_match_query(query):
+    """Turn free text into an FTS5 query: every term must match, each as a prefix."""
+    terms = re.findall(r'\w+', query.lower())
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def search_inventory(query, category=None, limit=20, offset=0):
+    """Return up to ``limit`` ranked matches (plus one extra row to detect a next page)."""
+    match = build_match_query(query)
+    if not match:
+        return []
+
+    if db.engine.dialect.name != 'sqlite':
+        pattern = f'%{query}%'
+        items = Inventory.query.filter(
+            db.or_(Inventory.name.ilike(pattern), Inventory.category.ilike(pattern),
+                   Inventory.description.ilike(pattern))
+        )
+        if category:
+            items = items.filter(Inventory.category == category)
+        return [_row_to_dict(item, None) for item in items.order_by(Inventory.id).offset(offset).limit(limit + 1)]
+
+    sql = (
+        f'SELECT i.id, i.name, i.category, i.price_per_item, i.description, i.count_in_stock, '
+        f'{RANK_EXPRESSION} AS score '
+        f'FROM inventory_fts JOIN inventory i ON i.id = inventory_fts.rowid '
+        f'WHERE inventory_fts MATCH :match '
+    )
+    params = {'match': match, 'limit': limit + 1, 'offset': offset}
+    if category:
+        sql += 'AND i.category = :category '
+        params['category'] = category
+    sql += 'ORDER BY score LIMIT :limit OFFSET :offset'
+
+    rows = db.session.execute(text(sql), params)
+    return [_row_to_dict(row, row.score) for row in rows]
+
+
+def _row_to_dict(row, score):
+    result = {
+        "id": row.id,
+        "name": row.name,
+        "category": row.category,
+        "price_per_item": row.price_per_item,
+        "description": row.description,
+        "count_in_stock": row.count_in_stock
+    }
+    if score is not None:
+        result["score"] = score
+    return result
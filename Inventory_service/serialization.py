@@ -0,0 +1,49 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import msgpack
+except ImportError:  # optional: without it every response stays JSON
+    msgpack = None
+
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+
+def wants_msgpack():
+    if msgpack is None or not has_request_context():
+        return False
+    return request.accept_mimetypes.best_match(['application/json', MSGPACK_MIMETYPE]) == MSGPACK_MIMETYPE
+
+
+class NegotiatingJSONProvider(DefaultJSONProvider):
+    """JSON provider that answers with MessagePack when the client asks for it in ``Accept``.
+
+    Every ``jsonify(...)`` and every dict or list returned from a view goes through
+    ``response()``, so views do not change. Internal clients send
+    ``Accept: application/msgpack`` and skip JSON text encoding and parsing entirely.
+    """
+
+    def response(self, *args, **kwargs):
+        if not wants_msgpack():
+            response = super().response(*args, **kwargs)
+        else:
+            obj = self._prepare_response_obj(args, kwargs)
+            response = self._app.response_class(msgpack.packb(obj, default=_default), mimetype=MSGPACK_MIMETYPE)
+        if msgpack is not None:
+            response.vary.add('Accept')
+        return response
+
+
+def init_serialization(app):
+    app.json = NegotiatingJSONProvider(app)
@@ -77,6 +77,20 @@ def test_deduct_goods(client):
     assert response.status_code == 200
     assert response.json['message'] == "Item removed successfully!"
 
+def test_deduct_stock_is_relative_and_safe_to_retry(client):
+    client.post('/api/v1/inventory', json={
+        "name": "Mouse", "category": "Electronics", "price_per_item": 20, "count_in_stock": 5
+    })
+    headers = {"Idempotency-Key": "sale-3-stock"}
+    for _ in range(2):
+        response = client.post('/api/v1/inventory/1/deduct', json={"quantity": 2}, headers=headers)
+        assert response.status_code == 200
+        assert response.json['count_in_stock'] == 3
+
+    assert client.post('/api/v1/inventory/1/deduct', json={"quantity": 4}).status_code == 400
+    assert client.post('/api/v1/inventory/1/deduct', json={"quantity": 0}).status_code == 400
+    assert client.get('/api/v1/inventory').json[0]['count_in_stock'] == 3
+
 # Test for missing required fields
 def test_add_goods_missing_fields(client):
     response = client.post('/api/v1/inventory', json={
@@ -85,3 +99,241 @@ def test_add_goods_missing_fields(client):
     })
     assert response.status_code == 400
     assert "price_per_item is required." in response.json['error']
+
+# Test for full-text search with prefix matching and category filter
+def test_search_goods(client):
+    for name, category, description in [
+        ("Gaming Laptop", "Electronics", "Fast laptop with a great keyboard"),
+        ("Laptop Sleeve", "Accessories", "Protective sleeve"),
+        ("Keyboard", "Electronics", "Mechanical keyboard"),
+    ]:
+        client.post('/api/v1/inventory', json={
+            "name": name,
+            "category": category,
+            "price_per_item": 50,
+            "description": description,
+            "count_in_stock": 5
+        })
+
+    response = client.get('/api/v1/inventory/search?q=lapt')
+    assert response.status_code == 200
+    assert {item['name'] for item in response.json['results']} == {"Gaming Laptop", "Laptop Sleeve"}
+
+    response = client.get('/api/v1/inventory/search?q=lapt&category=Accessories')
+    assert [item['name'] for item in response.json['results']] == ["Laptop Sleeve"]
+
+    # Renames are picked up by the sync triggers.
+    client.put('/api/v1/inventory/3', json={"name": "Clicky Board"})
+    response = client.get('/api/v1/inventory/search?q=clicky')
+    assert [item['name'] for item in response.json['results']] == ["Clicky Board"]
+
+def test_search_without_fts_matches_the_category_too(client, monkeypatch):
+    from db import db
+    from search import search_inventory
+    client.post('/api/v1/inventory', json={"name": "Sleeve", "category": "Accessories", "price_per_item": 10,
+                                           "description": "Protective", "count_in_stock": 5})
+    with client.application.app_context():
+        monkeypatch.setattr(db.engine.dialect, 'name', 'postgresql')  # take the ILIKE fallback
+        assert [item['name'] for item in search_inventory('access')] == ["Sleeve"]
+
+class FakeRedis:
+    """Just enough of the redis-py API for the cache backend."""
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        value = self.data.get(key)
+        return value.encode() if value is not None else None
+
+    def set(self, key, value, px=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = str(value)
+        return True
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def incr(self, key):
+        self.data[key] = str(int(self.data.get(key, 0)) + 1)
+        return int(self.data[key])
+
+# Test that the catalog is served from the shared cache and invalidated by writes
+def test_catalog_cache_is_shared_and_invalidated(client):
+    from cache import Cache, RedisBackend
+    redis = FakeRedis()
+    client.application.extensions['cache'] = Cache(RedisBackend(redis), prefix='test')
+
+    client.post('/api/v1/inventory', json={
+        "name": "Laptop",
+        "category": "Electronics",
+        "price_per_item": 1000,
+        "description": "High-end gaming laptop",
+        "count_in_stock": 10
+    })
+    assert client.get('/api/v1/inventory').json[0]['price_per_item'] == 1000
+    assert any(key.startswith('test:catalog:') for key in redis.data)
+
+    # Another worker sharing the backend sees the entry; a write bumps the namespace version.
+    other_worker = Cache(RedisBackend(redis), prefix='test')
+    assert other_worker.get('catalog', 'all')[0]['name'] == "Laptop"
+    client.put('/api/v1/inventory/1', json={"price_per_item": 1200})
+    assert other_worker.get('catalog', 'all') is None
+    assert client.get('/api/v1/inventory').json[0]['price_per_item'] == 1200
+
+# Test per-route rate limiting and load shedding
+def test_rate_limit_and_load_shedding(client):
+    app = client.application
+    app.config['RATE_LIMIT_ROUTES'] = {'inventory_bp.get_all_goods': (0.01, 2)}
+
+    assert client.get('/api/v1/inventory').status_code == 200
+    assert client.get('/api/v1/inventory').status_code == 200
+    response = client.get('/api/v1/inventory')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+
+    # Buckets are per client: another address still gets through...
+    assert client.get('/api/v1/inventory', environ_base={'REMOTE_ADDR': '10.1.2.3'}).status_code == 200
+    # ...but a fresh, unverified Authorization value on every request does not.
+    for attempt in range(3):
+        assert client.get('/api/v1/inventory', headers={'Authorization': f'Bearer random-{attempt}'}).status_code == 429
+
+    # Calls from the other services carry the shared service token and are never limited.
+    app.config['SERVICE_TOKEN'] = 'internal-secret'
+    for _ in range(3):
+        assert client.get('/api/v1/inventory', headers={'X-Service-Token': 'internal-secret'}).status_code == 200
+    assert client.get('/api/v1/inventory', headers={'X-Service-Token': 'guess'}).status_code == 429
+
+    shedder = app.extensions['load_shedder']
+    app.config['MAX_IN_FLIGHT_REQUESTS'] = 1
+    shedder.in_flight = 1  # pretend a request is already running
+    assert client.get('/api/v1/inventory/search?q=x').status_code == 503
+    assert client.get('/api/v1/health').status_code != 503
+    shedder.in_flight = 0
+    assert client.get('/api/v1/inventory/search?q=x').status_code == 200
+
+# Test conditional requests and negotiated compression on the catalog
+def test_catalog_etag_and_compression(client):
+    import gzip
+    import json
+
+    def add(name):
+        client.post('/api/v1/inventory', json={
+            "name": name,
+            "category": "Electronics",
+            "price_per_item": 10,
+            "description": "x" * 200,
+            "count_in_stock": 3
+        })
+
+    add("Laptop")
+    response = client.get('/api/v1/inventory')
+    etag = response.headers['ETag']
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert client.get('/api/v1/inventory', headers={'If-None-Match': etag}).status_code == 304
+
+    for i in range(10):
+        add(f"Mouse {i}")
+    response = client.get('/api/v1/inventory', headers={'If-None-Match': etag, 'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(json.loads(gzip.decompress(response.get_data()))) == 11
+
+# Test that If-Modified-Since never hides a write made in the same second as Last-Modified
+def test_if_modified_since_is_not_answered_on_an_equal_second(client):
+    from datetime import timedelta
+    from email.utils import format_datetime
+
+    def add(name):
+        client.post('/api/v1/inventory', json={
+            "name": name,
+            "category": "Electronics",
+            "price_per_item": 10,
+            "description": "x",
+            "count_in_stock": 3
+        })
+
+    add("Laptop")
+    last_modified = client.get('/api/v1/inventory').last_modified
+    add("Mouse")
+    response = client.get('/api/v1/inventory', headers={'If-Modified-Since': format_datetime(last_modified, usegmt=True)})
+    assert response.status_code == 200
+    assert len(response.json) == 2
+
+    later = format_datetime(response.last_modified + timedelta(seconds=1), usegmt=True)
+    assert client.get('/api/v1/inventory', headers={'If-Modified-Since': later}).status_code == 304
+
+# Test MessagePack content negotiation
+def test_inventory_list_in_msgpack(client):
+    msgpack = pytest.importorskip('msgpack')
+    client.post('/api/v1/inventory', json={
+        "name": "Laptop",
+        "category": "Electronics",
+        "price_per_item": 1000,
+        "description": "High-end gaming laptop",
+        "count_in_stock": 10
+    })
+
+    response = client.get('/api/v1/inventory', headers={'Accept': 'application/msgpack, application/json;q=0.9'})
+    assert response.mimetype == 'application/msgpack'
+    assert msgpack.unpackb(response.get_data())[0]['name'] == "Laptop"
+    assert 'Accept' in response.headers['Vary']
+
+    assert client.get('/api/v1/inventory').json[0]['name'] == "Laptop"
+
+# Test the incremental change feed used by the Sales catalog replica
+def test_inventory_changes_feed(client):
+    def add(name):
+        return client.post('/api/v1/inventory', json={
+            "name": name,
+            "category": "Electronics",
+            "price_per_item": 10,
+            "count_in_stock": 3
+        })
+
+    add("Laptop")
+    snapshot = client.get('/api/v1/inventory/changes').json
+    assert snapshot['snapshot'] is True
+    assert [item['name'] for item in snapshot['items']] == ["Laptop"]
+    cursor = snapshot['cursor']
+
+    unchanged = client.get(f'/api/v1/inventory/changes?since={cursor}').json
+    assert unchanged['items'] == [] and unchanged['cursor'] == cursor
+
+    add("Mouse")
+    client.put('/api/v1/inventory/1', json={"price_per_item": 12})
+    client.put('/api/v1/inventory/1', json={"count_in_stock": 2})
+    client.delete('/api/v1/inventory/2')
+    changes = client.get(f'/api/v1/inventory/changes?since={cursor}').json
+    assert changes['snapshot'] is False
+    # Each item shows up once, in its current state.
+    assert [(item['name'], item['price_per_item'], item['count_in_stock']) for item in changes['items']] == [("Laptop", 12, 2)]
+    assert changes['deleted'] == [2]
+    assert changes['cursor'] > cursor
+
+    assert client.get(f"/api/v1/inventory/changes?since={changes['cursor'] + 100}").json['snapshot'] is True
+    assert client.get('/api/v1/inventory/changes?since=abc').status_code == 400
+
+# Test the opt-in sampling profiler endpoints
+def test_sampling_profiler_returns_collapsed_stacks(monkeypatch):
+    monkeypatch.setenv('PROFILER_ENABLED', '1')
+    monkeypatch.setenv('PROFILER_TOKEN', 'secret')
+    app = create_app()
+    client = app.test_client()
+
+    assert client.get('/api/v1/admin/profile?seconds=0.1').status_code == 403
+    assert client.get('/api/v1/admin/profile?seconds=500', headers={'Authorization': 'Bearer secret'}).status_code == 400
+
+    response = client.get('/api/v1/admin/profile?seconds=0.2&interval=0.005', headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 200
+    assert int(response.headers['X-Profile-Samples']) > 0
+    stack, count = response.get_data(as_text=True).splitlines()[0].rsplit(' ', 1)
+    assert int(count) > 0
+    # The request thread itself was sampled while it waited for the window to end.
+    assert 'profile_window (sampling_profiler.py' in response.get_data(as_text=True)
+
+    assert client.post('/api/v1/admin/profile/start', headers={'Authorization': 'Bearer secret'}).status_code == 202
+    assert client.post('/api/v1/admin/profile/start', headers={'Authorization': 'Bearer secret'}).status_code == 409
+    assert client.post('/api/v1/admin/profile/stop', headers={'Authorization': 'Bearer secret'}).status_code == 200
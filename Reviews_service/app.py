@@ -1,35 +1,79 @@
 # app.py
 
+from startup import configure_logging, initialize, report_startup  # first, so STARTUP_PROFILE sees every import
+from functools import partial
+
+import click
 from flask import Flask
+from flask.cli import with_appcontext
 from models import db
 from routes import reviews_bp
+from routing import init_replica
+from cache import init_cache
+from ratelimit import init_rate_limiting
+from http_cache import init_http_cache
+from query_profiler import init_query_profiler
+from sampling_profiler import init_sampling_profiler
+from search import ensure_search_index
+from ratings import ensure_rating_summaries
+from archive import init_archive
+from eligibility import init_eligibility
+from consumers import init_consumers
+from health import init_health, dependency_probe
+from clients import customers_client, inventory_client, sales_client
 import os
-import logging
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create the tables, the search index and the rating summaries. Run once per deploy, not in every worker."""
+    db.create_all()
+    ensure_search_index()
+    ensure_rating_summaries()
+    click.echo("Database initialized.")
+
 
 def create_app():
+    configure_logging('reviews_service.log')
     app = Flask(__name__)
 
     # Configuration
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///reviews.db'  
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///reviews.db'
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-    
-    # Initialize the database
-    db.init_app(app)
+
+    # Initialize the database (read-only routes use the replica bind when one is configured)
+    initialize(
+        app,
+        init_replica,
+        db.init_app,
+        init_query_profiler,
+        partial(init_sampling_profiler, url_prefix='/reviews'),
+        init_cache,
+        init_rate_limiting,
+        partial(init_http_cache, db=db),
+        init_eligibility,
+        init_consumers,
+    )
 
     # Register blueprints
     app.register_blueprint(reviews_bp, url_prefix='/reviews')
+    app.cli.add_command(init_db_command)
+
+    # Old moderated reviews move to monthly archive databases (flask archive-reviews)
+    init_archive(app)
 
-    # Create the database tables
-    with app.app_context():
-        db.create_all()
+    # Background health monitor; dependencies are reported but do not gate readiness
+    app.config['HEALTH_CHECK_INTERVAL'] = float(os.getenv('HEALTH_CHECK_INTERVAL', '5'))
+    app.config['HEALTH_PROBE_TIMEOUT'] = float(os.getenv('HEALTH_PROBE_TIMEOUT', '2'))
+    health = init_health(app, url_prefix='/reviews')
+    health.add_probe('customer_service', dependency_probe(customers_client), critical=False)
+    health.add_probe('inventory_service', dependency_probe(inventory_client), critical=False)
+    health.add_probe('sales_service', dependency_probe(sales_client), critical=False)
 
+    report_startup(app)
     return app
 
 if __name__ == '__main__':
     app = create_app()
-    log_file_path = os.path.join(os.getcwd(), 'reviews_service.log')
-    logging.basicConfig(
-    filename=log_file_path,
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s')
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,163 @@
+import glob
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import create_engine, delete, select
+from sqlalchemy.orm import Session
+
+from models import db, Review, ReviewArchiveSummary
+from ratings import refresh_rating_summaries
+
+ARCHIVE_PREFIX = 'reviews_'
+DEFAULT_BATCH_SIZE = 1000
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def archive_cutoff(older_than_days=None):
+    days = older_than_days if older_than_days is not None else current_app.config['ARCHIVE_AFTER_DAYS']
+    return datetime.utcnow() - timedelta(days=days)
+
+
+def _month_of(value):
+    return value.strftime('%Y-%m')
+
+
+def _archive_path(month):
+    return os.path.join(os.path.abspath(current_app.config['ARCHIVE_DIR']), f"{ARCHIVE_PREFIX}{month.replace('-', '_')}.db")
+
+
+def _archive_engine(month, create=False):
+    """Engine on the archive database of ``month`` (``YYYY-MM``), or None if it does not exist yet."""
+    path = _archive_path(month)
+    with _engines_lock:
+        engine = _engines.get(path)
+        if engine is None:
+            if not create and not os.path.exists(path):
+                return None
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            engine = create_engine(f'sqlite:///{path}')
+            Review.__table__.create(engine, checkfirst=True)
+            _engines[path] = engine
+        return engine
+
+
+def archived_months():
+    """Months that have an archive database, oldest first."""
+    pattern = os.path.join(os.path.abspath(current_app.config['ARCHIVE_DIR']), f'{ARCHIVE_PREFIX}*.db')
+    names = (os.path.basename(path)[len(ARCHIVE_PREFIX):-len('.db')] for path in glob.glob(pattern))
+    return sorted(name.replace('_', '-') for name in names)
+
+
+def reaches_archives(since):
+    """Whether archived reviews can be on or after ``since``.
+
+    Decided from the archives that exist, not from ``ARCHIVE_AFTER_DAYS``: an archive run
+    with a shorter ``--older-than-days`` moves rows the configured cutoff would keep hot.
+    """
+    months = archived_months()
+    return bool(months) and _month_of(since) <= months[-1]
+
+
+def _copy(review):
+    return Review(
+        id=review.id,
+        customer_username=review.customer_username,
+        item_name=review.item_name,
+        rating=review.rating,
+        comment=review.comment,
+        status=review.status,
+        created_at=review.created_at,
+        updated_at=review.updated_at,
+    )
+
+
+def _write_archive(month, reviews):
+    # Rows already archived by an earlier, interrupted run are skipped, so re-running is safe.
+    ids = [r.id for r in reviews]
+    with Session(_archive_engine(month, create=True)) as archive:
+        existing = set(archive.scalars(select(Review.id).where(Review.id.in_(ids))))
+        archive.add_all([_copy(r) for r in reviews if r.id not in existing])
+        archive.commit()
+
+
+def _add_to_summary(month, reviews):
+    for review in reviews:
+        summary = db.session.get(ReviewArchiveSummary, (month, review.item_name))
+        if summary is None:
+            summary = ReviewArchiveSummary(month=month, item_name=review.item_name,
+                                           review_count=0, approved_count=0, rating_sum=0)
+            db.session.add(summary)
+        summary.review_count += 1
+        if review.status == 'approved':
+            summary.approved_count += 1
+            summary.rating_sum += review.rating
+
+
+def archive_reviews(older_than_days=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Move moderated reviews older than the cutoff into monthly archive databases.
+
+    Pending reviews stay put until they are moderated. Each batch is committed to its
+    archive first, then deleted from the hot database in the same transaction that
+    updates ``review_archive_summaries``, so product rating summaries are unchanged.
+    """
+    cutoff = archive_cutoff(older_than_days)
+    moved = 0
+    while True:
+        batch = db.session.scalars(
+            select(Review)
+            .where(Review.created_at < cutoff, Review.status != 'pending')
+            .order_by(Review.id)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            break
+
+        by_month = {}
+        for review in batch:
+            by_month.setdefault(_month_of(review.created_at), []).append(review)
+        for month, reviews in by_month.items():
+            _write_archive(month, reviews)
+            _add_to_summary(month, reviews)
+
+        db.session.execute(delete(Review).where(Review.id.in_([r.id for r in batch])))
+        refresh_rating_summaries(r.item_name for r in batch)
+        db.session.commit()
+        moved += len(batch)
+    logging.info(f"Archived {moved} reviews older than {cutoff.isoformat()}")
+    return moved
+
+
+def archived_reviews(since=None, **filters):
+    """Archived reviews created on or after ``since`` (all of them without it) that match the column ``filters``."""
+    reviews = []
+    for month in archived_months():
+        if since is not None and month < _month_of(since):
+            continue
+        statement = select(Review).filter_by(**filters)
+        if since is not None:
+            statement = statement.where(Review.created_at >= since)
+        with Session(_archive_engine(month)) as archive:
+            reviews.extend(archive.scalars(statement.order_by(Review.id)).all())
+    return reviews
+
+
+def init_archive(app):
+    app.config.setdefault('ARCHIVE_DIR', os.getenv('ARCHIVE_DIR', 'archive'))
+    app.config.setdefault('ARCHIVE_AFTER_DAYS', int(os.getenv('ARCHIVE_AFTER_DAYS', '365')))
+    app.cli.add_command(archive_reviews_command)
+
+
+@click.command('archive-reviews')
+@click.option('--older-than-days', type=int, default=None, help='Defaults to ARCHIVE_AFTER_DAYS.')
+@click.option('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, show_default=True)
+def archive_reviews_command(older_than_days, batch_size):
+    """Move old moderated reviews into monthly archive databases."""
+    moved = archive_reviews(older_than_days, batch_size)
+    click.echo(json.dumps({'archived': moved}))
@@ -0,0 +1,33 @@
+import os
+from resilience import Bulkhead, CircuitBreaker, DependencyClient
+
+INVENTORY_SERVICE_URL = os.getenv('INVENTORY_SERVICE_URL', 'http://ecommerce_azar_chedid-inventory_service-1:5002/api/v1')
+CUSTOMERS_SERVICE_URL = os.getenv('CUSTOMERS_SERVICE_URL', 'http://ecommerce_azar_chedid-customers_service-1:5001/api/v1')
+SALES_SERVICE_URL = os.getenv('SALES_SERVICE_URL', 'http://ecommerce_azar_chedid-sales_service-1:5003')
+
+REQUEST_TIMEOUT = float(os.getenv('DOWNSTREAM_TIMEOUT', '5'))
+HEALTH_TIMEOUT = float(os.getenv('DOWNSTREAM_HEALTH_TIMEOUT', '1'))
+MAX_CONCURRENT_CALLS = int(os.getenv('DOWNSTREAM_MAX_CONCURRENT_CALLS', '10'))
+
+
+def _client(name, base_url):
+    breaker = CircuitBreaker(
+        name,
+        failure_rate_threshold=float(os.getenv('BREAKER_FAILURE_RATE', '0.5')),
+        slow_call_seconds=float(os.getenv('BREAKER_SLOW_CALL_SECONDS', '2')),
+        slow_call_rate_threshold=float(os.getenv('BREAKER_SLOW_CALL_RATE', '0.5')),
+        open_seconds=float(os.getenv('BREAKER_OPEN_SECONDS', '30'))
+    )
+    return DependencyClient(name, base_url, timeout=REQUEST_TIMEOUT, breaker=breaker,
+                            bulkhead=Bulkhead(name, MAX_CONCURRENT_CALLS), health_timeout=HEALTH_TIMEOUT)
+
+
+inventory_client = _client('inventory_service', INVENTORY_SERVICE_URL)
+customers_client = _client('customer_service', CUSTOMERS_SERVICE_URL)
+sales_client = _client('sales_service', SALES_SERVICE_URL)
+
+
+def check_eligibility(pairs):
+    return sales_client.post('/purchases/eligibility', json={
+        'pairs': [{'customer_username': username, 'item_name': item_name} for username, item_name in pairs]
+    })
@@ -0,0 +1,16 @@
+from eligibility import remember_purchase
+from events import SALE_COMPLETED, init_events
+
+
+def warm_eligibility(event):
+    """Mark the buyer eligible to review the item before they first try, so that review skips the Sales call.
+
+    The warm entry lands in the cache of the worker holding the consumer lease, which is
+    every worker once ``CACHE_URL`` points them at a shared cache.
+    """
+    sale = event.payload
+    remember_purchase(sale['customer_username'], sale['item_name'])
+
+
+def init_consumers(app):
+    return init_events(app, group='reviews', handlers={SALE_COMPLETED: warm_eligibility})
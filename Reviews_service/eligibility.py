@@ -0,0 +1,62 @@
+import os
+
+from flask import current_app
+
+import clients
+from cache import get_cache
+
+NAMESPACE = 'eligibility'
+MAX_BATCH = 500
+
+
+class EligibilityUnavailable(Exception):
+    """Sales could not answer, so eligibility is unknown (as opposed to denied)."""
+
+
+def _key(customer_username, item_name):
+    return f'{customer_username}\0{item_name.lower()}'
+
+
+def verified_purchases(pairs):
+    """``{(customer_username, item_name): bool}`` for ``pairs``, asking Sales once for every uncached pair.
+
+    Only confirmed purchases are cached: a purchase never goes away, while a "no" may
+    turn into a "yes" as soon as the customer buys the item.
+    """
+    cache = get_cache()
+    ttl = current_app.config['ELIGIBILITY_CACHE_TTL']
+    result = {}
+    missing = []
+    for pair in dict.fromkeys(pairs):
+        if cache.get(NAMESPACE, _key(*pair)):
+            result[pair] = True
+        else:
+            missing.append(pair)
+
+    for start in range(0, len(missing), MAX_BATCH):
+        batch = missing[start:start + MAX_BATCH]
+        try:
+            response = clients.check_eligibility(batch)
+        except Exception as e:
+            raise EligibilityUnavailable(str(e)) from e
+        if response.status_code != 200:
+            raise EligibilityUnavailable(f"status {response.status_code}")
+        for entry in response.json()['results']:
+            pair = (entry['customer_username'], entry['item_name'])
+            result[pair] = bool(entry['eligible'])
+            if result[pair]:
+                cache.set(NAMESPACE, _key(*pair), True, ttl=ttl)
+    return result
+
+
+def remember_purchase(customer_username, item_name):
+    get_cache().set(NAMESPACE, _key(customer_username, item_name), True,
+                    ttl=current_app.config['ELIGIBILITY_CACHE_TTL'])
+
+
+def purchase_verified(customer_username, item_name):
+    return verified_purchases([(customer_username, item_name)])[(customer_username, item_name)]
+
+
+def init_eligibility(app):
+    app.config.setdefault('ELIGIBILITY_CACHE_TTL', float(os.getenv('ELIGIBILITY_CACHE_TTL', '3600')))
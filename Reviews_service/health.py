@@ -0,0 +1,146 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+
+from flask import jsonify
+from sqlalchemy.sql import text
+
+from models import db
+
+
+def database_probe(app):
+    def probe():
+        with app.app_context():
+            try:
+                db.session.execute(text('SELECT 1'))
+            finally:
+                db.session.remove()
+    return probe
+
+
+def dependency_probe(client):
+    def probe():
+        response = client.get('/health', timeout=client.health_timeout)
+        if response.status_code != 200:
+            raise RuntimeError(f"status {response.status_code}")
+    return probe
+
+
+class HealthMonitor:
+    """Runs every probe in parallel on a background schedule and caches the results.
+
+    Health endpoints only read the cache, so they answer in O(1) and never wait on a
+    slow or hanging dependency. Probes still running after ``probe_timeout`` are
+    reported as unhealthy for that round.
+    """
+
+    def __init__(self, interval=5.0, probe_timeout=2.0):
+        self.interval = interval
+        self.probe_timeout = probe_timeout
+        self._probes = {}
+        self._results = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._executor = None
+
+    def add_probe(self, name, probe, critical=True):
+        """``critical`` probes gate readiness; the others are only reported."""
+        self._probes[name] = (probe, critical)
+
+    def _timed(self, probe):
+        start = time.monotonic()
+        try:
+            probe()
+            error = None
+        except Exception as e:
+            error = str(e)
+        return error, round((time.monotonic() - start) * 1000, 2)
+
+    def run_once(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=max(len(self._probes), 1),
+                                                thread_name_prefix='health-probe')
+        futures = {name: self._executor.submit(self._timed, probe) for name, (probe, _) in self._probes.items()}
+        wait(futures.values(), timeout=self.probe_timeout)
+
+        checked_at = datetime.utcnow().isoformat()
+        results = {}
+        for name, future in futures.items():
+            if future.done():
+                error, latency_ms = future.result()
+            else:
+                error, latency_ms = f"timed out after {self.probe_timeout}s", None
+            results[name] = {
+                "status": "Healthy" if error is None else f"Unhealthy: {error}",
+                "latency_ms": latency_ms,
+                "checked_at": checked_at,
+                "critical": self._probes[name][1]
+            }
+        with self._lock:
+            self._results = results
+        return results
+
+    def results(self):
+        with self._lock:
+            return self._results
+
+    def status(self, name):
+        result = self.results().get(name)
+        return result["status"] if result else "Unknown"
+
+    def is_ready(self):
+        results = self.results()
+        return all(
+            results.get(name, {}).get("status") == "Healthy"
+            for name, (_, critical) in self._probes.items() if critical
+        )
+
+    def is_healthy(self):
+        results = self.results()
+        return all(results.get(name, {}).get("status") == "Healthy" for name in self._probes)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='health-monitor', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                logging.error(f"Health monitor error: {str(e)}")
+            time.sleep(self.interval)
+
+
+def init_health(app, url_prefix=''):
+    app.config.setdefault('HEALTH_MONITOR', True)
+    app.config.setdefault('HEALTH_CHECK_INTERVAL', 5.0)
+    app.config.setdefault('HEALTH_PROBE_TIMEOUT', 2.0)
+    monitor = HealthMonitor(app.config['HEALTH_CHECK_INTERVAL'], app.config['HEALTH_PROBE_TIMEOUT'])
+    monitor.add_probe('database', database_probe(app))
+    app.extensions['health'] = monitor
+
+    @app.before_request
+    def start_health_monitor():
+        if app.config['HEALTH_MONITOR']:
+            monitor.start()
+
+    @app.route(f'{url_prefix}/health/live', methods=['GET'])
+    def liveness():
+        return jsonify({"status": "alive"}), 200
+
+    @app.route(f'{url_prefix}/health/ready', methods=['GET'])
+    def readiness():
+        ready = monitor.is_ready()
+        return jsonify({
+            "status": "ready" if ready else "not ready",
+            "checks": monitor.results()
+        }), 200 if ready else 503
+
+    return monitor
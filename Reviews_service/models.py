@@ -2,11 +2,16 @@
 
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from routing import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class Review(db.Model):
     __tablename__ = 'reviews'
+    __table_args__ = (
+        # Serves the moderation queue: status filter + keyset pagination on (created_at, id).
+        db.Index('ix_reviews_status_created_at', 'status', 'created_at', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     customer_username = db.Column(db.String(80), nullable=False)
@@ -28,3 +33,40 @@ class Review(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
         }
+
+
+class ProductRatingSummary(db.Model):
+    __tablename__ = 'product_rating_summaries'
+
+    item_name = db.Column(db.String(100), primary_key=True)
+    approved_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'item_name': self.item_name,
+            'approved_count': self.approved_count,
+            'average_rating': round(self.rating_sum / self.approved_count, 2) if self.approved_count else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+
+class ReviewArchiveSummary(db.Model):
+    """Per-product monthly aggregates of reviews that were moved to an archive database."""
+    __tablename__ = 'review_archive_summaries'
+
+    month = db.Column(db.String(7), primary_key=True)  # YYYY-MM
+    item_name = db.Column(db.String(100), primary_key=True)
+    review_count = db.Column(db.Integer, nullable=False, default=0)
+    approved_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+
+    def to_dict(self):
+        return {
+            'month': self.month,
+            'item_name': self.item_name,
+            'review_count': self.review_count,
+            'approved_count': self.approved_count,
+            'rating_sum': self.rating_sum,
+        }
@@ -0,0 +1,54 @@
+from datetime import datetime
+from sqlalchemy import delete, func, insert, literal, select, union_all
+from models import db, Review, ProductRatingSummary, ReviewArchiveSummary
+from cache import get_cache
+
+
+def refresh_rating_summaries(item_names):
+    """Recompute the approved-review aggregates of ``item_names`` inside the current transaction.
+
+    Runs as one DELETE plus one INSERT ... SELECT ... GROUP BY, so the cost does not
+    depend on how many reviews were moderated. Archived reviews count through their
+    monthly aggregates. The caller commits; cached summaries are dropped once it does.
+    """
+    item_names = set(item_names)
+    if not item_names:
+        return
+
+    db.session.flush()
+    db.session.execute(
+        delete(ProductRatingSummary).where(ProductRatingSummary.item_name.in_(item_names))
+    )
+    live = (
+        select(Review.item_name, func.count(Review.id).label('approved_count'), func.sum(Review.rating).label('rating_sum'))
+        .where(Review.status == 'approved', Review.item_name.in_(item_names))
+        .group_by(Review.item_name)
+    )
+    archived = (
+        select(ReviewArchiveSummary.item_name, ReviewArchiveSummary.approved_count, ReviewArchiveSummary.rating_sum)
+        .where(ReviewArchiveSummary.item_name.in_(item_names))
+    )
+    combined = union_all(live, archived).subquery()
+    approved = (
+        select(combined.c.item_name, func.sum(combined.c.approved_count), func.sum(combined.c.rating_sum),
+               literal(datetime.utcnow()))
+        .group_by(combined.c.item_name)
+        .having(func.sum(combined.c.approved_count) > 0)
+    )
+    db.session.execute(
+        insert(ProductRatingSummary).from_select(
+            ['item_name', 'approved_count', 'rating_sum', 'updated_at'], approved
+        )
+    )
+    get_cache().invalidate_on_commit(db.session, 'ratings', *item_names)
+
+
+def ensure_rating_summaries():
+    """Backfill the aggregates for databases that predate the summary table."""
+    if ProductRatingSummary.query.first() is not None:
+        return
+    approved_items = db.session.execute(
+        select(Review.item_name).where(Review.status == 'approved').distinct()
+    ).scalars().all()
+    refresh_rating_summaries(approved_items)
+    db.session.commit()
@@ -1,72 +1,36 @@
-from flask import Blueprint, jsonify, request
-from models import db, Review
-import requests
-import os
+from flask import Blueprint, jsonify, request, current_app
+from models import db, Review, ProductRatingSummary
+from ratings import refresh_rating_summaries
+from archive import archived_reviews, reaches_archives
+from search import moderation_queue, search_reviews, encode_cursor
+from clients import customers_client, inventory_client, sales_client
+from eligibility import EligibilityUnavailable, purchase_verified
+from routing import read_only
+from cache import get_cache
+from http_cache import conditional
 import logging
-from sqlalchemy.sql import text
-
-
-logging.basicConfig(
-    filename='reviews_service.log',  # Log file name
-    level=logging.INFO,              # Log level: DEBUG, INFO, WARNING, ERROR, CRITICAL
-    format='%(asctime)s - %(levelname)s - %(message)s'  # Log format
-)
-
+from datetime import datetime
 
 
 reviews_bp = Blueprint('reviews', __name__)
 
-INVENTORY_SERVICE_URL = os.getenv('INVENTORY_SERVICE_URL', 'http://ecommerce_azar_chedid-inventory_service-1:5002/api/v1')
-CUSTOMERS_SERVICE_URL = os.getenv('CUSTOMERS_SERVICE_URL', 'http://ecommerce_azar_chedid-customers_service-1:5001/api/v1')
-
-def customer_exists(username):
-    try:
-        response = requests.get(f'{CUSTOMERS_SERVICE_URL}/customers/{username}')
-        return response.status_code == 200
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Error checking if customer exists: {str(e)}")
-        return False
-    
-def item_exists(item_name):
-    try:
-        response = requests.get(f'{INVENTORY_SERVICE_URL}/inventory')
-        if response.status_code != 200:
-            return False
-        items = response.json()
-        return any(item['name'].lower() == item_name.lower() for item in items)
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Error checking if item exists: {str(e)}")
-        return False
-
 @reviews_bp.route('/health', methods=['GET'])
 def health_check():
-    try:
-        # Check database connection
-        db.session.execute(text('SELECT 1'))
-        database_status = "Healthy"
-    except Exception as e:
-        database_status = f"Unhealthy: {str(e)}"
-
-    # Check external services (Example: Customer Service and Inventory Service)
-    try:
-        customer_response = requests.get(f'{CUSTOMERS_SERVICE_URL}/health')
-        customer_service_status = "Healthy" if customer_response.status_code == 200 else "Unhealthy"
-    except Exception as e:
-        customer_service_status = f"Unhealthy: {str(e)}"
-
-    try:
-        inventory_response = requests.get(f'{INVENTORY_SERVICE_URL}/health')
-        inventory_service_status = "Healthy" if inventory_response.status_code == 200 else "Unhealthy"
-    except Exception as e:
-        inventory_service_status = f"Unhealthy: {str(e)}"
-
-    # Aggregate results
-    overall_status = "Healthy" if database_status == "Healthy" and customer_service_status == "Healthy" and inventory_service_status == "Healthy" else "Unhealthy"
+    # Served from the background health monitor's cache; never probes inline.
+    health = current_app.extensions['health']
+    overall_status = "Healthy" if health.is_healthy() else "Unhealthy"
 
     return jsonify({
-        "database": database_status,
-        "customer_service": customer_service_status,
-        "inventory_service": inventory_service_status,
+        "database": health.status('database'),
+        "customer_service": health.status('customer_service'),
+        "inventory_service": health.status('inventory_service'),
+        "sales_service": health.status('sales_service'),
+        "checks": health.results(),
+        "circuits": {
+            "customer_service": customers_client.breaker.state,
+            "inventory_service": inventory_client.breaker.state,
+            "sales_service": sales_client.breaker.state
+        },
         "status": overall_status
     })
 
@@ -96,13 +60,15 @@ def submit_review():
             logging.warning(f"Invalid rating: {rating}")
             return {'error': 'Rating must be an integer between 1 and 5.'}, 400
 
-        if not customer_exists(customer_username):
-            logging.warning(f"Customer does not exist: {customer_username}")
-            return {'error': 'Customer does not exist.'}, 404
-
-        if not item_exists(item_name):
-            logging.warning(f"Item does not exist: {item_name}")
-            return {'error': 'Item does not exist.'}, 404
+        # One batched, cached call to Sales: a verified purchase implies the customer and item exist.
+        try:
+            verified = purchase_verified(customer_username, item_name)
+        except EligibilityUnavailable as e:
+            logging.error(f"Purchase verification unavailable: {str(e)}")
+            return {'error': 'Purchase verification is unavailable, please retry shortly.'}, 503
+        if not verified:
+            logging.warning(f"Review rejected, no purchase of {item_name} by {customer_username}")
+            return {'error': 'Only customers who bought this item can review it.'}, 403
 
         review = Review(
             customer_username=customer_username,
@@ -148,6 +114,7 @@ def update_review(review_id):
             review.comment = data['comment']
 
         review.status = 'pending'
+        refresh_rating_summaries([review.item_name])
         db.session.commit()
 
         logging.info(f"Review updated successfully: ID {review_id}")
@@ -182,6 +149,7 @@ def delete_review(review_id):
 
         # Perform the deletion
         db.session.delete(review)
+        refresh_rating_summaries([review.item_name])
         db.session.commit()
 
         # Log the successful deletion
@@ -195,13 +163,25 @@ def delete_review(review_id):
     return {'message': 'Review deleted successfully.'}, 200
 
 @reviews_bp.route('/product/<string:item_name>', methods=['GET'])
+@read_only
+@conditional(Review.__tablename__)
 def get_product_reviews(item_name):
+    since = request.args.get('since')
+    try:
+        since_date = datetime.fromisoformat(since) if since else None
+    except ValueError:
+        return {"error": "'since' must be an ISO date (YYYY-MM-DD)."}, 400
     try:
         # Log the incoming request
         logging.info(f"Received request to fetch reviews for product: {item_name}")
 
         # Query the database for approved reviews of the specified item
         reviews = Review.query.filter_by(item_name=item_name, status='approved').all()
+        if since_date is not None:
+            reviews = [r for r in reviews if r.created_at is None or r.created_at >= since_date]
+        # Older reviews live in the monthly archives; a ?since= range reads them only when it reaches back that far.
+        if since_date is None or reaches_archives(since_date):
+            reviews = archived_reviews(since_date, item_name=item_name, status='approved') + reviews
 
         if not reviews:
             # Log when no reviews are found
@@ -221,13 +201,24 @@ def get_product_reviews(item_name):
         return {"error": f"An unexpected error occurred: {str(e)}"}, 500
 
 @reviews_bp.route('/customer/<string:customer_username>', methods=['GET'])
+@read_only
+@conditional(Review.__tablename__)
 def get_customer_reviews(customer_username):
+    since = request.args.get('since')
+    try:
+        since_date = datetime.fromisoformat(since) if since else None
+    except ValueError:
+        return {"error": "'since' must be an ISO date (YYYY-MM-DD)."}, 400
     try:
         # Log the incoming request
         logging.info(f"Received request to fetch reviews for customer: {customer_username}")
 
         # Query the database for reviews by the customer
         reviews = Review.query.filter_by(customer_username=customer_username).all()
+        if since_date is not None:
+            reviews = [r for r in reviews if r.created_at is None or r.created_at >= since_date]
+        if since_date is None or reaches_archives(since_date):
+            reviews = archived_reviews(since_date, customer_username=customer_username) + reviews
 
         if not reviews:
             # Log when no reviews are found
@@ -272,6 +263,7 @@ def moderate_review(review_id):
 
         # Update the review status
         review.status = status
+        refresh_rating_summaries([review.item_name])
         db.session.commit()
 
         # Log the successful moderation
@@ -303,3 +295,140 @@ def get_review_details(review_id):
         # Log unexpected errors
         logging.error(f"Error occurred while fetching review details for ID: {review_id} | Error: {str(e)}")
         return {"error": f"An unexpected error occurred: {str(e)}"}, 500
+
+
+@reviews_bp.route('/moderation', methods=['GET'])
+def get_moderation_queue():
+    try:
+        status = request.args.get('status', 'pending')
+        if status not in ['pending', 'approved', 'rejected']:
+            logging.warning(f"Invalid status filter for moderation queue: {status}")
+            return {'error': 'Invalid status. Must be "pending", "approved" or "rejected".'}, 400
+
+        try:
+            limit = int(request.args.get('limit', 50))
+        except ValueError:
+            return {'error': 'limit must be a valid integer.'}, 400
+        if not (1 <= limit <= 500):
+            return {'error': 'limit must be between 1 and 500.'}, 400
+
+        try:
+            reviews = moderation_queue(
+                status=status,
+                cursor=request.args.get('cursor'),
+                limit=limit,
+                query=request.args.get('q')
+            )
+        except ValueError:
+            logging.warning(f"Invalid moderation queue cursor: {request.args.get('cursor')}")
+            return {'error': 'Invalid cursor.'}, 400
+
+        logging.info(f"Fetched {len(reviews)} reviews from the {status} moderation queue.")
+        return jsonify({
+            "reviews": [review.to_dict() for review in reviews],
+            "next_cursor": encode_cursor(reviews[-1]) if len(reviews) == limit else None
+        }), 200
+
+    except Exception as e:
+        logging.error(f"Error occurred while fetching the moderation queue | Error: {str(e)}")
+        return {"error": f"An unexpected error occurred: {str(e)}"}, 500
+
+@reviews_bp.route('/search', methods=['GET'])
+@read_only
+@conditional(Review.__tablename__)
+def search_review_comments():
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            logging.warning("Review search request without a query.")
+            return {'error': 'q is required.'}, 400
+
+        try:
+            page = int(request.args.get('page', 1))
+            per_page = int(request.args.get('per_page', 20))
+        except ValueError:
+            return {'error': 'page and per_page must be valid integers.'}, 400
+        if page < 1 or not (1 <= per_page <= 100):
+            return {'error': 'page must be >= 1 and per_page between 1 and 100.'}, 400
+
+        reviews = search_reviews(query, status=request.args.get('status'),
+                                 limit=per_page, offset=(page - 1) * per_page)
+
+        logging.info(f"Review search for '{query}' returned {len(reviews)} reviews.")
+        return jsonify([review.to_dict() for review in reviews]), 200
+
+    except Exception as e:
+        logging.error(f"Error occurred while searching reviews for: {request.args.get('q')} | Error: {str(e)}")
+        return {"error": f"An unexpected error occurred: {str(e)}"}, 500
+
+
+MAX_BULK_MODERATION_IDS = 10000
+
+@reviews_bp.route('/moderate', methods=['PUT'])
+def bulk_moderate_reviews():
+    try:
+        data = request.get_json(silent=True)
+        if not data:
+            logging.warning("No data provided for bulk moderation.")
+            return {'error': 'Request body must contain data.'}, 400
+
+        status = data.get('status')
+        if status not in ['approved', 'rejected']:
+            logging.warning(f"Invalid status provided for bulk moderation: {status}")
+            return {'error': 'Invalid status. Must be "approved" or "rejected".'}, 400
+
+        ids = data.get('ids')
+        criteria = data.get('filter')
+        if (ids is None) == (criteria is None):
+            return {'error': 'Exactly one of "ids" or "filter" is required.'}, 400
+
+        reviews = Review.query
+        if ids is not None:
+            if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+                return {'error': '"ids" must be a list of integers.'}, 400
+            if len(ids) > MAX_BULK_MODERATION_IDS:
+                return {'error': f'At most {MAX_BULK_MODERATION_IDS} ids can be moderated per request.'}, 400
+            reviews = reviews.filter(Review.id.in_(ids))
+        else:
+            if not isinstance(criteria, dict) or not ({'customer_username', 'item_name'} & criteria.keys()):
+                return {'error': '"filter" must contain customer_username and/or item_name.'}, 400
+            reviews = reviews.filter(Review.status == criteria.get('status', 'pending'))
+            if 'customer_username' in criteria:
+                reviews = reviews.filter(Review.customer_username == criteria['customer_username'])
+            if 'item_name' in criteria:
+                reviews = reviews.filter(Review.item_name == criteria['item_name'])
+
+        # One set-based UPDATE plus one aggregate refresh, committed together.
+        affected_items = [row.item_name for row in reviews.with_entities(Review.item_name).distinct()]
+        updated = reviews.update(
+            {Review.status: status, Review.updated_at: datetime.utcnow()},
+            synchronize_session=False
+        )
+        refresh_rating_summaries(affected_items)
+        db.session.commit()
+
+        logging.info(f"Bulk moderated {updated} reviews to status: {status}")
+        return {'message': f'{updated} reviews {status} successfully.', 'updated': updated}, 200
+
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error occurred during bulk moderation | Error: {str(e)}")
+        return {"error": f"An unexpected error occurred: {str(e)}"}, 500
+
+def _rating_summary(item_name):
+    summary = ProductRatingSummary.query.get(item_name)
+    if not summary:
+        return {'item_name': item_name, 'approved_count': 0, 'average_rating': None}
+    return summary.to_dict()
+
+@reviews_bp.route('/product/<string:item_name>/summary', methods=['GET'])
+@read_only
+@conditional(ProductRatingSummary.__tablename__)
+def get_product_rating_summary(item_name):
+    try:
+        # Cached per product; refresh_rating_summaries invalidates it when the aggregates change.
+        return jsonify(get_cache().get_or_load('ratings', item_name, lambda: _rating_summary(item_name))), 200
+
+    except Exception as e:
+        logging.error(f"Error occurred while fetching rating summary for product: {item_name} | Error: {str(e)}")
+        return {"error": f"An unexpected error occurred: {str(e)}"}, 500
@@ -0,0 +1,174 @@
+import hmac
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import Response, current_app, request
+
+MAX_SECONDS = 120
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread every ``interval`` seconds while running.
+
+    Nothing is hooked into the interpreter: a single background thread reads
+    ``sys._current_frames()``, so the cost is paid only while profiling and only at the
+    sampling rate. ``collapsed()`` is the ``stack;frames count`` format that flamegraph.pl,
+    speedscope and inferno read.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = Counter()
+        self.started_at = None
+        self.stopped_at = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=None, seconds=None):
+        """Start a new session; False if one is already running."""
+        with self._lock:
+            if self.running:
+                return False
+            if interval:
+                self.interval = interval
+            self.samples = Counter()
+            self.started_at, self.stopped_at = time.time(), None
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(seconds,), name='sampling-profiler', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _run(self, seconds):
+        deadline = time.monotonic() + min(seconds or MAX_SECONDS, MAX_SECONDS)
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            self.sample(skip=own_id)
+        self.stopped_at = time.time()
+
+    def sample(self, skip=None):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == skip:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
+
+
+def _authorized():
+    token = current_app.config['PROFILER_TOKEN']
+    if not token:
+        # Without a token the endpoints only answer on the loopback interface.
+        return request.remote_addr in ('127.0.0.1', '::1')
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    return hmac.compare_digest(supplied.encode('utf-8'), token.encode('utf-8'))
+
+
+def _collapsed_response(profiler):
+    response = Response(profiler.collapsed(), mimetype='text/plain')
+    response.headers['X-Profile-Samples'] = str(sum(profiler.samples.values()))
+    return response
+
+
+def _float_arg(name, default):
+    value = request.args.get(name)
+    return float(value) if value is not None else default
+
+
+def init_sampling_profiler(app, url_prefix=''):
+    """Opt-in (``PROFILER_ENABLED=1``) CPU sampling exposed under ``{url_prefix}/admin/profile``.
+
+    ``GET /admin/profile?seconds=N`` samples for a window and returns collapsed stacks;
+    ``POST /admin/profile/start`` and ``/stop`` bracket a longer session. ``SIGUSR2``
+    toggles a session too, writing the result under ``PROFILER_DIR`` when it stops.
+    """
+    app.config.setdefault('PROFILER_ENABLED', os.getenv('PROFILER_ENABLED', '0') == '1')
+    app.config.setdefault('PROFILER_TOKEN', os.getenv('PROFILER_TOKEN'))
+    app.config.setdefault('PROFILER_INTERVAL', float(os.getenv('PROFILER_INTERVAL', '0.01')))
+    app.config.setdefault('PROFILER_DIR', os.getenv('PROFILER_DIR', 'profiles'))
+    if not app.config['PROFILER_ENABLED']:
+        return None
+
+    profiler = SamplingProfiler(app.config['PROFILER_INTERVAL'])
+    app.extensions['sampling_profiler'] = profiler
+
+    @app.route(f'{url_prefix}/admin/profile', methods=['GET'])
+    def profile_window():
+        if not _authorized():
+            return {"error": "Not authorized."}, 403
+        try:
+            seconds = _float_arg('seconds', 10.0)
+            interval = _float_arg('interval', app.config['PROFILER_INTERVAL'])
+        except ValueError:
+            return {"error": "seconds and interval must be numbers."}, 400
+        if not (0 < seconds <= MAX_SECONDS) or not (0.001 <= interval <= 1):
+            return {"error": f"seconds must be in (0, {MAX_SECONDS}] and interval in [0.001, 1]."}, 400
+        if not profiler.start(interval=interval, seconds=seconds):
+            return {"error": "A profiling session is already running."}, 409
+        logging.info(f"Sampling profiler running for {seconds}s every {interval}s.")
+        time.sleep(seconds)
+        profiler.stop()
+        return _collapsed_response(profiler)
+
+    @app.route(f'{url_prefix}/admin/profile/start', methods=['POST'])
+    def profile_start():
+        if not _authorized():
+            return {"error": "Not authorized."}, 403
+        if not profiler.start(interval=app.config['PROFILER_INTERVAL']):
+            return {"error": "A profiling session is already running."}, 409
+        logging.info("Sampling profiler started.")
+        return {"message": "Profiling started.", "max_seconds": MAX_SECONDS}, 202
+
+    @app.route(f'{url_prefix}/admin/profile/stop', methods=['POST'])
+    def profile_stop():
+        if not _authorized():
+            return {"error": "Not authorized."}, 403
+        profiler.stop()
+        logging.info("Sampling profiler stopped.")
+        return _collapsed_response(profiler)
+
+    def toggle(signum, frame):
+        if profiler.start(interval=app.config['PROFILER_INTERVAL']):
+            return
+        # Stop from another thread: a signal handler must not block on the sampler.
+        threading.Thread(target=_stop_and_write, args=(app, profiler), daemon=True).start()
+
+    try:
+        signal.signal(signal.SIGUSR2, toggle)
+    except (ValueError, AttributeError):
+        # Not the main thread (some servers build the app elsewhere), or no SIGUSR2 on this platform.
+        logging.info("Sampling profiler signal toggle unavailable; use the admin endpoints.")
+    return profiler
+
+
+def _stop_and_write(app, profiler):
+    profiler.stop()
+    directory = app.config['PROFILER_DIR']
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'profile-{os.getpid()}-{int(profiler.started_at)}.collapsed')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(profiler.collapsed())
+    logging.info(f"Sampling profile written to {path}")
@@ -0,0 +1,111 @@
+import re
+from datetime import datetime
+from sqlalchemy import DDL, event, tuple_
+from sqlalchemy.sql import text
+from models import db, Review
+
+# External-content FTS5 index over review comments, kept in sync by triggers.
+SEARCH_INDEX_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS reviews_fts USING fts5(
+        comment, content='reviews', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS reviews_fts_ai AFTER INSERT ON reviews BEGIN
+        INSERT INTO reviews_fts(rowid, comment) VALUES (new.id, new.comment);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS reviews_fts_ad AFTER DELETE ON reviews BEGIN
+        INSERT INTO reviews_fts(reviews_fts, rowid, comment) VALUES ('delete', old.id, old.comment);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS reviews_fts_au AFTER UPDATE OF comment ON reviews BEGIN
+        INSERT INTO reviews_fts(reviews_fts, rowid, comment) VALUES ('delete', old.id, old.comment);
+        INSERT INTO reviews_fts(rowid, comment) VALUES (new.id, new.comment);
+    END""",
+    "INSERT INTO reviews_fts(reviews_fts) VALUES ('rebuild')",
+]
+
+for statement in SEARCH_INDEX_DDL:
+    event.listen(Review.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Review.__table__, 'before_drop',
+             DDL('DROP TABLE IF EXISTS reviews_fts').execute_if(dialect='sqlite'))
+
+
+def ensure_search_index():
+    """Add the moderation index and comment search index to a database created before they existed."""
+    for index in Review.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+
+    if db.engine.dialect.name != 'sqlite':
+        return
+    with db.engine.begin() as conn:
+        exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'reviews_fts'")).first()
+        if exists:
+            return
+        for statement in SEARCH_INDEX_DDL:
+            conn.execute(text(statement))
+
+
+def build_match_query(query):
+    """Turn free text into an FTS5 query: every term must match, each as a prefix."""
+    terms = re.findall(r'\w+', query.lower())
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def encode_cursor(review):
+    return f"{review.created_at.isoformat()},{review.id}"
+
+
+def decode_cursor(cursor):
+    """Parse a ``<created_at>,<id>`` cursor; raises ValueError when malformed."""
+    created_at, review_id = cursor.rsplit(',', 1)
+    return datetime.fromisoformat(created_at), int(review_id)
+
+
+def moderation_queue(status='pending', cursor=None, limit=50, query=None):
+    """Return the next ``limit`` reviews with ``status``, oldest first.
+
+    Uses keyset pagination on (status, created_at, id), so each page is an index
+    range scan no matter how deep into the backlog the moderator is.
+    """
+    reviews = Review.query.filter(Review.status == status)
+
+    if query:
+        match = build_match_query(query)
+        if not match:
+            return []
+        if db.engine.dialect.name == 'sqlite':
+            reviews = reviews.filter(Review.id.in_(
+                text('SELECT rowid FROM reviews_fts WHERE reviews_fts MATCH :match').bindparams(match=match)
+            ))
+        else:
+            reviews = reviews.filter(Review.comment.ilike(f'%{query}%'))
+
+    if cursor:
+        created_at, review_id = decode_cursor(cursor)
+        reviews = reviews.filter(tuple_(Review.created_at, Review.id) > tuple_(created_at, review_id))
+
+    return reviews.order_by(Review.created_at, Review.id).limit(limit).all()
+
+
+def search_reviews(query, status=None, limit=20, offset=0):
+    """Rank reviews whose comment matches ``query`` (best match first)."""
+    match = build_match_query(query)
+    if not match:
+        return []
+
+    if db.engine.dialect.name != 'sqlite':
+        reviews = Review.query.filter(Review.comment.ilike(f'%{query}%'))
+        if status:
+            reviews = reviews.filter(Review.status == status)
+        return reviews.order_by(Review.id).offset(offset).limit(limit).all()
+
+    sql = ('SELECT r.id FROM reviews_fts JOIN reviews r ON r.id = reviews_fts.rowid '
+           'WHERE reviews_fts MATCH :match ')
+    params = {'match': match, 'limit': limit, 'offset': offset}
+    if status:
+        sql += 'AND r.status = :status '
+        params['status'] = status
+    sql += 'ORDER BY bm25(reviews_fts) LIMIT :limit OFFSET :offset'
+
+    ids = [row.id for row in db.session.execute(text(sql), params)]
+    by_id = {review.id: review for review in Review.query.filter(Review.id.in_(ids))}
+    return [by_id[review_id] for review_id in ids if review_id in by_id]
@@ -0,0 +1,145 @@
+import pytest
+from unittest.mock import patch
+from app import create_app, db
+from models import Review
+
+@pytest.fixture
+def client():
+    app = create_app()
+    app.config['TESTING'] = True
+    app.config['HEALTH_MONITOR'] = False
+    with app.test_client() as client:
+        with app.app_context():
+            db.create_all()
+            yield client
+            db.drop_all()
+
+def test_missing_required_field(client):
+    response = client.post('/reviews/', json={"item_name": "Laptop"})
+    assert response.status_code == 400
+    assert response.json['error'] == "customer_username is required."
+
+def test_invalid_rating(client):
+    response = client.post('/reviews/', json={
+        "customer_username": "john_doe",
+        "item_name": "Laptop",
+        "rating": 10,
+        "comment": "Great!"
+    })
+    assert response.status_code == 400
+    assert response.json['error'] == "Rating must be an integer between 1 and 5."
+
+@patch('routes.purchase_verified', return_value=False)
+def test_review_requires_verified_purchase(mock_verified, client):
+    response = client.post('/reviews/', json={
+        "customer_username": "john_doe",
+        "item_name": "Laptop",
+        "rating": 5,
+        "comment": "Great product!"
+    })
+    assert response.status_code == 403
+    assert response.json['error'] == "Only customers who bought this item can review it."
+    mock_verified.assert_called_once_with("john_doe", "Laptop")
+
+@patch('routes.purchase_verified', return_value=True)
+def test_review_creation(mock_verified, client):
+    response = client.post('/reviews/', json={
+        "customer_username": "john_doe",
+        "item_name": "Laptop",
+        "rating": 5,
+        "comment": "Great product!"
+    })
+    assert response.status_code == 201
+    assert 'review_id' in response.json
+
+def test_eligibility_is_batched_and_positive_answers_cached(client):
+    from unittest.mock import Mock
+    from eligibility import verified_purchases
+
+    def answer(pairs):
+        return Mock(status_code=200, json=Mock(return_value={"results": [
+            {"customer_username": u, "item_name": i, "eligible": i == "Laptop"} for u, i in pairs
+        ]}))
+
+    with patch('clients.check_eligibility', side_effect=answer) as mock_check:
+        pairs = [("john_doe", "Laptop"), ("john_doe", "Phone")]
+        assert verified_purchases(pairs) == {pairs[0]: True, pairs[1]: False}
+        mock_check.assert_called_once_with(pairs)
+
+        # The purchase is served from the cache; the "no" is asked again.
+        assert verified_purchases([("john_doe", "laptop"), ("john_doe", "Phone")])[("john_doe", "laptop")] is True
+        assert mock_check.call_args.args == ([("john_doe", "Phone")],)
+
+def _add_reviews(*comments, status='pending'):
+    for comment in comments:
+        db.session.add(Review(customer_username="john_doe", item_name="Laptop",
+                              rating=4, comment=comment, status=status))
+    db.session.commit()
+
+def test_moderation_queue_pagination(client):
+    _add_reviews("First", "Second", "Third")
+    _add_reviews("Already done", status='approved')
+
+    response = client.get('/reviews/moderation?status=pending&limit=2')
+    assert response.status_code == 200
+    assert [r['comment'] for r in response.json['reviews']] == ["First", "Second"]
+
+    cursor = response.json['next_cursor']
+    response = client.get('/reviews/moderation', query_string={'status': 'pending', 'limit': 2, 'cursor': cursor})
+    assert [r['comment'] for r in response.json['reviews']] == ["Third"]
+    assert response.json['next_cursor'] is None
+
+def test_search_review_comments(client):
+    _add_reviews("Battery life is amazing", "Screen cracked after a week")
+
+    response = client.get('/reviews/search?q=batt')
+    assert response.status_code == 200
+    assert [r['comment'] for r in response.json] == ["Battery life is amazing"]
+
+    response = client.get('/reviews/moderation?q=cracked')
+    assert [r['comment'] for r in response.json['reviews']] == ["Screen cracked after a week"]
+
+def test_bulk_moderation_updates_rating_summary(client):
+    _add_reviews("Good", "Great", "Meh")
+    ids = [r.id for r in Review.query.order_by(Review.id)]
+
+    response = client.put('/reviews/moderate', json={"status": "approved", "ids": ids[:2]})
+    assert response.status_code == 200
+    assert response.json['updated'] == 2
+
+    summary = client.get('/reviews/product/Laptop/summary').json
+    assert summary['approved_count'] == 2
+    assert summary['average_rating'] == 4
+
+    response = client.put('/reviews/moderate', json={
+        "status": "rejected",
+        "filter": {"customer_username": "john_doe"}
+    })
+    assert response.json['updated'] == 1
+    assert Review.query.get(ids[2]).status == 'rejected'
+
+def test_archive_keeps_old_reviews_reachable(client, tmp_path):
+    from datetime import datetime, timedelta
+    from archive import archive_reviews
+    from ratings import refresh_rating_summaries
+
+    client.application.config['ARCHIVE_DIR'] = str(tmp_path)
+    old_date = datetime.utcnow() - timedelta(days=800)
+    db.session.add(Review(customer_username="john_doe", item_name="Laptop", rating=2,
+                          comment="Old", status='approved', created_at=old_date))
+    _add_reviews("New", status='approved')
+    refresh_rating_summaries(["Laptop"])
+    db.session.commit()
+
+    assert archive_reviews(older_than_days=365) == 1
+    # Without ?since= the whole history is returned, archived reviews included.
+    assert [r['comment'] for r in client.get('/reviews/product/Laptop').json] == ["Old", "New"]
+    assert [r['comment'] for r in client.get('/reviews/customer/john_doe').json] == ["Old", "New"]
+
+    since = (old_date - timedelta(days=1)).date().isoformat()
+    response = client.get(f'/reviews/product/Laptop?since={since}')
+    assert [r['comment'] for r in response.json] == ["Old", "New"]
+
+    summary = client.get('/reviews/product/Laptop/summary').json
+    assert summary['approved_count'] == 2
+    assert summary['average_rating'] == 3
@@ -1,15 +1,89 @@
+from startup import configure_logging, initialize, report_startup  # first, so STARTUP_PROFILE sees every import
+import os
+from functools import partial
+
+import click
 from flask import Flask
+from flask.cli import with_appcontext
 from db import db
 from routes import sales_bp
+from export import export_purchases_command
+from archive import init_archive
+from events import init_events
+from outbox import init_outbox
+from catalog import init_catalog
+from idempotency import init_idempotency
+from ratelimit import init_rate_limiting
+from http_cache import init_http_cache
+from query_profiler import init_query_profiler
+from sampling_profiler import init_sampling_profiler
+from routing import init_replica
+from sharding import configure_shards, ensure_shard_tables
+from health import init_health, dependency_probe
+from clients import inventory_client, customers_client
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create the tables (and the shard tables). Run once per deploy, not in every worker."""
+    db.create_all()
+    ensure_shard_tables()
+    click.echo("Database initialized.")
+
+
+def create_app():
+    configure_logging('sales_service.log')
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///sales.db'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['EXPORT_DIR'] = os.getenv('EXPORT_DIR', 'exports')
+    app.config['EXPORT_COMPRESSION'] = os.getenv('EXPORT_COMPRESSION', 'snappy')
+    app.config['EXPORT_SAFETY_LAG'] = float(os.getenv('EXPORT_SAFETY_LAG', '60'))
+    app.config['REVIEWS_DATABASE_URI'] = os.getenv('REVIEWS_DATABASE_URI')
+    app.config['SALES_OUTBOX_WORKER'] = os.getenv('SALES_OUTBOX_WORKER', '1') == '1'
+    app.config['SALES_OUTBOX_POLL_INTERVAL'] = float(os.getenv('SALES_OUTBOX_POLL_INTERVAL', '1.0'))
+    app.config['SALES_OUTBOX_MAX_ATTEMPTS'] = int(os.getenv('SALES_OUTBOX_MAX_ATTEMPTS', '8'))
+    app.config['ARCHIVE_DIR'] = os.getenv('ARCHIVE_DIR', 'archive')
+    app.config['ARCHIVE_AFTER_DAYS'] = int(os.getenv('ARCHIVE_AFTER_DAYS', '365'))
+    # Without a usable catalog replica these fan out to a full GET /inventory, so they get a tighter per-client budget.
+    app.config['RATE_LIMIT_ROUTES'] = {
+        'sales_bp.get_goods': (5, 10),
+        'sales_bp.get_good_details': (5, 10),
+    }
+    app.config['HEALTH_CHECK_INTERVAL'] = float(os.getenv('HEALTH_CHECK_INTERVAL', '5'))
+    app.config['HEALTH_PROBE_TIMEOUT'] = float(os.getenv('HEALTH_PROBE_TIMEOUT', '2'))
+
+    initialize(
+        app,
+        init_replica,
+        configure_shards,
+        db.init_app,
+        init_query_profiler,
+        init_sampling_profiler,
+        init_idempotency,
+        init_rate_limiting,
+        partial(init_http_cache, db=db),
+        init_archive,
+        init_events,
+        init_outbox,
+        init_catalog,
+    )
+    app.register_blueprint(sales_bp)
+    app.cli.add_command(export_purchases_command)
+    app.cli.add_command(init_db_command)
+
+    health = init_health(app)
+    # Dependencies are reported but do not gate readiness: pulling Sales out of the
+    # load balancer would not make Inventory or Customers come back any faster.
+    health.add_probe('inventory_service', dependency_probe(inventory_client), critical=False)
+    health.add_probe('customer_service', dependency_probe(customers_client), critical=False)
+
+    report_startup(app)
+    return app
 
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///sales.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-db.init_app(app)
-app.register_blueprint(sales_bp)
-with app.app_context():
-        db.create_all()  
+app = create_app()
 
 if __name__ == "__main__":
     app.run(debug=True)
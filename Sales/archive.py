@@ -0,0 +1,283 @@
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import create_engine, delete, insert, select
+from sqlalchemy.orm import Session
+
+from db import db
+from http_cache import touch
+from models import CustomerItemPurchase, CustomerPurchaseSummary, Purchase, PurchaseArchiveSummary
+from purchase_summary import SUMMARY_TABLES, add_to_summary, clear_summaries
+from sharding import (customer_session, is_sharded, purchase_sessions, purchases_recorded_after, recorded_after,
+                      recorded_order, shard_count, shard_index)
+
+ARCHIVE_PREFIX = 'purchases_'
+DEFAULT_BATCH_SIZE = 1000
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def archive_cutoff(older_than_days=None):
+    days = older_than_days if older_than_days is not None else current_app.config['ARCHIVE_AFTER_DAYS']
+    return datetime.utcnow() - timedelta(days=days)
+
+
+def _month_of(value):
+    return value.strftime('%Y-%m')
+
+
+def _archive_path(month):
+    return os.path.join(os.path.abspath(current_app.config['ARCHIVE_DIR']), f"{ARCHIVE_PREFIX}{month.replace('-', '_')}.db")
+
+
+def _archive_engine(month, create=False):
+    """Engine on the archive database of ``month`` (``YYYY-MM``), or None if it does not exist yet."""
+    path = _archive_path(month)
+    with _engines_lock:
+        engine = _engines.get(path)
+        if engine is None:
+            if not create and not os.path.exists(path):
+                return None
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            engine = create_engine(f'sqlite:///{path}')
+            Purchase.__table__.create(engine, checkfirst=True)
+            _engines[path] = engine
+        return engine
+
+
+def archived_months():
+    """Months that have an archive database, oldest first."""
+    pattern = os.path.join(os.path.abspath(current_app.config['ARCHIVE_DIR']), f'{ARCHIVE_PREFIX}*.db')
+    names = (os.path.basename(path)[len(ARCHIVE_PREFIX):-len('.db')] for path in glob.glob(pattern))
+    return sorted(name.replace('_', '-') for name in names)
+
+
+def reaches_archives(since):
+    """Whether archived purchases can be on or after ``since``.
+
+    Decided from the archives that exist, not from ``ARCHIVE_AFTER_DAYS``: an archive run
+    with a shorter ``--older-than-days`` moves rows the configured cutoff would keep hot.
+    """
+    months = archived_months()
+    return bool(months) and _month_of(since) <= months[-1]
+
+
+def _copy(purchase):
+    return Purchase(
+        purchase_id=purchase.purchase_id,
+        customer_username=purchase.customer_username,
+        item_name=purchase.item_name,
+        quantity=purchase.quantity,
+        total_price=purchase.total_price,
+        purchase_date=purchase.purchase_date
+    )
+
+
+def _write_archive(month, purchases):
+    # Rows already archived by an earlier, interrupted run are skipped, so re-running is safe.
+    ids = [p.purchase_id for p in purchases]
+    with Session(_archive_engine(month, create=True)) as archive:
+        existing = set(archive.scalars(select(Purchase.purchase_id).where(Purchase.purchase_id.in_(ids))))
+        archive.add_all([_copy(p) for p in purchases if p.purchase_id not in existing])
+        archive.commit()
+
+
+def _add_to_summary(session, month, purchases):
+    for purchase in purchases:
+        summary = session.get(PurchaseArchiveSummary, (month, purchase.customer_username))
+        if summary is None:
+            summary = PurchaseArchiveSummary(month=month, customer_username=purchase.customer_username,
+                                             purchase_count=0, quantity=0, total_spend=0.0)
+            session.add(summary)
+        summary.purchase_count += 1
+        summary.quantity += purchase.quantity
+        summary.total_spend += purchase.total_price
+
+
+def archive_purchases(older_than_days=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Move purchases older than the cutoff into monthly archive databases.
+
+    Each batch is first committed to its archive, then removed from the hot database in
+    the same transaction that folds it into ``purchase_archive_summaries``. A crash in
+    between leaves the rows in both places, and the next run simply finishes the move.
+    """
+    cutoff = archive_cutoff(older_than_days)
+    moved = 0
+    for session in purchase_sessions():
+        while True:
+            batch = session.scalars(
+                select(Purchase)
+                .where(Purchase.purchase_date < cutoff)
+                .order_by(Purchase.purchase_id)
+                .limit(batch_size)
+            ).all()
+            if not batch:
+                break
+
+            by_month = {}
+            for purchase in batch:
+                by_month.setdefault(_month_of(purchase.purchase_date), []).append(purchase)
+            for month, purchases in by_month.items():
+                _write_archive(month, purchases)
+                _add_to_summary(session, month, purchases)
+
+            session.execute(delete(Purchase).where(Purchase.purchase_id.in_([p.purchase_id for p in batch])))
+            session.commit()
+            moved += len(batch)
+    if moved and is_sharded():
+        touch(db.session, Purchase.__tablename__, PurchaseArchiveSummary.__tablename__)
+        db.session.commit()
+    logging.info(f"Archived {moved} purchases older than {cutoff.isoformat()}")
+    return moved
+
+
+def archived_purchases(customer_username, since=None):
+    """Archived purchases of ``customer_username`` made on or after ``since`` (all of them without it)."""
+    if since is None:
+        # Only the months this customer has archived purchases in.
+        months = [row.month for row in archive_summary(customer_username)]
+    else:
+        months = [month for month in archived_months() if month >= _month_of(since)]
+    purchases = []
+    for month in months:
+        engine = _archive_engine(month)
+        if engine is None:
+            continue
+        statement = select(Purchase).where(Purchase.customer_username == customer_username)
+        if since is not None:
+            statement = statement.where(Purchase.purchase_date >= since)
+        with Session(engine) as archive:
+            purchases.extend(archive.scalars(statement.order_by(Purchase.purchase_id)).all())
+    return purchases
+
+
+def recorded_purchases(after, until, limit, min_id=0):
+    """The next ``limit`` purchases of ``recorded_after``, live and archived alike.
+
+    The live databases are read first: archiving commits a batch to its archive before it
+    deletes it, so a row moved in between is then found in its archive. A row caught in
+    both places is returned once.
+    """
+    found = {purchase.purchase_id: purchase for purchase in purchases_recorded_after(after, until, limit, min_id)}
+    recorded_at = after[0]
+    for month in archived_months():
+        if recorded_at is not None and month < _month_of(recorded_at):
+            continue
+        with Session(_archive_engine(month)) as archive:
+            for purchase in archive.scalars(recorded_after(after, until, limit, min_id)):
+                found.setdefault(purchase.purchase_id, purchase)
+    return sorted(found.values(), key=recorded_order)[:limit]
+
+
+def archive_summary(customer_username):
+    with customer_session(customer_username) as session:
+        return session.scalars(
+            select(PurchaseArchiveSummary)
+            .where(PurchaseArchiveSummary.customer_username == customer_username)
+            .order_by(PurchaseArchiveSummary.month)
+        ).all()
+
+
+def _stage_archived_summaries(staging):
+    """Fold every archived purchase into the summary tables of ``staging``. Returns how many there were."""
+    staged = 0
+    for month in archived_months():
+        with Session(_archive_engine(month)) as archive:
+            for purchase in archive.scalars(select(Purchase).order_by(Purchase.purchase_id)):
+                add_to_summary(staging, purchase)
+                staged += 1
+        staging.commit()
+    return staged
+
+
+def _swap_in_summaries(session, staging, batch_size, shard=None):
+    """Replace ``session``'s summaries with the staged ones plus its live purchases, in one transaction.
+
+    ``shard`` is the index of the shard ``session`` is on, to copy only its customers' rows.
+
+    The old rows are deleted first, so the transaction holds the write lock before it reads
+    any purchase: a purchase recorded meanwhile waits for the swap, then adds itself on top.
+    Returns how many live purchases were replayed.
+    """
+    clear_summaries(session)
+    for model in (CustomerPurchaseSummary, CustomerItemPurchase):
+        result = staging.execute(select(model.__table__).execution_options(yield_per=batch_size)).mappings()
+        for rows in result.partitions():
+            rows = [dict(row) for row in rows
+                    if shard is None or shard_index(row['customer_username'], shard_count()) == shard]
+            if rows:
+                session.execute(insert(model), rows)
+
+    replayed, last_id = 0, 0
+    while True:
+        batch = session.scalars(
+            select(Purchase).where(Purchase.purchase_id > last_id).order_by(Purchase.purchase_id).limit(batch_size)
+        ).all()
+        if not batch:
+            break
+        for purchase in batch:
+            add_to_summary(session, purchase)
+        replayed += len(batch)
+        last_id = batch[-1].purchase_id
+    session.commit()
+    return replayed
+
+
+def rebuild_purchase_summaries(batch_size=DEFAULT_BATCH_SIZE):
+    """Recompute every customer purchase summary from archived and live purchases.
+
+    Only needed to backfill purchases recorded before summaries existed, or to repair
+    them; ``record_purchase`` keeps them current, and archiving leaves them untouched.
+    Archived totals are built in a staging database first; each purchase database then
+    swaps them in together with its live purchases in one transaction, so readers see the
+    old summaries until the new ones are complete. Archives are replayed first so
+    ``last_purchase_at`` ends on the newest purchase.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'summaries.db')}")
+        try:
+            CustomerPurchaseSummary.__table__.create(engine)
+            CustomerItemPurchase.__table__.create(engine)
+            with Session(engine) as staging:
+                replayed = _stage_archived_summaries(staging)
+                for index, session in enumerate(purchase_sessions()):
+                    replayed += _swap_in_summaries(session, staging, batch_size, index if is_sharded() else None)
+        finally:
+            engine.dispose()
+
+    touch(db.session, *SUMMARY_TABLES)
+    db.session.commit()
+    logging.info(f"Rebuilt customer purchase summaries from {replayed} purchases")
+    return replayed
+
+
+def init_archive(app):
+    app.config.setdefault('ARCHIVE_DIR', 'archive')
+    app.config.setdefault('ARCHIVE_AFTER_DAYS', 365)
+    app.cli.add_command(archive_purchases_command)
+    app.cli.add_command(rebuild_purchase_summaries_command)
+
+
+@click.command('archive-purchases')
+@click.option('--older-than-days', type=int, default=None, help='Defaults to ARCHIVE_AFTER_DAYS.')
+@click.option('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, show_default=True)
+def archive_purchases_command(older_than_days, batch_size):
+    """Move old purchases into monthly archive databases."""
+    moved = archive_purchases(older_than_days, batch_size)
+    click.echo(json.dumps({'archived': moved}))
+
+
+@click.command('rebuild-purchase-summaries')
+@click.option('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, show_default=True)
+def rebuild_purchase_summaries_command(batch_size):
+    """Recompute customer purchase summaries from archived and live purchases."""
+    replayed = rebuild_purchase_summaries(batch_size)
+    click.echo(json.dumps({'purchases': replayed}))
@@ -0,0 +1,278 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import event
+
+from routing import RoutingSession, serving_from_replica
+
+PENDING_INVALIDATIONS = 'cache_invalidations'
+
+
+class LocalBackend:
+    """In-process LRU with per-entry expiry. Every worker process keeps its own copy.
+
+    Counters (namespace versions, key generations) are kept outside the LRU: evicting one
+    would reset it to an older value and could resurrect entries it had invalidated.
+    """
+
+    def __init__(self, max_entries=1024, clock=time.monotonic):
+        self.max_entries = max_entries
+        self._clock = clock
+        self._data = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= self._clock():
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            if key in self._counters:
+                return str(self._counters[key])
+            entry = self._live(key)
+            if entry is None:
+                return None
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl=None, only_if_missing=False):
+        with self._lock:
+            if only_if_missing and self._live(key) is not None:
+                return False
+            self._data[key] = (value, self._clock() + ttl if ttl else None)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+                self._counters.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+class RedisBackend:
+    """Shared backend over any client with the redis-py API (``get``, ``set``, ``delete``, ``incr``)."""
+
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("redis is required when CACHE_URL is set (pip install redis).") from e
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key):
+        value = self.client.get(key)
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    def set(self, key, value, ttl=None, only_if_missing=False):
+        return bool(self.client.set(key, value, px=int(ttl * 1000) if ttl else None, nx=only_if_missing))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*keys)
+
+    def incr(self, key):
+        return int(self.client.incr(key))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one; every caller gets its result."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class Cache:
+    """JSON value cache with TTLs, stampede protection and namespaced invalidation.
+
+    Keys embed their namespace's version and their own generation, so ``invalidate(namespace)``
+    and ``delete`` are single INCRs and the old entries simply age out. A load that started
+    before either writes its value under the old key, where no reader looks any more. Misses are loaded once per process (single-flight)
+    and, with a shared backend, once across processes: the worker holding the rebuild
+    lock loads while the others poll briefly for its result. Backend errors are logged
+    and treated as misses, so an unreachable cache never fails a request.
+
+    For ``replica_lag`` seconds after an invalidation, values loaded from the read replica
+    are returned but not cached: the replica may not have the write yet, and caching what
+    it returned would bring the old value back for a whole TTL.
+    """
+
+    def __init__(self, backend, prefix='cache', default_ttl=60.0, lock_ttl=5.0, lock_poll=0.05, replica_lag=0.0):
+        self.backend = backend
+        self.prefix = prefix
+        self.default_ttl = default_ttl
+        self.replica_lag = replica_lag
+        self.lock_ttl = lock_ttl
+        self.lock_poll = lock_poll
+        self._flight = SingleFlight()
+
+    def _call(self, operation, *args, **kwargs):
+        try:
+            return getattr(self.backend, operation)(*args, **kwargs)
+        except Exception as e:
+            logging.error(f"Cache {operation} failed: {str(e)}")
+            return None
+
+    def _namespace_key(self, namespace):
+        return f'{self.prefix}:ns:{namespace}'
+
+    def _fence_key(self, namespace, key=None):
+        return f'{self.prefix}:fence:{namespace}' if key is None else f'{self.prefix}:fence:{namespace}:{key}'
+
+    def _generation_key(self, namespace, key):
+        return f'{self.prefix}:gen:{namespace}:{key}'
+
+    def _key(self, namespace, key):
+        version = self._call('get', self._namespace_key(namespace)) or 0
+        generation = self._call('get', self._generation_key(namespace, key)) or 0
+        return f'{self.prefix}:{namespace}:{version}:{key}:{generation}'
+
+    def get(self, namespace, key, default=None):
+        raw = self._call('get', self._key(namespace, key))
+        return default if raw is None else json.loads(raw)
+
+    def set(self, namespace, key, value, ttl=None):
+        self._call('set', self._key(namespace, key), json.dumps(value), ttl=ttl or self.default_ttl)
+
+    def delete(self, namespace, *keys):
+        for key in keys:
+            self._call('incr', self._generation_key(namespace, key))
+
+    def invalidate(self, namespace):
+        self._call('incr', self._namespace_key(namespace))
+
+    def fence(self, namespace, *keys):
+        """Keep replica reads from refilling ``keys`` (or the whole namespace) for ``replica_lag`` seconds."""
+        if self.replica_lag:
+            for key in keys or (None,):
+                self._call('set', self._fence_key(namespace, key), '1', ttl=self.replica_lag)
+
+    def _fenced(self, namespace, key):
+        if not self.replica_lag or not serving_from_replica():
+            return False
+        return any(self._call('get', fence) is not None
+                   for fence in (self._fence_key(namespace), self._fence_key(namespace, key)))
+
+    def get_or_load(self, namespace, key, loader, ttl=None):
+        full_key = self._key(namespace, key)
+        raw = self._call('get', full_key)
+        if raw is not None:
+            return json.loads(raw)
+        return self._flight.do(full_key, lambda: self._load(namespace, key, full_key, loader, ttl))
+
+    def _load(self, namespace, key, full_key, loader, ttl):
+        lock_key = f'{full_key}:lock'
+        locked = self._call('set', lock_key, '1', ttl=self.lock_ttl, only_if_missing=True)
+        if locked is False:  # another process is loading it (None means the backend is down)
+            deadline = time.monotonic() + self.lock_ttl
+            while time.monotonic() < deadline:
+                time.sleep(self.lock_poll)
+                raw = self._call('get', full_key)
+                if raw is not None:
+                    return json.loads(raw)
+        try:
+            value = loader()
+            # Misses are not cached, so a new row is visible right away.
+            if value is not None and not self._fenced(namespace, key):
+                self._call('set', full_key, json.dumps(value), ttl=ttl or self.default_ttl)
+            return value
+        finally:
+            if locked:
+                self._call('delete', lock_key)
+
+    def invalidate_on_commit(self, session, namespace, *keys):
+        """Drop ``keys`` (or the whole namespace) once ``session``'s transaction commits."""
+        session.info.setdefault(PENDING_INVALIDATIONS, []).append((self, namespace, keys))
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _apply_invalidations(session):
+    for cache, namespace, keys in session.info.pop(PENDING_INVALIDATIONS, []):
+        if keys:
+            cache.delete(namespace, *keys)
+        else:
+            cache.invalidate(namespace)
+        cache.fence(namespace, *keys)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_invalidations(session):
+    session.info.pop(PENDING_INVALIDATIONS, None)
+
+
+def init_cache(app):
+    """``CACHE_URL`` (redis://...) shares the cache across workers and hosts; otherwise it is per process.
+
+    ``CACHE_REPLICA_LAG`` is how far (in seconds) the read replica may trail the primary.
+    """
+    app.config.setdefault('CACHE_URL', os.getenv('CACHE_URL'))
+    app.config.setdefault('CACHE_PREFIX', os.getenv('CACHE_PREFIX', 'ecommerce'))
+    app.config.setdefault('CACHE_DEFAULT_TTL', float(os.getenv('CACHE_DEFAULT_TTL', '60')))
+    app.config.setdefault('CACHE_MAX_ENTRIES', int(os.getenv('CACHE_MAX_ENTRIES', '1024')))
+    app.config.setdefault('CACHE_REPLICA_LAG', float(os.getenv('CACHE_REPLICA_LAG', '10')))
+
+    url = app.config['CACHE_URL']
+    backend = RedisBackend.from_url(url) if url else LocalBackend(app.config['CACHE_MAX_ENTRIES'])
+    cache = Cache(backend, app.config['CACHE_PREFIX'], app.config['CACHE_DEFAULT_TTL'],
+                  replica_lag=app.config['CACHE_REPLICA_LAG'])
+    app.extensions['cache'] = cache
+    return cache
+
+
+def get_cache():
+    return current_app.extensions['cache']
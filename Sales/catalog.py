@@ -0,0 +1,189 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from flask import current_app
+
+import clients
+
+
+class CatalogItem:
+    """One inventory item as Sales needs it. ``__slots__`` keeps a large catalog compact in memory."""
+
+    __slots__ = ('id', 'name', 'category', 'price_per_item', 'description', 'count_in_stock')
+
+    def __init__(self, id, name, category=None, price_per_item=0.0, description=None, count_in_stock=0):
+        self.id = id
+        self.name = name
+        self.category = category
+        self.price_per_item = price_per_item
+        self.description = description
+        self.count_in_stock = count_in_stock
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{field: data.get(field) for field in cls.__slots__})
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+class CatalogReplica:
+    """Name-keyed, in-process copy of the Inventory catalog.
+
+    It warm-starts from a local snapshot file, then follows ``GET /inventory/changes``
+    from the snapshot's cursor. Browsing and sale pre-validation read it without leaving
+    the process; the stock check at reservation time still goes to Inventory.
+    """
+
+    def __init__(self, snapshot_path=None):
+        self.snapshot_path = snapshot_path
+        self.cursor = None
+        self.synced_at = None
+        self._by_id = {}
+        self._by_name = {}
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.cursor is not None
+
+    def age(self):
+        return None if self.synced_at is None else time.time() - self.synced_at
+
+    def get(self, name):
+        return self._by_name.get(name.lower())
+
+    def items(self):
+        return list(self._by_id.values())
+
+    def _put(self, item):
+        old = self._by_id.get(item.id)
+        if old is not None and old.name.lower() != item.name.lower():
+            self._by_name.pop(old.name.lower(), None)
+        self._by_id[item.id] = item
+        self._by_name[item.name.lower()] = item
+
+    def _remove(self, item_id):
+        old = self._by_id.pop(item_id, None)
+        if old is not None and self._by_name.get(old.name.lower()) is old:
+            del self._by_name[old.name.lower()]
+
+    def apply(self, payload):
+        """Apply one page of ``GET /inventory/changes``; a snapshot page replaces everything."""
+        items = [CatalogItem.from_dict(data) for data in payload.get('items', [])]
+        with self._lock:
+            if payload.get('snapshot'):
+                self._by_id, self._by_name = {}, {}
+            for item in items:
+                self._put(item)
+            for item_id in payload.get('deleted', []):
+                self._remove(item_id)
+            self.cursor = payload['cursor']
+        return len(items) + len(payload.get('deleted', []))
+
+    def sync(self):
+        """Pull every change since the cursor (a full snapshot the first time). Returns the number applied."""
+        with self._sync_lock:
+            applied = 0
+            while True:
+                response = clients.get_inventory_changes(self.cursor)
+                response.raise_for_status()
+                payload = response.json()
+                applied += self.apply(payload)
+                if not payload.get('has_more'):
+                    break
+            self.synced_at = time.time()
+        if applied:
+            self.save_snapshot()
+        return applied
+
+    def load_snapshot(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                data = json.load(f)
+            self.apply({'snapshot': True, 'cursor': data['cursor'], 'items': data['items']})
+            self.synced_at = os.path.getmtime(self.snapshot_path)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning(f"Ignoring unreadable catalog snapshot {self.snapshot_path}: {str(e)}")
+            return False
+        logging.info(f"Catalog replica warm-started with {len(self._by_id)} items at cursor {self.cursor}.")
+        return True
+
+    def save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            data = {'cursor': self.cursor, 'items': [item.to_dict() for item in self._by_id.values()]}
+        tmp_path = f'{self.snapshot_path}.tmp'
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.snapshot_path)), exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            logging.warning(f"Could not write catalog snapshot {self.snapshot_path}: {str(e)}")
+
+
+class CatalogSync:
+    """Background thread that polls Inventory for changes every ``CATALOG_POLL_INTERVAL`` seconds."""
+
+    def __init__(self, app, replica):
+        self.app = app
+        self.replica = replica
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='catalog-sync', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.replica.sync()
+            except Exception as e:
+                logging.warning(f"Catalog replica sync failed: {str(e)}")
+            time.sleep(self.app.config['CATALOG_POLL_INTERVAL'])
+
+
+def get_catalog():
+    """The replica when it is usable, else None (callers then fetch the catalog from Inventory)."""
+    replica = current_app.extensions.get('catalog')
+    if replica is None or not replica.ready:
+        return None
+    max_age = current_app.config['CATALOG_MAX_STALENESS']
+    if max_age and replica.age() is not None and replica.age() > max_age:
+        return None
+    return replica
+
+
+def init_catalog(app):
+    app.config.setdefault('CATALOG_REPLICA', os.getenv('CATALOG_REPLICA', '1') == '1')
+    app.config.setdefault('CATALOG_SYNC', True)
+    app.config.setdefault('CATALOG_POLL_INTERVAL', float(os.getenv('CATALOG_POLL_INTERVAL', '2')))
+    # Past this age without a successful sync the replica is bypassed; 0 never bypasses it.
+    app.config.setdefault('CATALOG_MAX_STALENESS', float(os.getenv('CATALOG_MAX_STALENESS', '60')))
+    app.config.setdefault('CATALOG_SNAPSHOT_PATH', os.getenv('CATALOG_SNAPSHOT_PATH', 'catalog_snapshot.json'))
+    if not app.config['CATALOG_REPLICA']:
+        return None
+
+    replica = CatalogReplica(app.config['CATALOG_SNAPSHOT_PATH'])
+    replica.load_snapshot()
+    sync = CatalogSync(app, replica)
+    app.extensions['catalog'] = replica
+    app.extensions['catalog_sync'] = sync
+
+    @app.before_request
+    def start_catalog_sync():
+        if app.config['CATALOG_SYNC']:
+            sync.start()
+
+    return replica
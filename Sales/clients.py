@@ -0,0 +1,63 @@
+import os
+from resilience import Bulkhead, CircuitBreaker, DependencyClient
+
+INVENTORY_SERVICE_URL = os.getenv('INVENTORY_SERVICE_URL', 'http://ecommerce_azar_chedid-inventory_service-1:5002/api/v1')
+CUSTOMERS_SERVICE_URL = os.getenv('CUSTOMERS_SERVICE_URL', 'http://ecommerce_azar_chedid-customers_service-1:5001/api/v1')
+
+REQUEST_TIMEOUT = float(os.getenv('DOWNSTREAM_TIMEOUT', '5'))
+HEALTH_TIMEOUT = float(os.getenv('DOWNSTREAM_HEALTH_TIMEOUT', '1'))
+MAX_CONCURRENT_CALLS = int(os.getenv('DOWNSTREAM_MAX_CONCURRENT_CALLS', '10'))
+
+
+def _client(name, base_url):
+    breaker = CircuitBreaker(
+        name,
+        failure_rate_threshold=float(os.getenv('BREAKER_FAILURE_RATE', '0.5')),
+        slow_call_seconds=float(os.getenv('BREAKER_SLOW_CALL_SECONDS', '2')),
+        slow_call_rate_threshold=float(os.getenv('BREAKER_SLOW_CALL_RATE', '0.5')),
+        open_seconds=float(os.getenv('BREAKER_OPEN_SECONDS', '30'))
+    )
+    return DependencyClient(name, base_url, timeout=REQUEST_TIMEOUT, breaker=breaker,
+                            bulkhead=Bulkhead(name, MAX_CONCURRENT_CALLS), health_timeout=HEALTH_TIMEOUT)
+
+
+inventory_client = _client('inventory_service', INVENTORY_SERVICE_URL)
+customers_client = _client('customer_service', CUSTOMERS_SERVICE_URL)
+
+
+def _idempotency_headers(idempotency_key):
+    return {'Idempotency-Key': idempotency_key} if idempotency_key else None
+
+
+def get_customer(username):
+    return customers_client.get(f'/customers/{username}')
+
+
+def deduct_wallet(username, amount, idempotency_key=None):
+    return customers_client.post(f'/customers/{username}/deduct', json={'amount': amount},
+                                 headers=_idempotency_headers(idempotency_key))
+
+
+def charge_wallet(username, amount, idempotency_key=None):
+    return customers_client.post(f'/customers/{username}/charge', json={'amount': amount},
+                                 headers=_idempotency_headers(idempotency_key))
+
+
+def get_inventory():
+    return inventory_client.get('/inventory')
+
+
+def get_inventory_changes(since=None, limit=1000):
+    params = {'limit': limit} if since is None else {'since': since, 'limit': limit}
+    return inventory_client.get('/inventory/changes', params=params)
+
+
+def find_item(inventory_data, item_name):
+    if not isinstance(inventory_data, list):
+        return None
+    return next((item for item in inventory_data if item.get('name', '').lower() == item_name.lower()), None)
+
+
+def deduct_stock(item_id, quantity, idempotency_key=None):
+    return inventory_client.post(f'/inventory/{item_id}/deduct', json={'quantity': quantity},
+                                 headers=_idempotency_headers(idempotency_key))
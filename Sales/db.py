@@ -1,2 +1,3 @@
 from flask_sqlalchemy import SQLAlchemy
-db = SQLAlchemy()
\ No newline at end of file
+from routing import RoutingSession
+db = SQLAlchemy(session_options={'class_': RoutingSession})
\ No newline at end of file
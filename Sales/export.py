@@ -0,0 +1,225 @@
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, Text, create_engine, select
+
+from db import db
+from archive import recorded_purchases
+
+DEFAULT_BATCH_SIZE = 10000
+WATERMARK_FILE = '_watermark.json'
+
+
+def _load_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("pyarrow is required for columnar exports (pip install pyarrow).") from e
+    return pa, pq
+
+
+def _purchase_schema(pa):
+    return pa.schema([
+        ('purchase_id', pa.int64()),
+        ('customer_username', pa.string()),
+        ('item_name', pa.string()),
+        ('quantity', pa.int64()),
+        ('total_price', pa.float64()),
+        ('purchase_date', pa.timestamp('us')),
+    ])
+
+
+def _review_schema(pa):
+    return pa.schema([
+        ('id', pa.int64()),
+        ('customer_username', pa.string()),
+        ('item_name', pa.string()),
+        ('rating', pa.int64()),
+        ('comment', pa.string()),
+        ('status', pa.string()),
+        ('created_at', pa.timestamp('us')),
+        ('updated_at', pa.timestamp('us')),
+    ])
+
+
+# Typed view of the Reviews service table: SQLite hands timestamps back as strings,
+# and the DateTime columns parse them so they match the Parquet schema.
+_reviews = Table(
+    'reviews', MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('customer_username', String),
+    Column('item_name', String),
+    Column('rating', Integer),
+    Column('comment', Text),
+    Column('status', String),
+    Column('created_at', DateTime),
+    Column('updated_at', DateTime),
+)
+
+
+def read_watermark(dataset_dir):
+    path = os.path.join(dataset_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return json.load(f).get('last_id', 0)
+
+
+def read_recorded_watermark(dataset_dir):
+    """``(recorded_at, last_id)`` of the last exported row; ``recorded_at`` is None before the first one."""
+    path = os.path.join(dataset_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return None, 0
+    with open(path) as f:
+        watermark = json.load(f)
+    recorded_at = watermark.get('last_recorded_at')
+    return datetime.fromisoformat(recorded_at) if recorded_at else None, watermark.get('last_id', 0)
+
+
+def write_watermark(dataset_dir, last_id, recorded_at=None):
+    # Write-then-rename so a crash mid-export never leaves a torn watermark.
+    path = os.path.join(dataset_dir, WATERMARK_FILE)
+    tmp_path = f'{path}.tmp'
+    watermark = {'last_id': last_id}
+    if recorded_at is not None:
+        watermark['last_recorded_at'] = recorded_at.isoformat()
+    with open(tmp_path, 'w') as f:
+        json.dump(watermark, f)
+    os.replace(tmp_path, path)
+
+
+def iter_purchase_batches(after, until, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield purchases recorded after ``after`` = ``(recorded_at, purchase_id)`` and by ``until``, in batches.
+
+    Archived purchases are included, so a row archived before the export reached it is
+    still exported. Without ``recorded_at`` (first run, ``since_id`` or a watermark of an
+    older version), every purchase with a higher id is exported.
+    """
+    min_id = after[1] if after[0] is None else 0
+    while True:
+        batch = recorded_purchases(after, until, batch_size, min_id)
+        if not batch:
+            return
+        after = (batch[-1].purchase_date, batch[-1].purchase_id)
+        yield [{
+            'purchase_id': p.purchase_id,
+            'customer_username': p.customer_username,
+            'item_name': p.item_name,
+            'quantity': p.quantity,
+            'total_price': p.total_price,
+            'purchase_date': p.purchase_date,
+        } for p in batch]
+        # Drop the batch from the identity map so memory stays flat on large tables.
+        db.session.expunge_all()
+
+
+def iter_review_batches(engine, since_id, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield rows of the Reviews service ``reviews`` table from a separate database."""
+    last_id = since_id
+    with engine.connect() as conn:
+        while True:
+            query = select(_reviews).where(_reviews.c.id > last_id).order_by(_reviews.c.id).limit(batch_size)
+            rows = [dict(row._mapping) for row in conn.execute(query)]
+            if not rows:
+                return
+            last_id = rows[-1]['id']
+            yield rows
+
+
+def _partition_key(value):
+    if value is None:
+        return 'unknown'
+    if isinstance(value, str):
+        return value[:10]
+    return value.date().isoformat()
+
+
+def export_dataset(batches, dataset_dir, schema, id_field, date_field, compression='snappy', recorded_field=None):
+    """Write each batch as Parquet files partitioned by ``date_field`` (Hive-style ``date=YYYY-MM-DD``).
+
+    The watermark is advanced after every batch, so an interrupted export resumes
+    where it stopped instead of starting over. With ``recorded_field`` it also keeps that
+    field of the last row, for datasets paginated by when rows were recorded.
+    """
+    pa, pq = _load_pyarrow()
+    os.makedirs(dataset_dir, exist_ok=True)
+    summary = {'rows': 0, 'files': 0, 'watermark': read_watermark(dataset_dir)}
+
+    for batch in batches:
+        partitions = {}
+        for row in batch:
+            partitions.setdefault(_partition_key(row[date_field]), []).append(row)
+
+        for day, rows in partitions.items():
+            partition_dir = os.path.join(dataset_dir, f'date={day}')
+            os.makedirs(partition_dir, exist_ok=True)
+            filename = f'part-{rows[0][id_field]:012d}-{rows[-1][id_field]:012d}.parquet'
+            table = pa.Table.from_pylist(rows, schema=schema)
+            pq.write_table(table, os.path.join(partition_dir, filename), compression=compression)
+            summary['files'] += 1
+
+        summary['rows'] += len(batch)
+        summary['watermark'] = batch[-1][id_field]
+        write_watermark(dataset_dir, summary['watermark'], batch[-1][recorded_field] if recorded_field else None)
+
+    return summary
+
+
+def export_purchases(out_dir, since_id=None, batch_size=DEFAULT_BATCH_SIZE, reviews_uri=None, compression='snappy',
+                     safety_lag=0):
+    """Incrementally export purchases (and optionally reviews) to ``out_dir``.
+
+    When ``since_id`` is not given, each dataset continues from its stored watermark.
+    Purchases recorded in the last ``safety_lag`` seconds wait for the next run, so one
+    still committing when the export passes its time is not skipped.
+    """
+    pa, _ = _load_pyarrow()
+    result = {}
+
+    purchases_dir = os.path.join(out_dir, 'purchases')
+    start = (None, since_id) if since_id is not None else read_recorded_watermark(purchases_dir)
+    until = datetime.utcnow() - timedelta(seconds=safety_lag)
+    result['purchases'] = export_dataset(
+        iter_purchase_batches(start, until, batch_size), purchases_dir,
+        _purchase_schema(pa), 'purchase_id', 'purchase_date', compression, recorded_field='purchase_date'
+    )
+    logging.info(f"Exported {result['purchases']['rows']} purchases to {purchases_dir}")
+
+    if reviews_uri:
+        reviews_dir = os.path.join(out_dir, 'reviews')
+        start = since_id if since_id is not None else read_watermark(reviews_dir)
+        engine = create_engine(reviews_uri)
+        try:
+            result['reviews'] = export_dataset(
+                iter_review_batches(engine, start, batch_size), reviews_dir,
+                _review_schema(pa), 'id', 'created_at', compression
+            )
+        finally:
+            engine.dispose()
+        logging.info(f"Exported {result['reviews']['rows']} reviews to {reviews_dir}")
+
+    return result
+
+
+@click.command('export-purchases')
+@click.option('--out-dir', default=None, help='Target directory (defaults to EXPORT_DIR).')
+@click.option('--since-id', type=int, default=None, help='Override the stored high-watermark.')
+@click.option('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, show_default=True)
+@click.option('--with-reviews', is_flag=True, help='Also export rows from REVIEWS_DATABASE_URI.')
+def export_purchases_command(out_dir, since_id, batch_size, with_reviews):
+    """Export purchases to partitioned Parquet files."""
+    config = current_app.config
+    result = export_purchases(
+        out_dir or config['EXPORT_DIR'],
+        since_id=since_id,
+        batch_size=batch_size,
+        reviews_uri=config.get('REVIEWS_DATABASE_URI') if with_reviews else None,
+        compression=config['EXPORT_COMPRESSION'],
+        safety_lag=config['EXPORT_SAFETY_LAG'],
+    )
+    click.echo(json.dumps(result))
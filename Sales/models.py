@@ -19,3 +19,118 @@ class Purchase(db.Model):
             "total_price": self.total_price,
             "purchase_date": self.purchase_date.isoformat() if self.purchase_date else None
         }
+
+
+class SaleIntent(db.Model):
+    """Outbox row for a sale: written before any downstream call, then driven to completion by the worker."""
+    __tablename__ = 'sale_intents'
+    __table_args__ = (
+        db.Index('ix_sale_intents_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    customer_username = db.Column(db.String(80), nullable=False)
+    item_name = db.Column(db.String(80), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, compensating, completed, failed, refund_failed
+    item_id = db.Column(db.Integer)
+    total_price = db.Column(db.Float)
+    wallet_debited = db.Column(db.Boolean, nullable=False, default=False)
+    stock_updated = db.Column(db.Boolean, nullable=False, default=False)
+    purchase_id = db.Column(db.Integer)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=db.func.now())
+    lease_expires_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=db.func.now())
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now())
+
+    def to_dict(self):
+        return {
+            "sale_id": self.id,
+            "customer_username": self.customer_username,
+            "item_name": self.item_name,
+            "quantity": self.quantity,
+            "status": self.status,
+            "total_price": self.total_price,
+            "purchase_id": self.purchase_id,
+            "attempts": self.attempts,
+            "error": self.last_error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+class SaleEvent(db.Model):
+    """Event outbox: written in the same transaction as the intent's final status, relayed to the broker later."""
+    __tablename__ = 'sale_events'
+    __table_args__ = (
+        db.Index('ix_sale_events_published_at', 'published_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    key = db.Column(db.String(80), unique=True, nullable=False)
+    topic = db.Column(db.String(40), nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    created_at = db.Column(db.DateTime, default=db.func.now())
+    published_at = db.Column(db.DateTime)
+
+
+class PurchaseArchiveSummary(db.Model):
+    """Per-customer monthly totals of purchases that were moved to an archive database."""
+    __tablename__ = 'purchase_archive_summaries'
+
+    month = db.Column(db.String(7), primary_key=True)  # YYYY-MM
+    customer_username = db.Column(db.String(80), primary_key=True)
+    purchase_count = db.Column(db.Integer, nullable=False, default=0)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    total_spend = db.Column(db.Float, nullable=False, default=0.0)
+
+    def to_dict(self):
+        return {
+            "month": self.month,
+            "customer_username": self.customer_username,
+            "purchase_count": self.purchase_count,
+            "quantity": self.quantity,
+            "total_spend": self.total_spend
+        }
+
+
+class CustomerPurchaseSummary(db.Model):
+    """Lifetime purchase totals of one customer, kept up to date by ``record_purchase``."""
+    __tablename__ = 'customer_purchase_summaries'
+
+    customer_username = db.Column(db.String(80), primary_key=True)
+    purchase_count = db.Column(db.Integer, nullable=False, default=0)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    total_spend = db.Column(db.Float, nullable=False, default=0.0)
+    last_purchase_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            "customer_username": self.customer_username,
+            "purchase_count": self.purchase_count,
+            "quantity": self.quantity,
+            "total_spend": self.total_spend,
+            "last_purchase_at": self.last_purchase_at.isoformat() if self.last_purchase_at else None
+        }
+
+
+class CustomerItemPurchase(db.Model):
+    """One row per (customer, item) ever bought: the set of purchased items, keyed case-insensitively."""
+    __tablename__ = 'customer_item_purchases'
+
+    customer_username = db.Column(db.String(80), primary_key=True)
+    item_key = db.Column(db.String(80), primary_key=True)  # lower-cased item name
+    item_name = db.Column(db.String(80), nullable=False)
+    purchase_count = db.Column(db.Integer, nullable=False, default=0)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    last_purchase_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            "item_name": self.item_name,
+            "purchase_count": self.purchase_count,
+            "quantity": self.quantity,
+            "last_purchase_at": self.last_purchase_at.isoformat() if self.last_purchase_at else None
+        }
@@ -0,0 +1,380 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+import requests
+from flask import current_app
+from sqlalchemy import or_, update
+
+import clients
+from db import db
+from catalog import get_catalog
+from events import SALE_COMPLETED, SALE_FAILED, get_broker
+from models import SaleEvent, SaleIntent
+from sharding import record_purchase
+
+LEASE_SECONDS = 30
+MAX_BACKOFF_SECONDS = 300
+# Timeout, idempotent request still in flight, rate limited: the step may well have happened or will.
+RETRYABLE_STATUSES = {408, 409, 429}
+
+
+class TransientFailure(Exception):
+    """A downstream step failed in a way that may succeed on retry (not before ``retry_after`` seconds, if set)."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PermanentFailure(Exception):
+    """A downstream step failed in a way that retrying cannot fix."""
+
+
+def enqueue_sale(customer_username, item_name, quantity):
+    """Persist the sale intent; nothing downstream is touched until the worker picks it up."""
+    intent = SaleIntent(
+        customer_username=customer_username,
+        item_name=item_name,
+        quantity=quantity,
+        status='pending',
+        next_attempt_at=datetime.utcnow()
+    )
+    db.session.add(intent)
+    db.session.commit()
+    return intent
+
+
+def _backoff(attempts):
+    return timedelta(seconds=min(2 ** attempts, MAX_BACKOFF_SECONDS))
+
+
+def _call(func, *args, **kwargs):
+    try:
+        return func(*args, **kwargs)
+    except requests.exceptions.RequestException as e:
+        raise TransientFailure(f"{func.__name__} failed: {str(e)}")
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        # Absent, or the HTTP-date form; the regular backoff applies.
+        return None
+
+
+def _check(response, action):
+    """Map a downstream response to success, a permanent failure (most 4xx) or a transient one."""
+    if response.status_code == 200:
+        return
+    if 400 <= response.status_code < 500 and response.status_code not in RETRYABLE_STATUSES:
+        raise PermanentFailure(f"Failed to {action} (status {response.status_code}).")
+    raise TransientFailure(f"Failed to {action} (status {response.status_code}).", _retry_after(response))
+
+
+def _fetch_item(intent):
+    inventory_response = _call(clients.get_inventory)
+    _check(inventory_response, "retrieve goods from Inventory service")
+    item = clients.find_item(inventory_response.json(), intent.item_name)
+    if not item:
+        raise PermanentFailure("Item not found.")
+    return item
+
+
+def _priced_item(intent):
+    # The local replica is enough to price the sale and to pass the stock check; a stock
+    # shortage it reports is confirmed with Inventory, and the stock step re-checks anyway.
+    catalog = get_catalog()
+    item = catalog.get(intent.item_name) if catalog is not None else None
+    return item.to_dict() if item is not None else _fetch_item(intent)
+
+
+def _idempotency_key(intent, step):
+    return f"sale-{intent.id}-{step}"
+
+
+def _emit(intent, topic):
+    """Queue ``topic`` for the intent in the current transaction, so the event exists iff its status does."""
+    if get_broker() is None:
+        return
+    db.session.add(SaleEvent(
+        key=f"sale-{intent.id}-{topic}",
+        topic=topic,
+        payload={
+            "sale_id": intent.id,
+            "customer_username": intent.customer_username,
+            "item_name": intent.item_name,
+            "item_id": intent.item_id,
+            "quantity": intent.quantity,
+            "total_price": intent.total_price,
+            "purchase_id": intent.purchase_id,
+            "error": intent.last_error,
+            "occurred_at": datetime.utcnow().isoformat()
+        }
+    ))
+
+
+def _advance(intent):
+    """Run the remaining steps of a sale. Each completed step is committed before the next one starts,
+    so a crash or retry resumes after the last step that is known to have happened. Remote steps carry
+    an Idempotency-Key, so repeating one whose outcome was lost (timeout, crash) does not apply it twice."""
+    if intent.total_price is None:
+        customer_response = _call(clients.get_customer, intent.customer_username)
+        if customer_response.status_code == 404:
+            raise PermanentFailure("Customer not found.")
+        _check(customer_response, "retrieve customer")
+        customer_wallet = customer_response.json().get('wallet')
+
+        item = _priced_item(intent)
+        if item.get('count_in_stock') < intent.quantity:
+            # The replica may not have seen a restock yet: only Inventory's own count fails the sale.
+            item = _fetch_item(intent)
+            if item.get('count_in_stock') < intent.quantity:
+                raise PermanentFailure("Insufficient stock.")
+
+        total_price = item.get('price_per_item') * intent.quantity
+        if customer_wallet < total_price:
+            raise PermanentFailure("Insufficient funds in wallet.")
+
+        intent.item_id = item.get('id')
+        intent.total_price = total_price
+        db.session.commit()
+        logging.info(f"Sale {intent.id} priced at {total_price} for customer: {intent.customer_username}")
+
+    if not intent.wallet_debited:
+        _check(_call(clients.deduct_wallet, intent.customer_username, intent.total_price,
+                     idempotency_key=_idempotency_key(intent, 'deduct')),
+               "deduct from customer wallet")
+        intent.wallet_debited = True
+        db.session.commit()
+        logging.info(f"Sale {intent.id}: deducted {intent.total_price} from customer wallet: {intent.customer_username}")
+
+    if not intent.stock_updated:
+        # A relative decrement: a retry after a lost response sends the very same request,
+        # and Inventory checks the stock authoritatively under its own lock.
+        response = _call(clients.deduct_stock, intent.item_id, intent.quantity,
+                         idempotency_key=_idempotency_key(intent, 'stock'))
+        if response.status_code == 400:
+            raise PermanentFailure("Insufficient stock.")
+        _check(response, "update item in inventory")
+        intent.stock_updated = True
+        db.session.commit()
+        logging.info(f"Sale {intent.id}: inventory updated for item: {intent.item_name}")
+
+    # Unsharded, the purchase row and the intent's final status commit together;
+    # sharded, recording the purchase is idempotent so a retry cannot duplicate it.
+    intent.purchase_id = record_purchase(intent)
+    intent.status = 'completed'
+    intent.last_error = None
+    _emit(intent, SALE_COMPLETED)
+    logging.info(f"Sale {intent.id} completed: purchase {intent.purchase_id} recorded.")
+
+
+def _compensate(intent):
+    """Undo the wallet deduction of a failed sale. Raises TransientFailure to be retried later.
+
+    A refund Customers rejects outright (the customer was deleted, say) cannot be retried
+    into success: the sale ends as ``refund_failed`` for someone to settle by hand.
+    """
+    if intent.wallet_debited:
+        try:
+            _check(_call(clients.charge_wallet, intent.customer_username, intent.total_price,
+                         idempotency_key=_idempotency_key(intent, 'refund')),
+                   "refund customer wallet")
+        except PermanentFailure as e:
+            intent.status = 'refund_failed'
+            intent.last_error = f"{intent.last_error} | Refund failed: {str(e)}" if intent.last_error else f"Refund failed: {str(e)}"
+            logging.error(f"Sale {intent.id}: refund of {intent.total_price} to customer {intent.customer_username} "
+                          f"needs manual action: {str(e)}")
+            _emit(intent, SALE_FAILED)
+            return
+        intent.wallet_debited = False
+        logging.info(f"Sale {intent.id}: refunded {intent.total_price} to customer: {intent.customer_username}")
+    intent.status = 'failed'
+    _emit(intent, SALE_FAILED)
+
+
+def _fail(intent, reason):
+    logging.warning(f"Sale {intent.id} failed: {reason}")
+    intent.last_error = reason
+    intent.attempts = 0
+    if intent.wallet_debited:
+        intent.status = 'compensating'
+        _compensate(intent)
+    else:
+        intent.status = 'failed'
+        _emit(intent, SALE_FAILED)
+
+
+def _outcome_unknown(intent):
+    """Whether a keyed remote step (wallet debit, stock deduct) may have been applied unheard.
+
+    Once a sale is priced, a timeout or lost response can hide a debit Customers already
+    applied. Giving up would fail the sale without refunding it, so such intents are
+    replayed with the same Idempotency-Key until a definite answer arrives.
+    """
+    return intent.total_price is not None
+
+
+def process_intent(intent, max_attempts):
+    try:
+        try:
+            if intent.status == 'compensating':
+                _compensate(intent)
+            else:
+                _advance(intent)
+        except PermanentFailure as e:
+            _fail(intent, str(e))
+        except TransientFailure as e:
+            if intent.status == 'pending' and not _outcome_unknown(intent) and intent.attempts + 1 >= max_attempts:
+                _fail(intent, f"Gave up after {intent.attempts + 1} attempts: {str(e)}")
+            else:
+                raise
+    except TransientFailure as e:
+        # Compensations and steps of unknown outcome are retried until they get an answer;
+        # anything else only up to max_attempts.
+        intent.attempts += 1
+        intent.last_error = str(e)
+        delay = _backoff(intent.attempts)
+        if e.retry_after:
+            delay = max(delay, timedelta(seconds=min(e.retry_after, MAX_BACKOFF_SECONDS)))
+        intent.next_attempt_at = datetime.utcnow() + delay
+        logging.warning(f"Sale {intent.id} will be retried (attempt {intent.attempts}): {str(e)}")
+    except Exception as e:
+        # Never let one intent stall the outbox: back off like a transient failure and move on.
+        db.session.rollback()
+        intent.attempts += 1
+        intent.last_error = f"Unexpected error: {str(e)}"
+        intent.next_attempt_at = datetime.utcnow() + _backoff(intent.attempts)
+        logging.exception(f"Sale {intent.id} hit an unexpected error (attempt {intent.attempts})")
+    finally:
+        intent.lease_expires_at = None
+        db.session.commit()
+
+
+def _claim(intent_id):
+    """Lease an intent so concurrent workers (other processes) never drive the same sale at once.
+
+    The lease starts now, not when the batch was selected, and the intent must still be due:
+    another worker may have finished it since.
+    """
+    now = datetime.utcnow()
+    result = db.session.execute(
+        update(SaleIntent)
+        .where(SaleIntent.id == intent_id,
+               SaleIntent.status.in_(['pending', 'compensating']),
+               SaleIntent.next_attempt_at <= now,
+               or_(SaleIntent.lease_expires_at.is_(None), SaleIntent.lease_expires_at < now))
+        .values(lease_expires_at=now + timedelta(seconds=LEASE_SECONDS))
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def process_due_intents(max_attempts=None, batch_size=50):
+    """Process every pending or compensating intent that is due. Returns how many were processed."""
+    if max_attempts is None:
+        max_attempts = current_app.config['SALES_OUTBOX_MAX_ATTEMPTS']
+    now = datetime.utcnow()
+    due_ids = [row.id for row in (
+        SaleIntent.query.with_entities(SaleIntent.id)
+        .filter(SaleIntent.status.in_(['pending', 'compensating']), SaleIntent.next_attempt_at <= now)
+        .order_by(SaleIntent.next_attempt_at)
+        .limit(batch_size)
+    )]
+
+    processed = 0
+    for intent_id in due_ids:
+        if not _claim(intent_id):
+            continue
+        process_intent(db.session.get(SaleIntent, intent_id), max_attempts)
+        processed += 1
+    return processed
+
+
+def publish_pending_events(batch_size=100):
+    """Relay queued sale events to the broker. Returns how many were published.
+
+    Each event is marked only after the broker accepted it, so a crash in between
+    publishes it again: consumers get at-least-once delivery and dedupe on the event key.
+    """
+    broker = get_broker()
+    if broker is None:
+        return 0
+    events = (SaleEvent.query.filter(SaleEvent.published_at.is_(None))
+              .order_by(SaleEvent.id).limit(batch_size).all())
+    for event in events:
+        broker.publish(event.topic, event.payload, key=event.key)
+        event.published_at = datetime.utcnow()
+        db.session.commit()
+    return len(events)
+
+
+def drain():
+    """Drive due intents, then relay events. Each runs on its own, so a bad intent never holds up events."""
+    for name, step in (('intents', process_due_intents), ('event relay', publish_pending_events)):
+        try:
+            while step():
+                pass
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Sales outbox {name} failed: {str(e)}")
+
+
+class OutboxWorker:
+    """Background thread that drains the sale outbox, woken early whenever a sale is enqueued."""
+
+    def __init__(self, app):
+        self.app = app
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='sales-outbox', daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        if self.app.config['SALES_OUTBOX_WORKER']:
+            self.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.app.config['SALES_OUTBOX_POLL_INTERVAL'])
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    drain()
+            except Exception as e:
+                logging.error(f"Sales outbox worker error: {str(e)}")
+
+
+@click.command('process-sales')
+@click.option('--once', is_flag=True, help='Drain due intents once and exit.')
+def process_sales_command(once):
+    """Run the sale outbox worker (and the event relay) in the foreground."""
+    while True:
+        drain()
+        if once:
+            return
+        time.sleep(current_app.config['SALES_OUTBOX_POLL_INTERVAL'])
+
+
+def init_outbox(app):
+    worker = OutboxWorker(app)
+    app.extensions['sales_outbox'] = worker
+    app.cli.add_command(process_sales_command)
+
+    @app.before_request
+    def start_outbox_worker():
+        # Resume intents left over from a previous process as soon as we serve traffic.
+        if app.config['SALES_OUTBOX_WORKER']:
+            worker.start()
+
+    return worker
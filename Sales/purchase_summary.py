@@ -0,0 +1,94 @@
+from sqlalchemy import delete, inspect, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import CustomerItemPurchase, CustomerPurchaseSummary
+
+SUMMARY_TABLES = (CustomerPurchaseSummary.__tablename__, CustomerItemPurchase.__tablename__)
+
+_DIALECT_INSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def item_key(item_name):
+    return item_name.lower()
+
+
+def _upsert(session, model, keys, increments, replace):
+    """Insert a row, or add ``increments`` to and overwrite ``replace`` on the existing one, atomically."""
+    dialect = session.get_bind(mapper=inspect(model)).dialect.name
+    insert = _DIALECT_INSERTS.get(dialect)
+    if insert is None:
+        row = session.get(model, tuple(keys.values()))
+        if row is None:
+            session.add(model(**keys, **increments, **replace))
+        else:
+            for name, value in increments.items():
+                setattr(row, name, getattr(row, name) + value)
+            for name, value in replace.items():
+                setattr(row, name, value)
+        return
+
+    statement = insert(model).values(**keys, **increments, **replace)
+    set_ = {name: getattr(model, name) + getattr(statement.excluded, name) for name in increments}
+    set_.update({name: getattr(statement.excluded, name) for name in replace})
+    session.execute(statement.on_conflict_do_update(index_elements=list(keys), set_=set_))
+
+
+def add_to_summary(session, purchase):
+    """Fold one purchase into its customer's summary rows, in ``session``'s transaction.
+
+    Both rows are upserts that add to the stored totals, so concurrent purchases of the
+    same customer never lose an update.
+    """
+    _upsert(session, CustomerPurchaseSummary,
+            {'customer_username': purchase.customer_username},
+            {'purchase_count': 1, 'quantity': purchase.quantity, 'total_spend': purchase.total_price},
+            {'last_purchase_at': purchase.purchase_date})
+    _upsert(session, CustomerItemPurchase,
+            {'customer_username': purchase.customer_username, 'item_key': item_key(purchase.item_name)},
+            {'purchase_count': 1, 'quantity': purchase.quantity},
+            {'item_name': purchase.item_name, 'last_purchase_at': purchase.purchase_date})
+
+
+def clear_summaries(session):
+    session.execute(delete(CustomerItemPurchase))
+    session.execute(delete(CustomerPurchaseSummary))
+
+
+def summary_dict(customer_username, summary, items):
+    """The shape every summary endpoint returns; a customer without purchases gets zeros."""
+    result = summary.to_dict() if summary is not None else {
+        "customer_username": customer_username,
+        "purchase_count": 0,
+        "quantity": 0,
+        "total_spend": 0.0,
+        "last_purchase_at": None
+    }
+    result["items"] = [item.to_dict() for item in items]
+    return result
+
+
+def load_summaries(session, usernames):
+    """``{username: (summary or None, [items])}`` for ``usernames``, in two primary-key lookups."""
+    usernames = list(usernames)
+    summaries = {row.customer_username: row for row in session.scalars(
+        select(CustomerPurchaseSummary).where(CustomerPurchaseSummary.customer_username.in_(usernames)))}
+    items = {}
+    for row in session.scalars(
+            select(CustomerItemPurchase)
+            .where(CustomerItemPurchase.customer_username.in_(usernames))
+            .order_by(CustomerItemPurchase.customer_username, CustomerItemPurchase.item_key)):
+        items.setdefault(row.customer_username, []).append(row)
+    return {username: (summaries.get(username), items.get(username, [])) for username in usernames}
+
+
+
+def purchased_pairs(session, pairs):
+    """The ``(customer_username, item_name)`` pairs in ``pairs`` that were bought, in one indexed query."""
+    keys = {}
+    for username, item_name in pairs:  # "Laptop" and "LAPTOP" share a key but are both answered
+        keys.setdefault((username, item_key(item_name)), []).append((username, item_name))
+    found = session.execute(
+        select(CustomerItemPurchase.customer_username, CustomerItemPurchase.item_key)
+        .where(tuple_(CustomerItemPurchase.customer_username, CustomerItemPurchase.item_key).in_(list(keys)))
+    ).all()
+    return {pair for row in found for pair in keys[tuple(row)]}
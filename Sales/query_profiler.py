@@ -0,0 +1,123 @@
+import logging
+import os
+import time
+from collections import Counter
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+EXPLAINABLE = ('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A route issued more statements than its budget; raised only when ``QUERY_BUDGET_STRICT`` is on."""
+
+
+class QueryStats:
+    """Statements run by one request: how many, how long, and how often each distinct SQL text repeats."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def record(self, statement, elapsed):
+        self.count += 1
+        self.duration += elapsed
+        self.statements[statement] += 1
+
+    def repeated(self, threshold):
+        return [(statement, count) for statement, count in self.statements.most_common() if count >= threshold]
+
+
+def _current_stats():
+    if not has_request_context():
+        return None
+    return g.get('query_stats')
+
+
+def _explain(cursor, dialect, statement, parameters):
+    # A separate DBAPI cursor on the same connection: bypasses SQLAlchemy's events and
+    # leaves the results of the statement being profiled untouched.
+    prefix = 'EXPLAIN QUERY PLAN' if dialect.name == 'sqlite' else 'EXPLAIN'
+    explain_cursor = cursor.connection.cursor()
+    try:
+        explain_cursor.execute(f'{prefix} {statement}', parameters)
+        return [' '.join(str(column) for column in row) for row in explain_cursor.fetchall()]
+    finally:
+        explain_cursor.close()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    if _current_stats() is not None:
+        conn.info.setdefault('query_profiler_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _record_statement(conn, cursor, statement, parameters, context, executemany):
+    stats = _current_stats()
+    starts = conn.info.get('query_profiler_start')
+    if stats is None or not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    stats.record(statement, elapsed)
+
+    slow_ms = current_app.config['QUERY_SLOW_MS']
+    if slow_ms and elapsed * 1000 >= slow_ms:
+        plan = None
+        if not executemany and statement.lstrip().upper().startswith(EXPLAINABLE):
+            try:
+                plan = _explain(cursor, conn.dialect, statement, parameters)
+            except Exception as e:
+                plan = [f"unavailable: {str(e)}"]
+        logging.warning(f"Slow query ({elapsed * 1000:.1f} ms) in {request.endpoint}: {statement} | plan: {plan}")
+
+
+def _budget(endpoint):
+    config = current_app.config
+    return config['QUERY_BUDGETS'].get(endpoint, config['QUERY_BUDGET'])
+
+
+def start_profiling():
+    if current_app.config['QUERY_PROFILER']:
+        g.query_stats = QueryStats()
+
+
+def finish_profiling(response):
+    stats = g.pop('query_stats', None)
+    if stats is None:
+        return response
+    config = current_app.config
+    response.headers['X-Query-Count'] = str(stats.count)
+    response.headers['Server-Timing'] = f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries"'
+
+    for statement, count in stats.repeated(config['QUERY_N_PLUS_ONE_THRESHOLD']):
+        logging.warning(f"Possible N+1 in {request.endpoint}: statement ran {count} times: {statement}")
+
+    budget = _budget(request.endpoint)
+    if budget and stats.count > budget:
+        message = f"{request.endpoint} issued {stats.count} queries, over its budget of {budget}."
+        logging.warning(message)
+        if config['QUERY_BUDGET_STRICT']:
+            raise QueryBudgetExceeded(message)
+    return response
+
+
+def init_query_profiler(app):
+    """Per-request statement counts and timings, reported in ``X-Query-Count`` and ``Server-Timing``.
+
+    ``QUERY_BUDGET`` (0 means none) and per-endpoint ``QUERY_BUDGETS`` cap statements per
+    request; over budget is logged, and with ``QUERY_BUDGET_STRICT`` (for tests and CI)
+    the request fails instead.
+    """
+    app.config.setdefault('QUERY_PROFILER', os.getenv('QUERY_PROFILER', '1') == '1')
+    app.config.setdefault('QUERY_SLOW_MS', float(os.getenv('QUERY_SLOW_MS', '100')))
+    app.config.setdefault('QUERY_N_PLUS_ONE_THRESHOLD', int(os.getenv('QUERY_N_PLUS_ONE_THRESHOLD', '5')))
+    app.config.setdefault('QUERY_BUDGET', int(os.getenv('QUERY_BUDGET', '0')))
+    app.config.setdefault('QUERY_BUDGETS', {})
+    app.config.setdefault('QUERY_BUDGET_STRICT', os.getenv('QUERY_BUDGET_STRICT', '0') == '1')
+
+    app.before_request(start_profiling)
+    app.after_request(finish_profiling)
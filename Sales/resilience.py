@@ -0,0 +1,187 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import requests
+
+from cache import SingleFlight
+
+try:
+    import msgpack
+except ImportError:  # optional: without it the clients ask for JSON
+    msgpack = None
+
+MSGPACK_MIMETYPE = 'application/msgpack'
+SERVICE_TOKEN_HEADER = 'X-Service-Token'
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised without touching the network while a dependency's circuit is open."""
+
+
+class BulkheadFullError(requests.exceptions.ConnectionError):
+    """Raised when too many calls to a dependency are already in flight."""
+
+
+class CircuitBreaker:
+    """Count-based circuit breaker over the last ``window_size`` calls.
+
+    The circuit opens when, over at least ``minimum_calls`` calls, the failure rate or the
+    rate of calls slower than ``slow_call_seconds`` reaches its threshold. After
+    ``open_seconds`` it lets ``half_open_calls`` probe calls through: all of them must
+    succeed to close the circuit again, any failure re-opens it.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_rate_threshold=0.5, slow_call_seconds=2.0, slow_call_rate_threshold=0.5,
+                 window_size=20, minimum_calls=10, open_seconds=30.0, half_open_calls=3, clock=time.monotonic):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.minimum_calls = minimum_calls
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._window = deque(maxlen=window_size)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._half_open_permits = 0
+        self._half_open_successes = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self):
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.open_seconds:
+            self._state = self.HALF_OPEN
+            self._half_open_permits = self.half_open_calls
+            self._half_open_successes = 0
+            logging.info(f"Circuit for {self.name} is half-open; probing.")
+
+    def _open(self):
+        self._state = self.OPEN
+        self._opened_at = self._clock()
+        self._window.clear()
+        logging.warning(f"Circuit for {self.name} opened.")
+
+    def before_call(self):
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == self.OPEN:
+                raise CircuitOpenError(f"Circuit for {self.name} is open.")
+            if self._state == self.HALF_OPEN:
+                if self._half_open_permits <= 0:
+                    raise CircuitOpenError(f"Circuit for {self.name} is half-open; probe in progress.")
+                self._half_open_permits -= 1
+
+    def record(self, success, duration):
+        slow = duration >= self.slow_call_seconds
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                if not success or slow:
+                    self._open()
+                    return
+                self._half_open_successes += 1
+                if self._half_open_successes >= self.half_open_calls:
+                    self._state = self.CLOSED
+                    self._window.clear()
+                    logging.info(f"Circuit for {self.name} closed.")
+                return
+
+            if self._state != self.CLOSED:
+                return
+            self._window.append((success, slow))
+            calls = len(self._window)
+            if calls < self.minimum_calls:
+                return
+            failures = sum(1 for ok, _ in self._window if not ok)
+            slow_calls = sum(1 for _, was_slow in self._window if was_slow)
+            if failures / calls >= self.failure_rate_threshold or slow_calls / calls >= self.slow_call_rate_threshold:
+                self._open()
+
+
+class Bulkhead:
+    """Caps concurrent calls to one dependency so a slow one cannot tie up every worker thread."""
+
+    def __init__(self, name, max_concurrent=10, max_wait=0.05):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+
+    def acquire(self):
+        if not self._semaphore.acquire(timeout=self.max_wait):
+            raise BulkheadFullError(f"Too many concurrent calls to {self.name}.")
+
+    def release(self):
+        self._semaphore.release()
+
+
+class DependencyClient:
+    """HTTP client for one downstream service, guarded by a bulkhead and a circuit breaker.
+
+    Rejections raise subclasses of ``requests.exceptions.RequestException``, so callers keep
+    handling them like any other unavailable-dependency error. Identical GETs that are in
+    flight at the same time are coalesced into one downstream call whose response (or
+    error) every caller receives; callers must treat that response as read-only.
+
+    When msgpack is installed the client asks for MessagePack and ``response.json()``
+    decodes it, so callers work the same with either encoding. With ``SERVICE_TOKEN`` set,
+    every call identifies itself as internal traffic, which the rate limiters exempt.
+    """
+
+    def __init__(self, name, base_url, timeout=5.0, breaker=None, bulkhead=None, health_timeout=1.0,
+                 coalesce_gets=True):
+        self.name = name
+        self.base_url = base_url
+        self.timeout = timeout
+        self.health_timeout = health_timeout
+        self.breaker = breaker or CircuitBreaker(name)
+        self.bulkhead = bulkhead or Bulkhead(name)
+        self.session = requests.Session()
+        self._flight = SingleFlight() if coalesce_gets else None
+        if msgpack is not None:
+            self.session.headers['Accept'] = f'{MSGPACK_MIMETYPE}, application/json;q=0.9'
+        if os.getenv('SERVICE_TOKEN'):
+            self.session.headers[SERVICE_TOKEN_HEADER] = os.getenv('SERVICE_TOKEN')
+
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        self.bulkhead.acquire()
+        try:
+            self.breaker.before_call()
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, f'{self.base_url}{path}', **kwargs)
+            except requests.exceptions.RequestException:
+                self.breaker.record(False, time.monotonic() - start)
+                raise
+            self.breaker.record(response.status_code < 500, time.monotonic() - start)
+            if msgpack is not None and response.headers.get('Content-Type', '').startswith(MSGPACK_MIMETYPE):
+                response.json = lambda **kwargs: msgpack.unpackb(response.content)
+            return response
+        finally:
+            self.bulkhead.release()
+
+    def get(self, path, **kwargs):
+        if self._flight is None:
+            return self.request('GET', path, **kwargs)
+        key = f"{path} {json.dumps(kwargs, sort_keys=True, default=str)}"
+        return self._flight.do(key, lambda: self.request('GET', path, **kwargs))
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
@@ -1,51 +1,43 @@
-from flask import Blueprint, request, jsonify
-from models import Purchase
+from flask import Blueprint, request, jsonify, current_app
+from models import SaleIntent, Purchase, PurchaseArchiveSummary
+from sharding import purchases_for_customer, purchase_summaries, verified_purchases, all_purchases
+from purchase_summary import SUMMARY_TABLES, item_key, summary_dict
 from db import db
+from export import export_purchases
+from archive import archived_purchases, archive_summary, reaches_archives
+from outbox import enqueue_sale
+from catalog import get_catalog
+from idempotency import idempotent
+from routing import read_only
+from http_cache import conditional
+from clients import inventory_client, customers_client
+import clients
 import requests
-import os
-from sqlalchemy.sql import text
+from datetime import datetime
 
 import logging
 
-logging.basicConfig(
-    filename='sales_service.log',  # Log file name
-    level=logging.INFO,            # Log level: DEBUG, INFO, WARNING, ERROR, CRITICAL
-    format='%(asctime)s - %(levelname)s - %(message)s'  # Log format
-)
 
 sales_bp = Blueprint('sales_bp', __name__)
 
-INVENTORY_SERVICE_URL = os.getenv('INVENTORY_SERVICE_URL', 'http://ecommerce_azar_chedid-inventory_service-1:5002/api/v1')
-CUSTOMERS_SERVICE_URL = os.getenv('CUSTOMERS_SERVICE_URL', 'http://ecommerce_azar_chedid-customers_service-1:5001/api/v1')
+MAX_SUMMARY_BATCH = 100
+MAX_ELIGIBILITY_BATCH = 500
+
 @sales_bp.route('/health', methods=['GET'])
 def health_check():
-    try:
-        # Check database connection
-        db.session.execute(text('SELECT 1'))
-        database_status = "Healthy"
-    except Exception as e:
-        database_status = f"Unhealthy: {str(e)}"
-
-    # Check external services (Example: Inventory Service and Customer Service)
-    try:
-        inventory_response = requests.get(f'{INVENTORY_SERVICE_URL}/health')
-        inventory_service_status = "Healthy" if inventory_response.status_code == 200 else "Unhealthy"
-    except Exception as e:
-        inventory_service_status = f"Unhealthy: {str(e)}"
-
-    try:
-        customer_response = requests.get(f'{CUSTOMERS_SERVICE_URL}/health')
-        customer_service_status = "Healthy" if customer_response.status_code == 200 else "Unhealthy"
-    except Exception as e:
-        customer_service_status = f"Unhealthy: {str(e)}"
-
-    # Aggregate results
-    overall_status = "Healthy" if database_status == "Healthy" and inventory_service_status == "Healthy" and customer_service_status == "Healthy" else "Unhealthy"
+    # Served from the background health monitor's cache; never probes inline.
+    health = current_app.extensions['health']
+    overall_status = "Healthy" if health.is_healthy() else "Unhealthy"
 
     return jsonify({
-        "database": database_status,
-        "inventory_service": inventory_service_status,
-        "customer_service": customer_service_status,
+        "database": health.status('database'),
+        "inventory_service": health.status('inventory_service'),
+        "customer_service": health.status('customer_service'),
+        "checks": health.results(),
+        "circuits": {
+            "inventory_service": inventory_client.breaker.state,
+            "customer_service": customers_client.breaker.state
+        },
         "status": overall_status
     })
 
@@ -57,8 +49,16 @@ def home():
 @sales_bp.route('/goods', methods=['GET'])
 def get_goods():
     try:
+        catalog = get_catalog()
+        if catalog is not None:
+            goods_list = [
+                {'name': item.name, 'price_per_item': item.price_per_item}
+                for item in catalog.items() if (item.count_in_stock or 0) > 0
+            ]
+            return jsonify(goods_list), 200
+
         logging.info("Fetching goods from the Inventory service.")
-        inventory_response = requests.get(f'{INVENTORY_SERVICE_URL}/inventory', timeout=5)
+        inventory_response = clients.get_inventory()
         inventory_response.raise_for_status()
         inventory_data = inventory_response.json()
 
@@ -79,7 +79,14 @@ def get_goods():
 @sales_bp.route('/goods/<string:good_name>', methods=['GET'])
 def get_good_details(good_name):
     try:
-        inventory_response = requests.get(f'{INVENTORY_SERVICE_URL}/inventory', timeout=5)
+        catalog = get_catalog()
+        if catalog is not None:
+            item = catalog.get(good_name)
+            if not item:
+                return {"error": f"Item '{good_name}' not found in inventory."}, 404
+            return jsonify(item.to_dict()), 200
+
+        inventory_response = clients.get_inventory()
         inventory_response.raise_for_status()
 
         try:
@@ -101,7 +108,31 @@ def get_good_details(good_name):
     except Exception as e:
         return {"error": f"An unexpected error occurred: {str(e)}"}, 500
 
+def _prevalidate_sale(item_name, quantity):
+    """Reject sales the catalog replica already knows cannot succeed; None means go ahead.
+
+    A miss or short stock may just be a change the replica has not polled yet, so it
+    syncs once before rejecting. Without a usable replica the outbox decides.
+    """
+    catalog = get_catalog()
+    if catalog is None:
+        return None
+    item = catalog.get(item_name)
+    if item is None or item.count_in_stock < quantity:
+        try:
+            catalog.sync()
+        except Exception as e:
+            logging.warning(f"Catalog replica sync failed during sale validation: {str(e)}")
+            return None
+        item = catalog.get(item_name)
+    if item is None:
+        return {"error": f"Item '{item_name}' not found in inventory."}, 404
+    if item.count_in_stock < quantity:
+        return {"error": "Insufficient stock."}, 400
+    return None
+
 @sales_bp.route('/sales', methods=['POST'])
+@idempotent
 def create_sale():
     try:
         # Log the incoming request
@@ -129,103 +160,57 @@ def create_sale():
             logging.warning(f"Non-integer quantity: {quantity}")
             return {"error": "Quantity must be a valid integer."}, 400
 
-        logging.info(f"Processing sale for customer: {customer_username}, item: {item_name}, quantity: {quantity}")
-
-        # Get Customer Details
-        customer_response = requests.get(f'{CUSTOMERS_SERVICE_URL}/customers/{customer_username}')
-        if customer_response.status_code != 200:
-            logging.warning(f"Customer not found: {customer_username}")
-            return {"error": "Customer not found."}, 404
-        customer_data = customer_response.json()
-        customer_wallet = customer_data.get('wallet')
-        logging.info(f"Customer details retrieved: {customer_data}")
-
-        # Get Inventory Data
-        inventory_response = requests.get(f'{INVENTORY_SERVICE_URL}/inventory')
-        if inventory_response.status_code != 200:
-            logging.error("Failed to retrieve inventory data.")
-            return {"error": "Failed to retrieve goods from Inventory service."}, 500
-        inventory_data = inventory_response.json()
-
-        item = next((item for item in inventory_data if item['name'].lower() == item_name.lower()), None)
-        if not item:
-            logging.warning(f"Item not found: {item_name}")
-            return {"error": "Item not found."}, 404
-
-        item_price = item.get('price_per_item')
-        count_in_stock = item.get('count_in_stock')
-        item_id = item.get('id')
-
-        logging.info(f"Item details retrieved: {item}")
-
-        # Check stock availability
-        if count_in_stock < quantity:
-            logging.warning(f"Insufficient stock for item: {item_name} (Requested: {quantity}, In Stock: {count_in_stock})")
-            return {"error": "Insufficient stock."}, 400
-
-        # Calculate total price
-        total_price = item_price * quantity
-        if customer_wallet < total_price:
-            logging.warning(f"Insufficient funds for customer: {customer_username} (Wallet: {customer_wallet}, Total Price: {total_price})")
-            return {"error": "Insufficient funds in wallet."}, 400
-
-        logging.info(f"Total price calculated: {total_price}")
-
-        # Deduct Money from Wallet
-        deduct_wallet_response = requests.post(
-            f'{CUSTOMERS_SERVICE_URL}/customers/{customer_username}/deduct',
-            json={'amount': total_price}
-        )
-        if deduct_wallet_response.status_code != 200:
-            logging.error(f"Failed to deduct amount from customer wallet: {customer_username}")
-            return {"error": "Failed to deduct from customer wallet."}, 500
-
-        logging.info(f"Deducted {total_price} from customer wallet: {customer_username}")
-
-        # Update Inventory
-        new_count = count_in_stock - quantity
-        update_inventory_response = requests.put(
-            f'{INVENTORY_SERVICE_URL}/inventory/{item_id}',
-            json={'count_in_stock': new_count}
-        )
-        if update_inventory_response.status_code != 200:
-            logging.error(f"Failed to update inventory for item: {item_name}")
-            # Rollback the wallet deduction
-            rollback_response = requests.post(
-                f'{CUSTOMERS_SERVICE_URL}/customers/{customer_username}/charge',
-                json={'amount': total_price}
-            )
-            if rollback_response.status_code == 200:
-                logging.info(f"Wallet deduction rolled back for customer: {customer_username}")
-            else:
-                logging.error(f"Failed to roll back wallet deduction for customer: {customer_username}")
-            return {"error": "Failed to update item in inventory."}, 500
-
-        logging.info(f"Inventory updated for item: {item_name} (New Count: {new_count})")
-
-        # Record the Purchase
-        purchase = Purchase(
-            customer_username=customer_username,
-            item_name=item_name,
-            quantity=quantity,
-            total_price=total_price
-        )
-        db.session.add(purchase)
-        db.session.commit()
+        rejection = _prevalidate_sale(item_name, quantity)
+        if rejection is not None:
+            logging.warning(f"Sale rejected for customer: {customer_username}, item: {item_name}: {rejection[0]['error']}")
+            return rejection
 
-        logging.info(f"Purchase recorded: {purchase}")
+        # Record the intent first; the outbox worker performs the wallet and
+        # inventory steps (with retries and compensation) and records the purchase.
+        intent = enqueue_sale(customer_username, item_name, quantity)
+        current_app.extensions['sales_outbox'].wake()
 
-        return {"message": "Purchase successful.", "purchase_id": purchase.purchase_id}, 201
+        logging.info(f"Sale {intent.id} accepted for customer: {customer_username}, item: {item_name}, quantity: {quantity}")
+        return {
+            "message": "Sale accepted.",
+            "sale_id": intent.id,
+            "status": intent.status,
+            "status_url": f"/sales/{intent.id}"
+        }, 202
 
     except Exception as e:
         db.session.rollback()
         logging.error(f"Unexpected error: {str(e)}")
         return {"error": f"An unexpected error occurred: {str(e)}"}, 500
+
+@sales_bp.route('/sales/<int:sale_id>', methods=['GET'])
+def get_sale_status(sale_id):
+    try:
+        intent = db.session.get(SaleIntent, sale_id)
+        if not intent:
+            logging.warning(f"Sale not found: {sale_id}")
+            return {"error": "Sale not found."}, 404
+        return jsonify(intent.to_dict()), 200
+    except Exception as e:
+        logging.error(f"Error while fetching sale status: {sale_id} | {str(e)}")
+        return {"error": f"An unexpected error occurred: {str(e)}"}, 500
     
 @sales_bp.route('/customers/<username>/purchases', methods=['GET'])
+@read_only
+@conditional(Purchase.__tablename__)
 def get_purchase_history(username):
+    since = request.args.get('since')
     try:
-        purchases = Purchase.query.filter_by(customer_username=username).all()
+        since_date = datetime.fromisoformat(since) if since else None
+    except ValueError:
+        return {"error": "'since' must be an ISO date (YYYY-MM-DD)."}, 400
+    try:
+        purchases = purchases_for_customer(username)
+        if since_date is not None:
+            purchases = [p for p in purchases if p.purchase_date is None or p.purchase_date >= since_date]
+        # Older purchases live in the monthly archives; a ?since= range reads them only when it reaches back that far.
+        if since_date is None or reaches_archives(since_date):
+            purchases = archived_purchases(username, since_date) + purchases
 
         # Log the results of the query
         logging.debug(f"Found {len(purchases)} purchases for customer: {username}")
@@ -240,10 +225,81 @@ def get_purchase_history(username):
         logging.error(f"Error while fetching purchase history for customer: {username} | {str(e)}")
         return {"error": f"An unexpected error occurred: {str(e)}"}, 500
     
+@sales_bp.route('/customers/<username>/purchases/archive-summary', methods=['GET'])
+@read_only
+@conditional(PurchaseArchiveSummary.__tablename__)
+def get_purchase_archive_summary(username):
+    try:
+        summary = archive_summary(username)
+        return jsonify([row.to_dict() for row in summary]), 200
+    except Exception as e:
+        logging.error(f"Error while fetching archived purchase summary for customer: {username} | {str(e)}")
+        return {"error": f"An unexpected error occurred: {str(e)}"}, 500
+
+@sales_bp.route('/customers/<username>/purchases/summary', methods=['GET'])
+@read_only
+@conditional(*SUMMARY_TABLES)
+def get_purchase_summary(username):
+    try:
+        summary, items = purchase_summaries([username])[username]
+        result = summary_dict(username, summary, items)
+        item_name = request.args.get('item')
+        if item_name:
+            result["has_purchased"] = any(item.item_key == item_key(item_name) for item in items)
+        return jsonify(result), 200
+    except Exception as e:
+        logging.error(f"Error while fetching purchase summary for customer: {username} | {str(e)}")
+        return {"error": f"An unexpected error occurred: {str(e)}"}, 500
+
+@sales_bp.route('/customers/purchases/summary', methods=['POST'])
+@read_only
+def get_purchase_summaries():
+    try:
+        data = request.get_json(silent=True) or {}
+        usernames = data.get('usernames')
+        if not isinstance(usernames, list) or not usernames or not all(isinstance(u, str) for u in usernames):
+            logging.warning("Invalid usernames for purchase summary batch.")
+            return {"error": "usernames must be a non-empty list of strings."}, 400
+        if len(usernames) > MAX_SUMMARY_BATCH:
+            return {"error": f"At most {MAX_SUMMARY_BATCH} usernames per request."}, 400
+
+        summaries = purchase_summaries(list(dict.fromkeys(usernames)))
+        return jsonify({username: summary_dict(username, *summaries[username]) for username in summaries}), 200
+    except Exception as e:
+        logging.error(f"Error while fetching purchase summaries: {str(e)}")
+        return {"error": f"An unexpected error occurred: {str(e)}"}, 500
+
+@sales_bp.route('/purchases/eligibility', methods=['POST'])
+@read_only
+def check_purchase_eligibility():
+    """Which (customer, item) pairs are verified purchases; item names compare case-insensitively."""
+    try:
+        data = request.get_json(silent=True) or {}
+        pairs = data.get('pairs')
+        if not isinstance(pairs, list) or not pairs or not all(
+                isinstance(pair, dict) and isinstance(pair.get('customer_username'), str)
+                and isinstance(pair.get('item_name'), str) for pair in pairs):
+            logging.warning("Invalid pairs for purchase eligibility check.")
+            return {"error": "pairs must be a non-empty list of {customer_username, item_name} objects."}, 400
+        if len(pairs) > MAX_ELIGIBILITY_BATCH:
+            return {"error": f"At most {MAX_ELIGIBILITY_BATCH} pairs per request."}, 400
+
+        requested = [(pair['customer_username'], pair['item_name']) for pair in pairs]
+        verified = verified_purchases(set(requested))
+        return jsonify({"results": [
+            {"customer_username": username, "item_name": item_name, "eligible": (username, item_name) in verified}
+            for username, item_name in requested
+        ]}), 200
+    except Exception as e:
+        logging.error(f"Error while checking purchase eligibility: {str(e)}")
+        return {"error": f"An unexpected error occurred: {str(e)}"}, 500
+
 @sales_bp.route('/sales', methods=['GET'])
+@read_only
+@conditional(Purchase.__tablename__)
 def get_sales():
         try:
-            sales = Purchase.query.all()  # Fetch all sales from the database
+            sales = all_purchases()  # Fetch all sales from every shard
             if not sales:
                 return jsonify({"message": "No sales found."}), 404
             
@@ -251,3 +307,34 @@ def get_sales():
             return jsonify(sales_list), 200
         except Exception as e:
             return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
+
+@sales_bp.route('/sales/export', methods=['POST'])
+def export_sales():
+    try:
+        data = request.get_json(silent=True) or {}
+
+        since_id = data.get('since_id')
+        if since_id is not None and (not isinstance(since_id, int) or since_id < 0):
+            logging.warning(f"Invalid since_id for export: {since_id}")
+            return {"error": "since_id must be a non-negative integer."}, 400
+
+        reviews_uri = current_app.config.get('REVIEWS_DATABASE_URI') if data.get('include_reviews') else None
+        if data.get('include_reviews') and not reviews_uri:
+            return {"error": "Review export is not configured."}, 400
+
+        result = export_purchases(
+            current_app.config['EXPORT_DIR'],
+            since_id=since_id,
+            reviews_uri=reviews_uri,
+            compression=current_app.config['EXPORT_COMPRESSION'],
+            safety_lag=current_app.config['EXPORT_SAFETY_LAG'],
+        )
+        return jsonify(result), 200
+    except RuntimeError as e:
+        logging.error(f"Export unavailable: {str(e)}")
+        return {"error": str(e)}, 503
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error while exporting purchases: {str(e)}")
+        return {"error": f"An unexpected error occurred: {str(e)}"}, 500
@@ -0,0 +1,135 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+import sqlalchemy as sa
+from flask import current_app, g, has_request_context
+from flask_sqlalchemy.session import Session
+
+REPLICA_BIND = 'replica'
+
+
+class RoutingSession(Session):
+    """Session that serves reads of read-only requests from the replica bind.
+
+    Everything else goes to the primary. Once a request has written anything, the rest of
+    that request reads from the primary too, so it always sees its own writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and _reads_from_replica(self, clause):
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def serving_from_replica():
+    """Whether the current request's reads go to the replica (read-only, nothing written yet)."""
+    if not has_request_context() or not g.get('db_read_only') or g.get('db_wrote'):
+        return False
+    replica = current_app.extensions.get('db_replica')
+    return replica is not None and replica.available
+
+
+def _reads_from_replica(session, clause):
+    if not serving_from_replica():
+        return False
+    if session._flushing or isinstance(clause, sa.sql.dml.UpdateBase) or session.new or session.dirty or session.deleted:
+        g.db_wrote = True
+        return False
+    return True
+
+
+def read_only(view):
+    """Mark a route as safe to serve from the read replica."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_read_only = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+class Replica:
+    """The replica bind, plus (for local SQLite) the thread that keeps its file in sync with the primary."""
+
+    def __init__(self, app, sync_path=None, interval=5.0):
+        self.app = app
+        self.sync_path = sync_path
+        self.interval = interval
+        self.available = sync_path is None
+        self.last_synced_at = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def sync_once(self):
+        """Copy the primary into the replica file with SQLite's online backup API.
+
+        The backup writes into the existing replica database under SQLite's own locking,
+        so open replica connections see either the old or the new snapshot, never a torn one.
+        """
+        with self.app.app_context():
+            primary_path = self.app.extensions['sqlalchemy'].engine.url.database
+        if not primary_path or primary_path == ':memory:':
+            logging.warning("Replica sync skipped: the primary is not a SQLite file.")
+            return
+        source = sqlite3.connect(primary_path)
+        target = sqlite3.connect(self.sync_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        self.last_synced_at = time.time()
+        self.available = True
+
+    def start(self):
+        if self.sync_path is None or (self._thread is not None and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                try:
+                    self.sync_once()
+                except Exception as e:
+                    logging.error(f"Initial replica sync failed: {str(e)}")
+                self._thread = threading.Thread(target=self._run, name='replica-sync', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sync_once()
+            except Exception as e:
+                logging.error(f"Replica sync failed: {str(e)}")
+
+
+def init_replica(app):
+    """Configure the replica bind; must run before ``db.init_app`` so the engine is created.
+
+    ``REPLICA_DATABASE_URI`` points at a real replica (production). Otherwise, when
+    ``REPLICA_SYNC_PATH`` is set, a local SQLite copy of the primary is refreshed every
+    ``REPLICA_SYNC_INTERVAL`` seconds. With neither, every query uses the primary.
+    """
+    uri = app.config.get('REPLICA_DATABASE_URI', os.getenv('REPLICA_DATABASE_URI'))
+    sync_path = app.config.get('REPLICA_SYNC_PATH', os.getenv('REPLICA_SYNC_PATH'))
+    if not uri and not sync_path:
+        return None
+
+    if not uri:
+        sync_path = os.path.abspath(sync_path)
+        uri = f'sqlite:///{sync_path}'
+    else:
+        sync_path = None
+
+    app.config.setdefault('SQLALCHEMY_BINDS', {})[REPLICA_BIND] = uri
+    interval = float(app.config.get('REPLICA_SYNC_INTERVAL', os.getenv('REPLICA_SYNC_INTERVAL', '5')))
+    replica = Replica(app, sync_path, interval)
+    app.extensions['db_replica'] = replica
+
+    @app.before_request
+    def start_replica_sync():
+        replica.start()
+
+    return replica
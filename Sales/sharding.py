@@ -0,0 +1,227 @@
+import heapq
+import logging
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import Session
+
+from db import db
+from models import CustomerItemPurchase, CustomerPurchaseSummary, Purchase, PurchaseArchiveSummary
+from http_cache import touch
+from purchase_summary import SUMMARY_TABLES, add_to_summary, load_summaries, purchased_pairs
+
+SHARD_BIND_PREFIX = 'shard_'
+
+_executor = None
+
+
+def configure_shards(app):
+    """Register one bind per entry of ``SALES_SHARD_URIS``; must run before ``db.init_app``.
+
+    With no shards configured, purchases stay in the primary database exactly as before.
+    """
+    uris = app.config.get('SALES_SHARD_URIS')
+    if uris is None:
+        uris = [uri.strip() for uri in os.getenv('SALES_SHARD_URIS', '').split(',') if uri.strip()]
+    app.config['SALES_SHARD_URIS'] = uris
+    if uris:
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+        for index, uri in enumerate(uris):
+            binds[f'{SHARD_BIND_PREFIX}{index}'] = uri
+
+
+def is_sharded():
+    return bool(current_app.config['SALES_SHARD_URIS'])
+
+
+def shard_count():
+    return len(current_app.config['SALES_SHARD_URIS'])
+
+
+def shard_index(customer_username, count):
+    # crc32 is stable across processes and Python versions, unlike hash().
+    return zlib.crc32(customer_username.encode('utf-8')) % count
+
+
+def shard_engines():
+    return [db.engines[f'{SHARD_BIND_PREFIX}{index}'] for index in range(shard_count())]
+
+
+def ensure_shard_tables():
+    if not is_sharded():
+        return
+    for engine in shard_engines():
+        Purchase.__table__.create(engine, checkfirst=True)
+        PurchaseArchiveSummary.__table__.create(engine, checkfirst=True)
+        CustomerPurchaseSummary.__table__.create(engine, checkfirst=True)
+        CustomerItemPurchase.__table__.create(engine, checkfirst=True)
+    if Purchase.query.first() is not None:
+        logging.warning("Sharding is enabled but the primary still holds purchases; they are not served from shards.")
+
+
+@contextmanager
+def _session(engine):
+    session = Session(bind=engine, expire_on_commit=False)
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def _engine_for(customer_username):
+    engines = shard_engines()
+    return engines[shard_index(customer_username, len(engines))]
+
+
+@contextmanager
+def customer_session(customer_username):
+    """Session on the database that holds ``customer_username``'s purchases."""
+    if not is_sharded():
+        yield db.session
+        return
+    with _session(_engine_for(customer_username)) as session:
+        yield session
+
+
+def purchase_sessions():
+    """Yield a session on each database that holds purchases (the primary, or every shard)."""
+    if not is_sharded():
+        yield db.session
+        return
+    for engine in shard_engines():
+        with _session(engine) as session:
+            yield session
+
+
+def _scatter_gather(statement, key=lambda purchase: purchase.purchase_id):
+    """Run ``statement`` on every shard in parallel and merge the results by ``key`` (purchase_id)."""
+    global _executor
+    engines = shard_engines()
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=len(engines), thread_name_prefix='shard-query')
+
+    def run(engine):
+        with _session(engine) as session:
+            return session.scalars(statement).all()
+
+    return list(heapq.merge(*_executor.map(run, engines), key=key))
+
+
+def record_purchase(intent):
+    """Store the purchase of a completed sale intent and return its purchase_id.
+
+    Unsharded, the row is added to ``db.session`` so it commits with the intent. Sharded,
+    the purchase_id is the intent's id (unique across shards) and the insert is skipped
+    when the row already exists, so a retry after a crash never duplicates the purchase.
+    Either way the customer's purchase summary is updated in the same transaction as the row.
+    """
+    purchase = Purchase(
+        customer_username=intent.customer_username,
+        item_name=intent.item_name,
+        quantity=intent.quantity,
+        total_price=intent.total_price,
+        purchase_date=datetime.utcnow()
+    )
+    if not is_sharded():
+        db.session.add(purchase)
+        db.session.flush()
+        add_to_summary(db.session, purchase)
+        return purchase.purchase_id
+
+    purchase.purchase_id = intent.id
+    with _session(_engine_for(intent.customer_username)) as session:
+        if session.get(Purchase, intent.id) is None:
+            session.add(purchase)
+            add_to_summary(session, purchase)
+            session.commit()
+    # Shard sessions do not bump the HTTP cache validators; they are bumped when the intent commits.
+    touch(db.session, Purchase.__tablename__, *SUMMARY_TABLES)
+    return intent.id
+
+
+def purchases_for_customer(customer_username):
+    statement = (select(Purchase)
+                 .where(Purchase.customer_username == customer_username)
+                 .order_by(Purchase.purchase_id))
+    with customer_session(customer_username) as session:
+        return session.scalars(statement).all()
+
+
+def purchase_summaries(usernames):
+    """``{username: (summary or None, [items])}``, reading each shard once for its customers."""
+    if not is_sharded():
+        return load_summaries(db.session, usernames)
+    by_shard = {}
+    for username in usernames:
+        by_shard.setdefault(shard_index(username, shard_count()), []).append(username)
+    engines = shard_engines()
+    result = {}
+    for index, shard_usernames in by_shard.items():
+        with _session(engines[index]) as session:
+            result.update(load_summaries(session, shard_usernames))
+    return result
+
+
+def verified_purchases(pairs):
+    """The subset of ``(customer_username, item_name)`` pairs that were bought, one query per shard."""
+    if not is_sharded():
+        return purchased_pairs(db.session, pairs)
+    by_shard = {}
+    for pair in pairs:
+        by_shard.setdefault(shard_index(pair[0], shard_count()), []).append(pair)
+    engines = shard_engines()
+    found = set()
+    for index, shard_pairs in by_shard.items():
+        with _session(engines[index]) as session:
+            found |= purchased_pairs(session, shard_pairs)
+    return found
+
+
+def all_purchases():
+    statement = select(Purchase).order_by(Purchase.purchase_id)
+    if not is_sharded():
+        return db.session.scalars(statement).all()
+    return _scatter_gather(statement)
+
+
+def purchases_after(last_id, limit):
+    """Return the next ``limit`` purchases with ``purchase_id > last_id`` across all shards."""
+    statement = (select(Purchase)
+                 .where(Purchase.purchase_id > last_id)
+                 .order_by(Purchase.purchase_id)
+                 .limit(limit))
+    if not is_sharded():
+        return db.session.scalars(statement).all()
+    return _scatter_gather(statement)[:limit]
+
+
+def recorded_order(purchase):
+    return purchase.purchase_date, purchase.purchase_id
+
+
+def recorded_after(after, until, limit, min_id=0):
+    """Purchases after ``after`` = ``(recorded_at, purchase_id)`` in recorded order, recorded by ``until``.
+
+    ``recorded_at`` None starts from the first purchase. Purchase ids follow neither time
+    nor commit order (sharded, they are the sale's id), so the keyset leads with
+    ``purchase_date``, which ``record_purchase`` stamps when the row is written.
+    """
+    recorded_at, last_id = after
+    statement = select(Purchase).where(Purchase.purchase_id > min_id, Purchase.purchase_date <= until)
+    if recorded_at is not None:
+        statement = statement.where(or_(Purchase.purchase_date > recorded_at,
+                                        and_(Purchase.purchase_date == recorded_at, Purchase.purchase_id > last_id)))
+    return statement.order_by(Purchase.purchase_date, Purchase.purchase_id).limit(limit)
+
+
+def purchases_recorded_after(after, until, limit, min_id=0):
+    """The next ``limit`` purchases of ``recorded_after`` across all shards."""
+    statement = recorded_after(after, until, limit, min_id)
+    if not is_sharded():
+        return db.session.scalars(statement).all()
+    return _scatter_gather(statement, key=recorded_order)[:limit]
@@ -1,4 +1,5 @@
 import pytest
+from unittest.mock import Mock, patch
 from app import app, db
 
 @pytest.fixture
@@ -6,6 +7,10 @@ def test_client():
     app.config['TESTING'] = True
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SALES_OUTBOX_WORKER'] = False
+    app.config['HEALTH_MONITOR'] = False
+    app.config['CATALOG_SYNC'] = False
+    app.config['EXPORT_SAFETY_LAG'] = 0
 
     with app.test_client() as client:
         with app.app_context():
@@ -30,3 +35,639 @@ def test_sales_create_sale_missing_data(test_client):
 
    
     assert response.json == {"error": "item_name is required."}
+
+
+def test_export_purchases_is_incremental(test_client, tmp_path):
+    pytest.importorskip('pyarrow')
+    import pyarrow.parquet as pq
+    from models import Purchase
+
+    app.config['EXPORT_DIR'] = str(tmp_path)
+    db.session.add_all([
+        Purchase(customer_username='pia', item_name='Laptop', quantity=1, total_price=1000.0),
+        Purchase(customer_username='sam', item_name='Mouse', quantity=2, total_price=40.0),
+    ])
+    db.session.commit()
+
+    response = test_client.post('/sales/export', json={})
+    assert response.status_code == 200
+    assert response.json['purchases']['rows'] == 2
+    assert response.json['purchases']['watermark'] == 2
+
+    table = pq.read_table(tmp_path / 'purchases')
+    assert sorted(table.column('item_name').to_pylist()) == ['Laptop', 'Mouse']
+
+    # Nothing new since the watermark, so a second run writes nothing.
+    response = test_client.post('/sales/export', json={})
+    assert response.json['purchases']['rows'] == 0
+
+
+def test_export_picks_up_purchases_recorded_out_of_id_order_or_archived(test_client, tmp_path):
+    pytest.importorskip('pyarrow')
+    from datetime import datetime, timedelta
+    import pyarrow.parquet as pq
+    from archive import archive_purchases
+    from models import Purchase
+
+    app.config['EXPORT_DIR'] = str(tmp_path / 'exports')
+    app.config['ARCHIVE_DIR'] = str(tmp_path / 'archive')
+    now = datetime.utcnow()
+
+    def recorded(purchase_id, item_name, when):
+        db.session.add(Purchase(purchase_id=purchase_id, customer_username='pia', item_name=item_name,
+                                quantity=1, total_price=10.0, purchase_date=when))
+        db.session.commit()
+
+    recorded(5, 'Laptop', now - timedelta(days=100))
+    assert test_client.post('/sales/export', json={}).json['purchases']['rows'] == 1
+
+    # Sharded, a purchase's id is its sale's, so sale 3 can be recorded after sale 5 was exported...
+    recorded(3, 'Mouse', now - timedelta(days=1))
+    # ...and a purchase can be archived before the next export gets to it.
+    recorded(7, 'Cable', now - timedelta(days=80))
+    assert archive_purchases(older_than_days=30) == 2
+
+    assert test_client.post('/sales/export', json={}).json['purchases']['rows'] == 2
+    table = pq.read_table(tmp_path / 'exports' / 'purchases')
+    assert sorted(table.column('item_name').to_pylist()) == ['Cable', 'Laptop', 'Mouse']
+    assert test_client.post('/sales/export', json={}).json['purchases']['rows'] == 0
+
+
+def test_export_includes_reviews_with_their_timestamps(test_client, tmp_path):
+    pytest.importorskip('pyarrow')
+    import sqlite3
+    from datetime import datetime
+    import pyarrow.parquet as pq
+
+    reviews_db = tmp_path / 'reviews.db'
+    with sqlite3.connect(reviews_db) as conn:
+        # As the Reviews service stores them: SQLite keeps the timestamps as text.
+        conn.execute('CREATE TABLE reviews (id INTEGER PRIMARY KEY, customer_username VARCHAR, item_name VARCHAR, '
+                     'rating INTEGER, comment TEXT, status VARCHAR, created_at DATETIME, updated_at DATETIME)')
+        conn.execute("INSERT INTO reviews VALUES (1, 'pia', 'Laptop', 5, 'Great', 'approved', "
+                     "'2024-05-01 10:00:00', '2024-05-02 11:30:00.250000')")
+
+    app.config['EXPORT_DIR'] = str(tmp_path / 'exports')
+    app.config['REVIEWS_DATABASE_URI'] = f'sqlite:///{reviews_db}'
+    try:
+        response = test_client.post('/sales/export', json={"include_reviews": True})
+    finally:
+        app.config['REVIEWS_DATABASE_URI'] = None
+
+    assert response.status_code == 200
+    assert response.json['reviews']['rows'] == 1
+    table = pq.read_table(tmp_path / 'exports' / 'reviews')
+    assert table.column('created_at').to_pylist() == [datetime(2024, 5, 1, 10, 0)]
+    assert table.column('updated_at').to_pylist() == [datetime(2024, 5, 2, 11, 30, 0, 250000)]
+
+
+def _response(status_code, payload=None):
+    return Mock(status_code=status_code, headers={}, json=Mock(return_value=payload))
+
+LAPTOP = {"id": 1, "name": "Laptop", "price_per_item": 100.0, "count_in_stock": 5}
+
+
+@patch('clients.deduct_stock', return_value=_response(200))
+@patch('clients.deduct_wallet', return_value=_response(200))
+@patch('clients.get_inventory', return_value=_response(200, [LAPTOP]))
+@patch('clients.get_customer', return_value=_response(200, {"username": "pia", "wallet": 500.0}))
+def test_sale_is_accepted_then_completed_by_outbox(mock_customer, mock_inventory, mock_deduct, mock_stock, test_client):
+    from outbox import process_due_intents
+
+    response = test_client.post('/sales', json={"customer_username": "pia", "item_name": "laptop", "quantity": 2})
+    assert response.status_code == 202
+    sale_id = response.json['sale_id']
+    assert test_client.get(f'/sales/{sale_id}').json['status'] == 'pending'
+
+    assert process_due_intents() == 1
+
+    status = test_client.get(f'/sales/{sale_id}').json
+    assert status['status'] == 'completed'
+    assert status['total_price'] == 200.0
+    assert status['purchase_id'] is not None
+    mock_deduct.assert_called_once_with('pia', 200.0, idempotency_key=f'sale-{sale_id}-deduct')
+    mock_stock.assert_called_once_with(1, 2, idempotency_key=f'sale-{sale_id}-stock')
+
+
+@patch('clients.charge_wallet', return_value=_response(200))
+@patch('clients.deduct_stock')
+@patch('clients.deduct_wallet', return_value=_response(200))
+@patch('clients.get_inventory', return_value=_response(200, [LAPTOP]))
+@patch('clients.get_customer', return_value=_response(200, {"username": "pia", "wallet": 500.0}))
+def test_sale_refunds_wallet_when_inventory_rejects_the_stock_step(mock_customer, mock_inventory, mock_deduct,
+                                                                   mock_stock, mock_charge, test_client):
+    from models import Purchase, SaleIntent
+    from outbox import process_intent
+
+    mock_stock.side_effect = [_response(500), _response(500), _response(400)]
+    response = test_client.post('/sales', json={"customer_username": "pia", "item_name": "Laptop", "quantity": 1})
+    intent = db.session.get(SaleIntent, response.json['sale_id'])
+
+    # A 500 may hide a deduct Inventory applied, so the step is retried past max_attempts...
+    process_intent(intent, max_attempts=2)
+    assert intent.status == 'pending' and intent.attempts == 1
+    process_intent(intent, max_attempts=2)
+    assert intent.status == 'pending' and intent.attempts == 2
+    # ...until Inventory gives a definite answer.
+    process_intent(intent, max_attempts=2)
+
+    assert intent.status == 'failed'
+    assert not intent.wallet_debited
+    mock_deduct.assert_called_once()
+    mock_charge.assert_called_once_with('pia', 100.0, idempotency_key=f'sale-{intent.id}-refund')
+    assert Purchase.query.count() == 0
+
+
+@patch('clients.deduct_stock', return_value=_response(200))
+@patch('clients.deduct_wallet')
+@patch('clients.get_inventory', return_value=_response(200, [LAPTOP]))
+@patch('clients.get_customer', return_value=_response(200, {"username": "pia", "wallet": 500.0}))
+def test_debit_whose_response_is_lost_is_replayed_instead_of_abandoned(mock_customer, mock_inventory, mock_deduct,
+                                                                       mock_stock, test_client):
+    import requests
+    from models import SaleIntent
+    from outbox import process_intent
+
+    # Customers applied the debit, but its response is lost on every attempt.
+    mock_deduct.__name__ = 'deduct_wallet'
+    mock_deduct.side_effect = requests.exceptions.Timeout("read timed out")
+    response = test_client.post('/sales', json={"customer_username": "pia", "item_name": "Laptop", "quantity": 1})
+    intent = db.session.get(SaleIntent, response.json['sale_id'])
+
+    for _ in range(5):
+        process_intent(intent, max_attempts=2)
+        assert intent.status == 'pending' and not intent.wallet_debited
+    assert 'read timed out' in intent.last_error
+    assert {call.kwargs['idempotency_key'] for call in mock_deduct.call_args_list} == {f'sale-{intent.id}-deduct'}
+
+    mock_deduct.side_effect = None
+    mock_deduct.return_value = _response(200)  # the replay is answered with the stored response
+    process_intent(intent, max_attempts=2)
+    assert intent.status == 'completed'
+    assert intent.wallet_debited
+
+
+@patch('clients.deduct_stock', return_value=_response(200))
+@patch('clients.deduct_wallet')
+@patch('clients.get_inventory', return_value=_response(200, [LAPTOP]))
+@patch('clients.get_customer', return_value=_response(200, {"username": "pia", "wallet": 500.0}))
+def test_in_flight_and_rate_limited_steps_are_retried_after_retry_after(mock_customer, mock_inventory, mock_deduct,
+                                                                        mock_stock, test_client):
+    from datetime import datetime, timedelta
+    from models import SaleIntent
+    from outbox import process_intent
+
+    busy = _response(409)
+    busy.headers = {'Retry-After': '120'}
+    mock_deduct.side_effect = [busy, _response(429), _response(200)]
+    response = test_client.post('/sales', json={"customer_username": "pia", "item_name": "Laptop", "quantity": 1})
+    intent = db.session.get(SaleIntent, response.json['sale_id'])
+
+    process_intent(intent, max_attempts=5)
+    assert intent.status == 'pending' and not intent.wallet_debited
+    assert intent.next_attempt_at >= datetime.utcnow() + timedelta(seconds=110)
+    process_intent(intent, max_attempts=5)
+    assert intent.status == 'pending'
+    process_intent(intent, max_attempts=5)
+    assert intent.status == 'completed'
+
+
+@patch('clients.deduct_stock')
+@patch('clients.deduct_wallet', return_value=_response(200))
+@patch('clients.get_inventory', return_value=_response(200, [LAPTOP]))
+@patch('clients.get_customer', return_value=_response(200, {"username": "pia", "wallet": 500.0}))
+def test_stock_step_retry_sends_the_same_request(mock_customer, mock_inventory, mock_deduct, mock_stock, test_client):
+    import requests
+    from models import SaleIntent
+    from outbox import process_intent
+
+    # The first decrement was applied but its response was lost.
+    mock_stock.side_effect = [requests.exceptions.Timeout("read timed out"), _response(200)]
+    response = test_client.post('/sales', json={"customer_username": "pia", "item_name": "Laptop", "quantity": 2})
+    intent = db.session.get(SaleIntent, response.json['sale_id'])
+
+    process_intent(intent, max_attempts=5)
+    process_intent(intent, max_attempts=5)
+
+    assert intent.status == 'completed'
+    first, retry = mock_stock.call_args_list
+    assert first == retry
+    assert retry.args == (1, 2)
+
+
+def test_claim_leases_from_claim_time_and_skips_finished_intents(test_client):
+    from datetime import datetime, timedelta
+    from models import SaleIntent
+    from outbox import LEASE_SECONDS, _claim
+
+    response = test_client.post('/sales', json={"customer_username": "pia", "item_name": "Laptop", "quantity": 1})
+    intent = db.session.get(SaleIntent, response.json['sale_id'])
+
+    assert _claim(intent.id)
+    db.session.refresh(intent)
+    assert intent.lease_expires_at > datetime.utcnow() + timedelta(seconds=LEASE_SECONDS - 5)
+
+    # Another worker completed it after this batch was selected.
+    intent.status, intent.lease_expires_at = 'completed', None
+    db.session.commit()
+    assert not _claim(intent.id)
+
+
+@patch('clients.charge_wallet', return_value=_response(404))
+@patch('clients.deduct_stock', return_value=_response(400))
+@patch('clients.deduct_wallet', return_value=_response(200))
+@patch('clients.get_inventory', return_value=_response(200, [LAPTOP]))
+@patch('clients.get_customer', return_value=_response(200, {"username": "pia", "wallet": 500.0}))
+def test_rejected_refund_ends_the_sale_instead_of_stalling_the_outbox(mock_customer, mock_inventory, mock_deduct,
+                                                                      mock_stock, mock_charge, test_client):
+    from outbox import process_due_intents
+
+    response = test_client.post('/sales', json={"customer_username": "pia", "item_name": "Laptop", "quantity": 1})
+    sale_id = response.json['sale_id']
+    second = test_client.post('/sales', json={"customer_username": "pia", "item_name": "Laptop", "quantity": 1})
+
+    # The customer was deleted in the meantime, so Customers answers the refund with 404.
+    assert process_due_intents() == 2
+    status = test_client.get(f'/sales/{sale_id}').json
+    assert status['status'] == 'refund_failed'
+    assert 'Refund failed' in status['error']
+    assert test_client.get(f"/sales/{second.json['sale_id']}").json['status'] == 'refund_failed'
+    assert process_due_intents() == 0
+    assert mock_charge.call_count == 2
+
+
+@patch('clients.deduct_stock', return_value=_response(200))
+@patch('clients.deduct_wallet', return_value=_response(200))
+@patch('clients.get_inventory', return_value=_response(200, [LAPTOP]))
+@patch('clients.get_customer', return_value=_response(200, {"username": "pia", "wallet": 150.0}))
+def test_finished_sales_are_published_as_events(mock_customer, mock_inventory, mock_deduct, mock_stock,
+                                               test_client, tmp_path):
+    from events import SALE_COMPLETED, SALE_FAILED, SQLiteBroker
+    from models import SaleEvent
+    from outbox import drain
+
+    broker = SQLiteBroker(str(tmp_path / 'events.db'))
+    app.extensions['event_broker'] = broker
+    try:
+        completed = test_client.post('/sales', json={"customer_username": "pia", "item_name": "Laptop", "quantity": 1})
+        failed = test_client.post('/sales', json={"customer_username": "pia", "item_name": "Laptop", "quantity": 2})
+        drain()
+    finally:
+        del app.extensions['event_broker']
+
+    events = broker.poll('test', [SALE_COMPLETED, SALE_FAILED])
+    assert [(event.topic, event.payload['sale_id']) for event in events] == [
+        (SALE_COMPLETED, completed.json['sale_id']), (SALE_FAILED, failed.json['sale_id'])]
+    assert events[0].key == f"sale-{completed.json['sale_id']}-{SALE_COMPLETED}"
+    assert events[0].payload['total_price'] == 100.0 and events[0].payload['purchase_id'] is not None
+    assert events[1].payload['error'] == "Insufficient funds in wallet."
+    assert SaleEvent.query.filter(SaleEvent.published_at.is_(None)).count() == 0
+
+
+def test_event_relay_runs_even_when_intents_fail(test_client, tmp_path):
+    from events import SALE_COMPLETED, SQLiteBroker
+    from models import SaleEvent
+    from outbox import drain
+
+    db.session.add(SaleEvent(key='sale-1-SaleCompleted', topic=SALE_COMPLETED, payload={"sale_id": 1}))
+    db.session.commit()
+    broker = SQLiteBroker(str(tmp_path / 'events.db'))
+    app.extensions['event_broker'] = broker
+    try:
+        with patch('outbox.process_due_intents', side_effect=RuntimeError("database is locked")):
+            drain()
+    finally:
+        del app.extensions['event_broker']
+
+    assert [event.key for event in broker.poll('test', [SALE_COMPLETED])] == ['sale-1-SaleCompleted']
+
+
+def test_create_sale_retry_with_idempotency_key_is_replayed(test_client):
+    from models import SaleIntent
+
+    payload = {"customer_username": "pia", "item_name": "Laptop", "quantity": 1}
+    headers = {"Idempotency-Key": "checkout-42"}
+    first = test_client.post('/sales', json=payload, headers=headers)
+    retry = test_client.post('/sales', json=payload, headers=headers)
+
+    assert first.status_code == retry.status_code == 202
+    assert retry.json['sale_id'] == first.json['sale_id']
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert SaleIntent.query.count() == 1
+
+    conflict = test_client.post('/sales', json={**payload, "quantity": 2}, headers=headers)
+    assert conflict.status_code == 422
+
+
+
+def test_catalog_replica_serves_browsing_and_prevalidates_sales(test_client, tmp_path):
+    from catalog import CatalogReplica
+    from models import SaleIntent
+
+    mouse = {"id": 2, "name": "Mouse", "price_per_item": 20.0, "count_in_stock": 0}
+    pages = [
+        _response(200, {"snapshot": True, "cursor": 3, "items": [LAPTOP, mouse], "deleted": [], "has_more": False}),
+        _response(200, {"snapshot": False, "cursor": 4, "items": [{**LAPTOP, "price_per_item": 90.0}],
+                        "deleted": [2], "has_more": False}),
+        _response(200, {"snapshot": False, "cursor": 4, "items": [], "deleted": [], "has_more": False}),
+    ]
+    for page in pages:
+        page.raise_for_status = Mock()
+    replica = CatalogReplica(str(tmp_path / 'catalog.json'))
+    previous = app.extensions.get('catalog')
+    app.extensions['catalog'] = replica
+    try:
+        with patch('clients.get_inventory_changes', side_effect=pages) as mock_changes, \
+                patch('clients.get_inventory') as mock_inventory:
+            replica.sync()
+            assert test_client.get('/goods').json == [{"name": "Laptop", "price_per_item": 100.0}]
+            assert test_client.get('/goods/mouse').json['count_in_stock'] == 0
+
+            replica.sync()
+            assert test_client.get('/goods/laptop').json['price_per_item'] == 90.0
+            assert replica.get('mouse') is None
+
+            # A miss syncs once more before the sale is rejected.
+            response = test_client.post('/sales', json={"customer_username": "pia", "item_name": "Mouse", "quantity": 1})
+            assert response.status_code == 404
+            assert mock_changes.call_args_list[-1].args == (4,)
+            assert SaleIntent.query.count() == 0
+            mock_inventory.assert_not_called()
+
+        warm = CatalogReplica(str(tmp_path / 'catalog.json'))
+        assert warm.load_snapshot()
+        assert warm.cursor == 4 and warm.get('LAPTOP').price_per_item == 90.0
+    finally:
+        app.extensions['catalog'] = previous
+
+@patch('clients.deduct_stock', return_value=_response(200))
+@patch('clients.deduct_wallet', return_value=_response(200))
+@patch('clients.get_inventory', return_value=_response(200, [LAPTOP]))
+@patch('clients.get_customer', return_value=_response(200, {"username": "pia", "wallet": 500.0}))
+def test_stale_replica_stock_does_not_fail_a_sale(mock_customer, mock_inventory, mock_deduct, mock_stock,
+                                                  test_client, tmp_path):
+    from catalog import CatalogReplica, get_catalog
+    from models import SaleIntent
+    from outbox import process_intent
+
+    replica = CatalogReplica(str(tmp_path / 'catalog.json'))
+    # The replica last saw the laptop sold out; Inventory has been restocked since.
+    replica.apply({"snapshot": True, "cursor": 1, "items": [{**LAPTOP, "count_in_stock": 0}],
+                   "deleted": [], "has_more": False})
+    previous = app.extensions.get('catalog')
+    app.extensions['catalog'] = replica
+    try:
+        assert get_catalog() is replica
+        intent = SaleIntent(customer_username='pia', item_name='Laptop', quantity=1, status='pending')
+        db.session.add(intent)
+        db.session.commit()
+        process_intent(intent, max_attempts=3)
+    finally:
+        app.extensions['catalog'] = previous
+
+    assert intent.status == 'completed'
+    mock_inventory.assert_called_once()
+
+
+def test_circuit_breaker_opens_then_probes_half_open():
+    from resilience import CircuitBreaker, CircuitOpenError
+
+    now = [0.0]
+    breaker = CircuitBreaker('inventory', minimum_calls=4, window_size=4, open_seconds=10,
+                             half_open_calls=1, clock=lambda: now[0])
+    for success in (True, False, False, True):
+        breaker.before_call()
+        breaker.record(success, 0.01)
+    assert breaker.state == 'open'
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    now[0] = 11
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()  # only one probe is let through
+    breaker.record(True, 0.01)
+    assert breaker.state == 'closed'
+
+
+def test_bulkhead_rejects_when_full():
+    from resilience import Bulkhead, BulkheadFullError
+
+    bulkhead = Bulkhead('customers', max_concurrent=1, max_wait=0)
+    bulkhead.acquire()
+    with pytest.raises(BulkheadFullError):
+        bulkhead.acquire()
+    bulkhead.release()
+    bulkhead.acquire()
+
+
+def test_concurrent_identical_gets_are_coalesced():
+    import threading
+    import time
+    from resilience import DependencyClient
+
+    client = DependencyClient('inventory', 'http://inventory')
+    calls = []
+
+    def slow_request(method, url, **kwargs):
+        calls.append(url)
+        time.sleep(0.05)
+        return _response(200, [LAPTOP])
+
+    client.session.request = slow_request
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.get('/inventory'))) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == ['http://inventory/inventory']
+    assert len(results) == 10 and all(r.json() == [LAPTOP] for r in results)
+
+    client.get('/inventory')
+    client.get('/inventory', params={'page': 2})
+    assert len(calls) == 3  # finished calls are not reused and different arguments are not merged
+
+def test_client_asks_for_and_decodes_msgpack():
+    msgpack = pytest.importorskip('msgpack')
+    from resilience import DependencyClient
+
+    client = DependencyClient('inventory', 'http://inventory')
+    assert client.session.headers['Accept'].startswith('application/msgpack')
+    client.session.request = lambda method, url, **kwargs: Mock(
+        status_code=200, headers={'Content-Type': 'application/msgpack'}, content=msgpack.packb([LAPTOP]))
+    assert client.get('/inventory').json() == [LAPTOP]
+
+def test_health_monitor_caches_probes_and_times_out_hanging_ones():
+    import threading
+    from health import HealthMonitor
+
+    release = threading.Event()
+    monitor = HealthMonitor(probe_timeout=0.1)
+    monitor.add_probe('database', lambda: None)
+    monitor.add_probe('inventory_service', release.wait, critical=False)
+    assert monitor.status('database') == 'Unknown'
+
+    results = monitor.run_once()
+    release.set()
+    assert results['database']['status'] == 'Healthy'
+    assert results['inventory_service']['status'].startswith('Unhealthy: timed out')
+    assert monitor.is_ready() and not monitor.is_healthy()
+
+
+def test_liveness_and_readiness_endpoints(test_client):
+    assert test_client.get('/health/live').status_code == 200
+
+    health = app.extensions['health']
+    health.run_once()
+    response = test_client.get('/health/ready')
+    assert response.status_code == 200
+    assert response.json['checks']['database']['status'] == 'Healthy'
+
+
+def test_archive_moves_old_purchases_and_history_reads_them_back(test_client, tmp_path):
+    from datetime import datetime, timedelta
+    from archive import archive_purchases
+    from models import Purchase
+
+    app.config['ARCHIVE_DIR'] = str(tmp_path)
+    old_date = datetime.utcnow() - timedelta(days=800)
+    Purchase.query.delete()
+    db.session.add_all([
+        Purchase(customer_username='pia', item_name='Laptop', quantity=1, total_price=1000.0, purchase_date=old_date),
+        Purchase(customer_username='pia', item_name='Mouse', quantity=2, total_price=40.0),
+    ])
+    db.session.commit()
+
+    assert archive_purchases(older_than_days=365) == 1
+    assert archive_purchases(older_than_days=365) == 0
+    assert Purchase.query.count() == 1
+
+    # Without ?since= the whole history is returned, archived purchases included.
+    response = test_client.get('/customers/pia/purchases')
+    assert [p['item_name'] for p in response.json] == ['Laptop', 'Mouse']
+
+    since = (old_date - timedelta(days=1)).date().isoformat()
+    response = test_client.get(f'/customers/pia/purchases?since={since}')
+    assert [p['item_name'] for p in response.json] == ['Laptop', 'Mouse']
+
+    response = test_client.get('/customers/pia/purchases/archive-summary')
+    assert response.json == [{"month": old_date.strftime('%Y-%m'), "customer_username": "pia",
+                              "purchase_count": 1, "quantity": 1, "total_spend": 1000.0}]
+
+    # Archived with a shorter cutoff than ARCHIVE_AFTER_DAYS: still found by a ?since= read.
+    recent_date = datetime.utcnow() - timedelta(days=100)
+    db.session.add(Purchase(customer_username='pia', item_name='Cable', quantity=1, total_price=5.0,
+                            purchase_date=recent_date))
+    db.session.commit()
+    assert archive_purchases(older_than_days=30) == 1
+    since = (recent_date - timedelta(days=1)).date().isoformat()
+    response = test_client.get(f'/customers/pia/purchases?since={since}')
+    assert [p['item_name'] for p in response.json] == ['Cable', 'Mouse']
+
+
+
+def test_purchase_summary_is_updated_with_each_purchase(test_client, tmp_path):
+    from types import SimpleNamespace
+    from archive import rebuild_purchase_summaries
+    from models import CustomerPurchaseSummary
+    from sharding import record_purchase
+
+    for intent_id, (item_name, quantity, total_price) in enumerate(
+            [("Laptop", 1, 100.0), ("Mouse", 2, 40.0), ("laptop", 1, 90.0)], start=1):
+        record_purchase(SimpleNamespace(id=intent_id, customer_username='pia', item_name=item_name,
+                                        quantity=quantity, total_price=total_price))
+    db.session.commit()
+
+    summary = test_client.get('/customers/pia/purchases/summary?item=LAPTOP').json
+    assert (summary['purchase_count'], summary['quantity'], summary['total_spend']) == (3, 4, 230.0)
+    assert summary['last_purchase_at'] is not None
+    assert summary['has_purchased'] is True
+    assert [(item['item_name'], item['purchase_count']) for item in summary['items']] == [("laptop", 2), ("Mouse", 1)]
+    assert test_client.get('/customers/pia/purchases/summary?item=Keyboard').json['has_purchased'] is False
+
+    batch = test_client.post('/customers/purchases/summary', json={"usernames": ["pia", "sam", "pia"]}).json
+    assert sorted(batch) == ["pia", "sam"]
+    assert batch['sam']['purchase_count'] == 0 and batch['sam']['items'] == []
+    assert test_client.post('/customers/purchases/summary', json={"usernames": []}).status_code == 400
+
+    eligibility = test_client.post('/purchases/eligibility', json={"pairs": [
+        {"customer_username": "pia", "item_name": "LAPTOP"},
+        {"customer_username": "pia", "item_name": "Laptop"},
+        {"customer_username": "pia", "item_name": "Keyboard"},
+        {"customer_username": "sam", "item_name": "Mouse"},
+    ]}).json['results']
+    assert [result['eligible'] for result in eligibility] == [True, True, False, False]
+    assert test_client.post('/purchases/eligibility', json={"pairs": [{"item_name": "Mouse"}]}).status_code == 400
+
+    CustomerPurchaseSummary.query.delete()
+    db.session.commit()
+    app.config['ARCHIVE_DIR'] = str(tmp_path)
+    assert rebuild_purchase_summaries() == 3
+    assert test_client.get('/customers/pia/purchases/summary').json['total_spend'] == 230.0
+
+def test_rebuilding_summaries_never_clears_them_or_counts_a_purchase_twice(test_client, monkeypatch):
+    from types import SimpleNamespace
+    import archive
+    from sharding import record_purchase
+
+    def sale(intent_id, item_name):
+        record_purchase(SimpleNamespace(id=intent_id, customer_username='quinn', item_name=item_name,
+                                        quantity=1, total_price=10.0))
+        db.session.commit()
+
+    sale(1, "Laptop")
+
+    def months_while_a_sale_lands():
+        # Readers still see the old summary while the rebuild is staging...
+        assert test_client.get('/customers/quinn/purchases/summary').json['purchase_count'] == 1
+        assert test_client.post('/purchases/eligibility', json={"pairs": [
+            {"customer_username": "quinn", "item_name": "Laptop"}]}).json['results'][0]['eligible'] is True
+        # ...and a purchase recorded before the swap is counted once.
+        sale(2, "Mouse")
+        return []
+
+    monkeypatch.setattr(archive, 'archived_months', months_while_a_sale_lands)
+    assert archive.rebuild_purchase_summaries() == 2
+    summary = test_client.get('/customers/quinn/purchases/summary').json
+    assert (summary['purchase_count'], summary['total_spend']) == (2, 20.0)
+    assert sorted(item['item_name'] for item in summary['items']) == ["Laptop", "Mouse"]
+
+def test_sharded_purchases_are_routed_by_customer_and_gathered(tmp_path):
+    from flask import Flask
+    from sqlalchemy import func, select
+    import sharding
+    from models import Purchase, SaleIntent
+
+    shard_app = Flask('sharded_sales')
+    shard_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    shard_app.config['SALES_SHARD_URIS'] = [f'sqlite:///{tmp_path}/shard0.db', f'sqlite:///{tmp_path}/shard1.db']
+    sharding.configure_shards(shard_app)
+    db.init_app(shard_app)
+
+    with shard_app.app_context():
+        db.create_all()
+        sharding.ensure_shard_tables()
+        for sale_id, username in enumerate(['pia', 'sam', 'lea', 'tom'], start=1):
+            intent = SaleIntent(id=sale_id, customer_username=username, item_name='Laptop', quantity=1, total_price=10.0)
+            assert sharding.record_purchase(intent) == sale_id
+        # Replaying a sale (e.g. after a crash) must not duplicate its purchase.
+        sharding.record_purchase(SaleIntent(id=1, customer_username='pia', item_name='Laptop', quantity=1, total_price=10.0))
+
+        assert [p.purchase_id for p in sharding.all_purchases()] == [1, 2, 3, 4]
+        assert [p.purchase_id for p in sharding.purchases_after(2, 1)] == [3]
+        assert [p.customer_username for p in sharding.purchases_for_customer('sam')] == ['sam']
+        rows = 0
+        for engine in sharding.shard_engines():
+            with engine.connect() as conn:
+                rows += conn.execute(select(func.count()).select_from(Purchase.__table__)).scalar()
+        assert rows == 4
+
+
+        # A rebuild swaps each shard's summaries in from its own purchases only.
+        from archive import rebuild_purchase_summaries
+        shard_app.config['ARCHIVE_DIR'] = str(tmp_path / 'archive')
+        assert rebuild_purchase_summaries() == 4
+        summaries = sharding.purchase_summaries(['pia', 'sam', 'lea', 'tom'])
+        assert [summaries[username][0].purchase_count for username in ['pia', 'sam', 'lea', 'tom']] == [1, 1, 1, 1]
@@ -0,0 +1,80 @@
+"""Compare JSON and MessagePack on the payloads Sales pulls from Inventory and Customers.
+
+    python benchmarks/bench_serialization.py [--items 5000] [--purchases 20000] [--rounds 20]
+"""
+import argparse
+import gzip
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+import msgpack
+
+CATEGORIES = ['food', 'clothes', 'accessories', 'electronics']
+
+
+def catalog(count):
+    rng = random.Random(42)
+    return [{
+        'name': f'item-{i:06d}',
+        'category': rng.choice(CATEGORIES),
+        'price_per_item': round(rng.uniform(1, 2000), 2),
+        'description': f'Description of item {i} ' * rng.randint(1, 4),
+        'count_in_stock': rng.randint(0, 500),
+    } for i in range(count)]
+
+
+def purchase_history(count):
+    rng = random.Random(7)
+    start = datetime(2023, 1, 1)
+    return [{
+        'purchase_id': i,
+        'customer_username': f'customer-{rng.randint(1, 200)}',
+        'item_name': f'item-{rng.randint(0, 4999):06d}',
+        'quantity': rng.randint(1, 5),
+        'total_price': round(rng.uniform(1, 5000), 2),
+        'purchase_date': (start + timedelta(minutes=i)).isoformat(),
+    } for i in range(count)]
+
+
+def _best(fn, rounds):
+    best = float('inf')
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def compare(name, payload, rounds):
+    encoded_json = json.dumps(payload).encode('utf-8')
+    encoded_msgpack = msgpack.packb(payload)
+    assert msgpack.unpackb(encoded_msgpack) == json.loads(encoded_json)
+
+    rows = [
+        ('json', len(encoded_json), len(gzip.compress(encoded_json)),
+         _best(lambda: json.dumps(payload).encode('utf-8'), rounds), _best(lambda: json.loads(encoded_json), rounds)),
+        ('msgpack', len(encoded_msgpack), len(gzip.compress(encoded_msgpack)),
+         _best(lambda: msgpack.packb(payload), rounds), _best(lambda: msgpack.unpackb(encoded_msgpack), rounds)),
+    ]
+    print(f'\n{name} ({len(payload)} records)')
+    print(f"{'format':<10}{'bytes':>12}{'gzip bytes':>12}{'encode ms':>12}{'decode ms':>12}")
+    for fmt, size, gzipped, encode, decode in rows:
+        print(f'{fmt:<10}{size:>12}{gzipped:>12}{encode:>12.2f}{decode:>12.2f}')
+    (_, js, _, je, jd), (_, ms, _, me, md) = rows
+    print(f'msgpack: {100 * (1 - ms / js):.0f}% smaller, encode {je / me:.1f}x, decode {jd / md:.1f}x')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=5000)
+    parser.add_argument('--purchases', type=int, default=20000)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+    compare('Catalog (GET /inventory)', catalog(args.items), args.rounds)
+    compare('Purchase history', purchase_history(args.purchases), args.rounds)
+
+
+if __name__ == '__main__':
+    main()